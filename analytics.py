@@ -0,0 +1,385 @@
+"""
+Historical Q analytics
+Leaderboards over the full signup history, served from snapshot tables
+
+A Q's identity is resolved through normalized aliases: their email
+(lowercased) when given, otherwise their name (lowercased, trimmed). Triggers
+queue every name/email whose signups change; refresh() drains that queue and
+recomputes only the affected identities, so leaderboard reads never scan
+q_signups. History is read through q_signups_all, so archived signups count.
+Only Qs up to today count (booked slots can still be cancelled); refresh()
+re-queues the Qs whose booked dates have passed since the previous refresh.
+
+Usage:
+    python analytics.py            # Process queued changes
+    python analytics.py --full     # Rebuild every identity from scratch
+"""
+import sys
+from datetime import date, datetime, timedelta
+
+from config import get_config
+from database import db_transaction, region_names, use_region
+import leases
+import writer
+
+config = get_config()
+
+REFRESH_BATCH_SIZE = 500
+ANALYTICS_LEASE = 'analytics'
+ANALYTICS_LEASE_SECONDS = 600
+
+
+# ==================== IDENTITY ====================
+
+def normalize_name(name):
+    """Normalize a Q name the same way the SQL triggers do"""
+    return (name or '').strip().lower() or None
+
+
+def normalize_email(email):
+    """Normalize an email the same way the SQL triggers do"""
+    return (email or '').strip().lower() or None
+
+
+def _alias_owner(conn, alias):
+    row = conn.execute(
+        'SELECT identity_id FROM q_identity_aliases WHERE alias = ?',
+        (alias,)
+    ).fetchone()
+    return row['identity_id'] if row else None
+
+
+def _add_alias(conn, alias, identity_id):
+    conn.execute(
+        'INSERT OR IGNORE INTO q_identity_aliases (alias, identity_id) VALUES (?, ?)',
+        (alias, identity_id)
+    )
+
+
+def _today():
+    return date.today().strftime('%Y-%m-%d')
+
+
+def _resolve_identity(conn, name_key, email_key):
+    """
+    Find (or create) the identity for a name/email pair
+    Email wins over name. Existing identities are never merged.
+    """
+    name_alias = f'name:{name_key}' if name_key else None
+    email_alias = f'email:{email_key}' if email_key else None
+
+    identity_id = None
+    if email_alias:
+        identity_id = _alias_owner(conn, email_alias)
+    if identity_id is None and name_alias:
+        identity_id = _alias_owner(conn, name_alias)
+
+    if identity_id is None:
+        # Only create identities for pairs that have Q'd (not just booked)
+        exists = conn.execute(
+            '''SELECT 1 FROM q_signups_all
+               WHERE (lower(trim(q_name)) = ? OR lower(trim(q_email)) = ?)
+                 AND date <= ?
+               LIMIT 1''',
+            (name_key, email_key, _today())
+        ).fetchone()
+        if not exists:
+            return None
+        identity_id = conn.execute(
+            'INSERT INTO q_identities (display_name) VALUES (?)',
+            (name_key or email_key,)
+        ).lastrowid
+
+    for alias in (email_alias, name_alias):
+        if alias:
+            _add_alias(conn, alias, identity_id)
+
+    return identity_id
+
+
+def _longest_streak(dates):
+    """Longest run of consecutive ISO weeks containing at least one Q"""
+    weeks = sorted({d - timedelta(days=d.weekday()) for d in dates})
+    longest = current = 0
+    previous = None
+    for week in weeks:
+        current = current + 1 if previous and week - previous == timedelta(weeks=1) else 1
+        longest = max(longest, current)
+        previous = week
+    return longest
+
+
+def _recompute_identity(conn, identity_id):
+    """Recompute one identity's snapshot rows from its signups up to today"""
+    aliases = [row['alias'] for row in conn.execute(
+        'SELECT alias FROM q_identity_aliases WHERE identity_id = ?',
+        (identity_id,)
+    )]
+    names = [a[5:] for a in aliases if a.startswith('name:')]
+    emails = [a[6:] for a in aliases if a.startswith('email:')]
+
+    clauses, params = [], []
+    if names:
+        clauses.append(f"lower(trim(s.q_name)) IN ({','.join('?' * len(names))})")
+        params += names
+    if emails:
+        clauses.append(f"lower(trim(s.q_email)) IN ({','.join('?' * len(emails))})")
+        params += emails
+
+    candidates = conn.execute(
+        f'''SELECT s.date, s.q_name, s.q_email, s.created_at, w.location_id
+            FROM q_signups_all s
+            JOIN workouts w ON s.workout_id = w.id
+            WHERE ({' OR '.join(clauses)}) AND s.date <= ?
+            ORDER BY s.date''',
+        params + [_today()]
+    ).fetchall() if clauses else []
+
+    # A signup belongs to the owner of its email alias when it has one
+    signups = []
+    for s in candidates:
+        email_key = normalize_email(s['q_email'])
+        owner = _alias_owner(conn, f'email:{email_key}') if email_key else None
+        if owner is None:
+            owner = _alias_owner(conn, f"name:{normalize_name(s['q_name'])}")
+        if owner == identity_id:
+            signups.append(s)
+
+    conn.execute('DELETE FROM q_identity_locations WHERE identity_id = ?', (identity_id,))
+
+    if not signups:
+        conn.execute('DELETE FROM q_identities WHERE id = ?', (identity_id,))
+        return
+
+    dates = [datetime.strptime(s['date'], '%Y-%m-%d').date() for s in signups]
+    latest = max(signups, key=lambda s: (s['created_at'] or '', s['date']))
+    email = next((s['q_email'] for s in sorted(signups, key=lambda s: s['created_at'] or '',
+                                               reverse=True) if s['q_email']), None)
+
+    conn.execute(
+        '''UPDATE q_identities
+           SET display_name = ?, email = ?, total_qs = ?, first_q_date = ?,
+               last_q_date = ?, longest_streak = ?, refreshed_at = CURRENT_TIMESTAMP
+           WHERE id = ?''',
+        (latest['q_name'].strip(), email, len(signups), signups[0]['date'],
+         signups[-1]['date'], _longest_streak(dates), identity_id)
+    )
+
+    per_location = {}
+    for s in signups:
+        count, _ = per_location.get(s['location_id'], (0, None))
+        per_location[s['location_id']] = (count + 1, s['date'])
+    conn.executemany(
+        '''INSERT INTO q_identity_locations (identity_id, location_id, q_count, last_q_date)
+           VALUES (?, ?, ?, ?)''',
+        [(identity_id, location_id, count, last) for location_id, (count, last)
+         in per_location.items()]
+    )
+
+
+# ==================== REFRESH ====================
+
+def _queue_passed_signups(conn):
+    """
+    Queue the Qs whose signups have moved into the past since the last refresh
+    The first time (no analytics_through setting yet) every Q with a future
+    signup is queued, so snapshots that counted booked slots are corrected.
+    """
+    today = _today()
+    row = conn.execute("SELECT value FROM settings WHERE key = 'analytics_through'").fetchone()
+    through = row['value'] if row else None
+    if through == today:
+        return
+    if through is None:
+        where, params = 'date > ?', (today,)
+    else:
+        where, params = 'date > ? AND date <= ?', (through, today)
+    conn.execute(
+        f'''INSERT INTO q_analytics_queue (name_key, email_key)
+            SELECT DISTINCT lower(trim(q_name)), lower(trim(q_email))
+            FROM q_signups_all WHERE {where}''',
+        params
+    )
+    conn.execute(
+        '''INSERT INTO settings (key, value, description)
+           VALUES ('analytics_through', ?, 'Q analytics count signups up to this date')
+           ON CONFLICT(key) DO UPDATE SET value = excluded.value''',
+        (today,)
+    )
+
+
+def _refresh_batch(conn, batch_size, queue_passed):
+    """Refresh the Qs of the next queued batch; returns how many (None when the queue is empty)"""
+    if queue_passed:
+        _queue_passed_signups(conn)
+    rows = conn.execute(
+        'SELECT id, name_key, email_key FROM q_analytics_queue ORDER BY id LIMIT ?',
+        (batch_size,)
+    ).fetchall()
+    if not rows:
+        return None
+
+    dirty = set()
+    for row in rows:
+        # A deleted signup may leave its old identity to shrink or vanish
+        for alias in (f"email:{row['email_key']}", f"name:{row['name_key']}"):
+            owner = _alias_owner(conn, alias)
+            if owner is not None:
+                dirty.add(owner)
+        identity_id = _resolve_identity(conn, row['name_key'], row['email_key'])
+        if identity_id is not None:
+            dirty.add(identity_id)
+
+    for identity_id in dirty:
+        _recompute_identity(conn, identity_id)
+
+    conn.execute('DELETE FROM q_analytics_queue WHERE id <= ?', (rows[-1]['id'],))
+    return len(dirty)
+
+
+def refresh(batch_size=REFRESH_BATCH_SIZE):
+    """
+    Drain the analytics queue for the current region
+    Each batch is one short write through the write queue. Returns identities refreshed.
+    """
+    refreshed = 0
+    first = True
+    while True:
+        count = writer.execute(_refresh_batch, batch_size, first)
+        first = False
+        if count is None:
+            return refreshed
+        refreshed += count
+
+
+def rebuild():
+    """Throw away every snapshot and queue the whole history for refresh"""
+    def write(conn):
+        conn.execute('DELETE FROM q_identity_locations')
+        conn.execute('DELETE FROM q_identity_aliases')
+        conn.execute('DELETE FROM q_identities')
+        conn.execute('DELETE FROM q_analytics_queue')
+        conn.execute(
+            '''INSERT INTO q_analytics_queue (name_key, email_key)
+               SELECT DISTINCT lower(trim(q_name)), lower(trim(q_email)) FROM q_signups_all'''
+        )
+    writer.execute(write)
+    return refresh()
+
+
+def run_scheduled_refresh():
+    """Timer entry point: drain the queue unless another worker or container is (then None)"""
+    if not leases.acquire(ANALYTICS_LEASE, ANALYTICS_LEASE_SECONDS):
+        return None
+    refreshed = None
+    try:
+        refreshed = refresh()
+    finally:
+        leases.release(ANALYTICS_LEASE, refreshed)
+    return refreshed
+
+
+def refresh_all_regions():
+    """Drain the analytics queue of every region (used by the background timer)"""
+    results = {}
+    for region in region_names():
+        with use_region(region):
+            results[region] = run_scheduled_refresh()
+    return results
+
+
+# ==================== LEADERBOARDS ====================
+
+def get_top_qs(limit=10):
+    """PAX with the most Qs"""
+    with db_transaction() as conn:
+        return conn.execute(
+            '''SELECT id, display_name, total_qs, first_q_date, last_q_date
+               FROM q_identities
+               ORDER BY total_qs DESC, display_name
+               LIMIT ?''',
+            (limit,)
+        ).fetchall()
+
+
+def get_longest_streaks(limit=10):
+    """PAX with the longest runs of consecutive weeks Q'ing"""
+    with db_transaction() as conn:
+        return conn.execute(
+            '''SELECT id, display_name, longest_streak, total_qs
+               FROM q_identities
+               ORDER BY longest_streak DESC, total_qs DESC
+               LIMIT ?''',
+            (limit,)
+        ).fetchall()
+
+
+def get_ao_regulars(location_id=None, limit=3):
+    """Most frequent Qs per AO (or for a single AO)"""
+    with db_transaction() as conn:
+        if location_id is not None:
+            return conn.execute(
+                '''SELECT il.location_id, l.name as location_name, i.display_name,
+                          il.q_count, il.last_q_date
+                   FROM q_identity_locations il
+                   JOIN q_identities i ON il.identity_id = i.id
+                   JOIN locations l ON il.location_id = l.id
+                   WHERE il.location_id = ?
+                   ORDER BY il.q_count DESC, i.display_name
+                   LIMIT ?''',
+                (location_id, limit)
+            ).fetchall()
+
+        return conn.execute(
+            '''SELECT location_id, location_name, display_name, q_count, last_q_date
+               FROM (
+                   SELECT il.location_id, l.name as location_name, i.display_name,
+                          il.q_count, il.last_q_date,
+                          ROW_NUMBER() OVER (
+                              PARTITION BY il.location_id
+                              ORDER BY il.q_count DESC, i.display_name
+                          ) as rank
+                   FROM q_identity_locations il
+                   JOIN q_identities i ON il.identity_id = i.id
+                   JOIN locations l ON il.location_id = l.id
+                   WHERE l.active = 1
+               )
+               WHERE rank <= ?
+               ORDER BY location_name, q_count DESC''',
+            (limit,)
+        ).fetchall()
+
+
+def get_first_time_qs_by_month(months=12):
+    """Number of first-time Qs (FNG Qs) per month"""
+    start = date.today().replace(day=1)
+    for _ in range(months - 1):
+        start = (start - timedelta(days=1)).replace(day=1)
+
+    with db_transaction() as conn:
+        return conn.execute(
+            '''SELECT substr(first_q_date, 1, 7) as month, COUNT(*) as first_timers
+               FROM q_identities
+               WHERE first_q_date >= ?
+               GROUP BY month
+               ORDER BY month''',
+            (start.strftime('%Y-%m-%d'),)
+        ).fetchall()
+
+
+def get_leaderboards(limit=10):
+    """All leaderboards in one structure (no emails, safe for the public API)"""
+    return {
+        'top_qs': [dict(r) for r in get_top_qs(limit)],
+        'longest_streaks': [dict(r) for r in get_longest_streaks(limit)],
+        'ao_regulars': [dict(r) for r in get_ao_regulars(limit=3)],
+        'first_time_qs': [dict(r) for r in get_first_time_qs_by_month()],
+    }
+
+
+if __name__ == '__main__':
+    full = '--full' in sys.argv[1:]
+    for region in region_names():
+        with use_region(region):
+            count = rebuild() if full else refresh()
+        print(f"{region}: refreshed {count} Q identities")
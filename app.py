@@ -2,63 +2,217 @@
 F3 Q-Sheet - Fast, Simple Workout Sign-Up Application
 Main Flask application with routes
 """
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import (Flask, Response, render_template, request, jsonify, redirect, url_for,
+                   session, flash, g, send_file)
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime, date, timedelta
 from functools import wraps
+import math
 import os
+import re
+import sqlite3
 
 from config import get_config
-from database import init_db, get_setting, set_setting
+from database import (init_db, database_exists, region_names, default_region,
+                      get_current_region, set_current_region, reset_current_region)
 import models
+import records
+import auth
+import backup
+from migrations import check_schema
+import analytics
+import archive
+import background
+import email_notifications
+import health
+import maintenance
+import profiling
+
+
+# ==================== REGION ROUTING ====================
+
+class RegionMiddleware:
+    """
+    Pick the region for a request by URL prefix (/cobb/...) or subdomain
+    (cobb.example.com). With prefix routing the prefix is moved into
+    SCRIPT_NAME so routes and url_for work unchanged.
+    """
+
+    def __init__(self, wsgi_app, mode='prefix'):
+        self.wsgi_app = wsgi_app
+        self.mode = mode
+
+    def __call__(self, environ, start_response):
+        self.route(environ)
+        return self.wsgi_app(environ, start_response)
+
+    def route(self, environ):
+        """Resolve a WSGI environ's region in place (also used by the ASGI app)"""
+        regions = region_names()
+        region = None
+
+        if self.mode == 'subdomain':
+            host = environ.get('HTTP_HOST', '').split(':')[0]
+            label = host.split('.')[0].lower()
+            if label in regions:
+                region = label
+        else:
+            path = environ.get('PATH_INFO', '')
+            first, _, rest = path.lstrip('/').partition('/')
+            if first.lower() in regions:
+                region = first.lower()
+                environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + '/' + first
+                environ['PATH_INFO'] = '/' + rest
+
+        environ['qsheet.region'] = region or default_region()
+        return environ['qsheet.region']
+
 
 # Initialize Flask app
 app = Flask(__name__)
 config = get_config()
 app.config.from_object(config)
-
-# Initialize database on first run
-if not os.path.exists(config.DATABASE_PATH):
-    init_db()
+region_router = RegionMiddleware(app.wsgi_app, config.REGION_ROUTING)
+app.wsgi_app = region_router
+if config.PROXY_FIX_X_FOR > 0:
+    # Behind a reverse proxy: take the client address (used by the login
+    # limiter) from that many trusted X-Forwarded-For hops
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.PROXY_FIX_X_FOR)
+
+# Initialize (or clone) databases on first run, bring existing ones up to date
+# (AUTO_MIGRATE), and refuse to serve an outdated schema
+for region in region_names():
+    if not database_exists(region) or config.AUTO_MIGRATE:
+        init_db(region)
+    check_schema(region)
+
+
+def start_background_tasks():
+    """Start this process's periodic tasks (once, on the first request)"""
+    if config.ANALYTICS_REFRESH_SECONDS > 0:
+        background.start_periodic('analytics', config.ANALYTICS_REFRESH_SECONDS,
+                                  analytics.refresh_all_regions, initial_delay=5)
+    if config.ARCHIVE_INTERVAL_SECONDS > 0:
+        background.start_periodic('archive', config.ARCHIVE_INTERVAL_SECONDS,
+                                  archive.archive_all_regions)
+    if config.MAINTENANCE_INTERVAL_SECONDS > 0:
+        background.start_periodic('maintenance', config.MAINTENANCE_INTERVAL_SECONDS,
+                                  maintenance.run_all_regions)
+    if config.REMINDER_INTERVAL_SECONDS > 0:
+        background.start_periodic('reminders', config.REMINDER_INTERVAL_SECONDS,
+                                  email_notifications.sweep_all_regions, initial_delay=30)
+    if config.DIGEST_INTERVAL_SECONDS > 0:
+        background.start_periodic('digest', config.DIGEST_INTERVAL_SECONDS,
+                                  email_notifications.digest_all_regions, initial_delay=60)
+    if config.BACKUP_INTERVAL_SECONDS > 0:
+        background.start_periodic('backup', config.BACKUP_INTERVAL_SECONDS,
+                                  backup.backup_all_regions, initial_delay=120)
+
+
+@app.before_request
+def ensure_background_tasks():
+    """Lazily start background tasks so CLI imports of app stay passive"""
+    if not app.config.get('BACKGROUND_STARTED'):
+        app.config['BACKGROUND_STARTED'] = True
+        start_background_tasks()
+
+
+@app.before_request
+def bind_region():
+    """Bind the routed region's shard for the duration of the request"""
+    g.region = request.environ.get('qsheet.region') or default_region()
+    g.region_token = set_current_region(g.region)
+
+
+@app.before_request
+def start_profiling():
+    """Profile this request if the region's admin asked for it (?_profile=1 or X-Profile: 1)"""
+    if (profiling.requested(request) and session.get('admin_logged_in')
+            and session.get('admin_region') == g.region):
+        g.profile = profiling.RequestProfile()
+
+
+@app.after_request
+def finish_profiling(response):
+    """Save the request's profile and point to it in an X-Profile-Id header"""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        name = profile.finish(g.region, request.method, request.full_path, response.status_code)
+        response.headers['X-Profile-Id'] = name
+    return response
+
+
+@app.teardown_request
+def unbind_region(exc=None):
+    """Release the request's region binding"""
+    profile = g.pop('profile', None)
+    if profile is not None:  # The view raised before after_request ran
+        profile.finish(g.region, request.method, request.full_path, 500)
+    token = g.pop('region_token', None)
+    if token is not None:
+        reset_current_region(token)
 
 
 # ==================== AUTHENTICATION ====================
 
 def check_signup_password(password):
     """Check if signup password is correct"""
-    stored = get_setting('signup_password', config.SIGNUP_PASSWORD)
-    return password == stored
+    return auth.check_password('signup', password)
 
 
 def check_admin_password(password):
     """Check if admin password is correct"""
-    stored = get_setting('admin_password', config.ADMIN_PASSWORD)
-    return password == stored
+    return auth.check_password('admin', password)
+
+
+def verify_signup(password, token=None):
+    """
+    Authorize a signup by token or password
+    Returns (error, status, new_token): error is None when the signup may go
+    ahead, and new_token is set when the password was just checked.
+    """
+    token = token or session.get('signup_token')
+    if auth.check_signup_token(token):
+        return None, 200, None
+    if not auth.allow_attempt('signup', request.remote_addr):
+        return "Too many attempts, please wait a minute", 429, None
+    if not check_signup_password(password):
+        return "Invalid password", 401, None
+    auth.refund_attempt('signup', request.remote_addr)
+    token = auth.issue_signup_token()
+    session['signup_token'] = token
+    return None, 200, token
 
 
 def login_required(f):
     """Decorator to require admin login"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not session.get('admin_logged_in'):
+        if (not session.get('admin_logged_in')
+                or session.get('admin_region') != get_current_region()):
             return redirect(url_for('admin_login', next=request.url))
         return f(*args, **kwargs)
     return decorated_function
 
 
-# ==================== PUBLIC ROUTES ====================
+# ==================== SCHEDULE HELPERS ====================
 
-@app.route('/')
-def index():
-    """Homepage with weekly schedule view"""
-    # Get current week (Monday to Sunday)
+def get_week_bounds(offset=0):
+    """Get (today, monday, sunday) for a week offset from the current week"""
     today = date.today()
     # Find Monday of current week
-    days_since_monday = today.weekday()
-    monday = today - timedelta(days=days_since_monday)
+    base_monday = today - timedelta(days=today.weekday())
+    monday = base_monday + timedelta(weeks=offset)
     sunday = monday + timedelta(days=6)
+    return today, monday, sunday
+
 
-    # Get all workouts and signups for the week
-    workouts = models.get_all_workouts(active_only=True)
+def build_week_schedule(monday):
+    """Build the day-by-day schedule (workouts + signups) for one week"""
+    sunday = monday + timedelta(days=6)
+
+    # Workouts come from the cached catalog; only the week's signups are queried
+    workouts_by_day = models.get_workouts_by_day()
     signups = models.get_signups_for_date_range(
         monday.strftime('%Y-%m-%d'),
         sunday.strftime('%Y-%m-%d')
@@ -69,84 +223,109 @@ def index():
         (s['workout_id'], s['date']): s for s in signups
     }
 
-    # Organize workouts by day and time
+    # Each day's workouts, already sorted by time
     schedule = {}
     for i in range(7):
         day = monday + timedelta(days=i)
         db_day = (day.weekday() + 1) % 7  # Convert to our format (Sun=0)
-        schedule[day.strftime('%Y-%m-%d')] = {
+        day_str = day.strftime('%Y-%m-%d')
+        schedule[day_str] = {
             'date': day,
             'day_name': models.get_day_name(db_day),
-            'workouts': []
+            'workouts': [
+                records.Slot(workout, signup_lookup.get((workout.id, day_str)), day_str)
+                for workout in workouts_by_day.get(db_day, [])
+            ]
         }
 
-    # Add workouts to schedule
-    for workout in workouts:
-        for day_str in schedule:
-            day = schedule[day_str]['date']
-            db_day = (day.weekday() + 1) % 7
-            if workout['day_of_week'] == db_day:
-                signup = signup_lookup.get((workout['id'], day_str))
-                schedule[day_str]['workouts'].append({
-                    'workout': workout,
-                    'signup': signup,
-                    'date': day_str
-                })
-
-    # Sort workouts by time within each day
-    for day_str in schedule:
-        schedule[day_str]['workouts'].sort(key=lambda x: x['workout']['time'])
+    return schedule
+
+
+def build_week_json(offset):
+    """One week's schedule as plain JSON data"""
+    today, monday, sunday = get_week_bounds(offset)
+    schedule = build_week_schedule(monday)
+
+    days = []
+    for day_str, day in schedule.items():
+        days.append({
+            'date': day_str,
+            'day_name': day['day_name'],
+            'workouts': [{
+                'workout_id': item['workout']['id'],
+                'time': item['workout']['time'],
+                'workout_type': item['workout']['workout_type'],
+                'location_id': item['workout']['location_id'],
+                'location_name': item['workout']['location_name'],
+                'address': item['workout']['address'],
+                'q_name': item['signup']['q_name'] if item['signup'] else None
+            } for item in day['workouts']]
+        })
+
+    return {
+        'monday': monday.strftime('%Y-%m-%d'),
+        'sunday': sunday.strftime('%Y-%m-%d'),
+        'days': days
+    }
 
-    return render_template('index.html',
-                         schedule=schedule,
-                         monday=monday,
-                         sunday=sunday,
-                         today=today)
 
+def get_location_schedule(location_id):
+    """A location with its workouts and the next 4 weeks of signups (None if missing)"""
+    location = models.get_location(location_id)
+    if not location:
+        return None
 
-@app.route('/schedule/week/<int:offset>')
-def week_schedule(offset):
-    """View schedule for a specific week offset from current week"""
+    workouts = models.get_workouts_by_location(location_id, active_only=True)
+
+    # Get next 4 weeks of signups
     today = date.today()
-    days_since_monday = today.weekday()
-    base_monday = today - timedelta(days=days_since_monday)
-    monday = base_monday + timedelta(weeks=offset)
-    sunday = monday + timedelta(days=6)
+    end_date = today + timedelta(days=28)
 
-    workouts = models.get_all_workouts(active_only=True)
     signups = models.get_signups_for_date_range(
-        monday.strftime('%Y-%m-%d'),
-        sunday.strftime('%Y-%m-%d')
+        today.strftime('%Y-%m-%d'),
+        end_date.strftime('%Y-%m-%d')
     )
 
-    signup_lookup = {
-        (s['workout_id'], s['date']): s for s in signups
+    # Organize by workout
+    workout_signups = {}
+    for signup in signups:
+        if signup['workout_id'] not in workout_signups:
+            workout_signups[signup['workout_id']] = []
+        workout_signups[signup['workout_id']].append(signup)
+
+    return {
+        'location': location,
+        'workouts': workouts,
+        'workout_signups': workout_signups,
     }
 
-    schedule = {}
-    for i in range(7):
-        day = monday + timedelta(days=i)
-        db_day = (day.weekday() + 1) % 7
-        schedule[day.strftime('%Y-%m-%d')] = {
-            'date': day,
-            'day_name': models.get_day_name(db_day),
-            'workouts': []
-        }
 
-    for workout in workouts:
-        for day_str in schedule:
-            day = schedule[day_str]['date']
-            db_day = (day.weekday() + 1) % 7
-            if workout['day_of_week'] == db_day:
-                signup = signup_lookup.get((workout['id'], day_str))
-                schedule[day_str]['workouts'].append({
-                    'workout': workout,
-                    'signup': signup,
-                    'date': day_str
-                })
-
-    for day_str in schedule:
-        schedule[day_str]['workouts'].sort(key=lambda x: x['workout']['time'])
+@app.context_processor
+def inject_now():
+    """Make now() available to templates (used in the footer)"""
+    return {'now': datetime.now}
+
+
+# ==================== PUBLIC ROUTES ====================
+
+@app.route('/')
+def index():
+    """Homepage with weekly schedule view"""
+    today, monday, sunday = get_week_bounds()
+    schedule = build_week_schedule(monday)
+
+    return render_template('index.html',
+                         schedule=schedule,
+                         monday=monday,
+                         sunday=sunday,
+                         today=today)
+
+
+@app.route('/schedule/week/<int(signed=True):offset>')
+def week_schedule(offset):
+    """View schedule for a specific week offset from current week"""
+    today, monday, sunday = get_week_bounds(offset)
+    schedule = build_week_schedule(monday)
 
     return render_template('week_schedule.html',
                          schedule=schedule,
@@ -171,13 +350,14 @@ def signup(workout_id, date_str):
         q_email = request.form.get('q_email', '').strip() or None
         notes = request.form.get('notes', '').strip() or None
 
-        # Validate password
-        if not check_signup_password(password):
+        # Validate password (skipped while the session holds a signup token)
+        error, _, _ = verify_signup(password)
+        if error:
             return render_template('signup.html',
                                  workout=workout,
                                  date_str=date_str,
                                  existing=existing,
-                                 error="Invalid password")
+                                 error=error)
 
         # Validate Q name
         if not q_name:
@@ -185,6 +365,7 @@ def signup(workout_id, date_str):
                                  workout=workout,
                                  date_str=date_str,
                                  existing=existing,
+                                 verified=True,
                                  error="Please enter your name")
 
         # Check if slot is already taken
@@ -193,10 +374,17 @@ def signup(workout_id, date_str):
                                  workout=workout,
                                  date_str=date_str,
                                  existing=existing,
+                                 verified=True,
                                  error="This slot is already taken")
 
-        # Create signup
-        models.create_signup(workout_id, date_str, q_name, q_email, notes)
+        # Create signup (None when someone else got the slot in the meantime)
+        if models.create_signup(workout_id, date_str, q_name, q_email, notes) is None:
+            return render_template('signup.html',
+                                 workout=workout,
+                                 date_str=date_str,
+                                 existing=models.get_signup_for_workout_date(workout_id, date_str),
+                                 verified=True,
+                                 error="This slot is already taken")
 
         return render_template('signup_success.html',
                              workout=workout,
@@ -206,7 +394,8 @@ def signup(workout_id, date_str):
     return render_template('signup.html',
                          workout=workout,
                          date_str=date_str,
-                         existing=existing)
+                         existing=existing,
+                         verified=auth.check_signup_token(session.get('signup_token')))
 
 
 @app.route('/locations')
@@ -219,32 +408,149 @@ def locations():
 @app.route('/location/<int:location_id>')
 def location_detail(location_id):
     """View a specific location's schedule"""
-    location = models.get_location(location_id)
-    if not location:
+    data = get_location_schedule(location_id)
+    if not data:
         return "Location not found", 404
 
-    workouts = models.get_workouts_by_location(location_id, active_only=True)
-
-    # Get next 4 weeks of signups
+    return render_template('location_detail.html', **data)
+
+
+def parse_page_key(value):
+    """(date, workout_id) keyset cursor from an ?after= value like 2024-01-15.3"""
+    try:
+        day, workout_id = (value or '').split('.', 1)
+        datetime.strptime(day, '%Y-%m-%d')
+        return day, int(workout_id)
+    except ValueError:
+        return None
+
+
+def format_page_key(key):
+    return f'{key[0]}.{key[1]}' if key else None
+
+
+def find_my_qs(args):
+    """Search context for the "find my Qs" page: upcoming signups by Q name, one page"""
+    name = args.get('name', '').strip()[:100]
+    signups, next_key = [], None
+    if name:
+        signups, next_key = models.search_signups(
+            name, date.today().strftime('%Y-%m-%d'),
+            after=parse_page_key(args.get('after')), name_only=True
+        )
+    return {'name': name, 'signups': signups, 'next_after': format_page_key(next_key)}
+
+
+NEARBY_MAX_RESULTS = 50
+NEARBY_MAX_ROUNDS = 10  # Doublings from 1 km reach NEARBY_MAX_RADIUS_KM within this many
+
+
+def find_nearby(args):
+    """
+    Next occurrence of the workouts closest to ?lat=&lon= (this week), with their Q or an open slot
+    Optional: radius_km (a hard bound unless expand=1 lets it double until limit
+    results match), day (0=Sunday), time_from / time_to (HH:MM), open_only, limit.
+    Returns the context for the page and API; 'error' is set for bad coordinates,
+    'searched_km' is the radius actually searched.
+    """
+    lat = args.get('lat', type=float)
+    lon = args.get('lon', type=float)
+    radius_km = args.get('radius_km', models.NEARBY_RADIUS_KM, type=float)
+    day = args.get('day', type=int)
+    time_from = args.get('time_from', '')
+    time_to = args.get('time_to', '')
+    context = {
+        'lat': lat, 'lon': lon,
+        # float() accepts 'nan' and 'inf', which no clamp can bound
+        'radius_km': (min(max(radius_km, 1), models.NEARBY_MAX_RADIUS_KM)
+                      if math.isfinite(radius_km) else models.NEARBY_RADIUS_KM),
+        'day': day if day in range(7) else None,
+        'time_from': time_from if re.fullmatch(r'\d\d:\d\d', time_from) else None,
+        'time_to': time_to if re.fullmatch(r'\d\d:\d\d', time_to) else None,
+        'open_only': args.get('open_only', '') in ('1', 'true', 'on'),
+        'expand': args.get('expand', '') in ('1', 'true', 'on'),
+        'results': [],
+        'error': None,
+    }
+    context['searched_km'] = context['radius_km']
+    context['expanded'] = False
+    if lat is None or lon is None:
+        context['error'] = 'lat and lon are required'
+        return context
+    if not (math.isfinite(lat) and math.isfinite(lon)
+            and -90 <= lat <= 90 and -180 <= lon <= 180):
+        context['error'] = 'lat/lon out of range'
+        return context
+    if not math.isfinite(radius_km):
+        context['error'] = 'radius_km must be a number'
+        return context
+
+    limit = min(max(args.get('limit', 10, type=int), 1), NEARBY_MAX_RESULTS)
     today = date.today()
-    end_date = today + timedelta(days=28)
-
-    signups = models.get_signups_for_date_range(
-        today.strftime('%Y-%m-%d'),
-        end_date.strftime('%Y-%m-%d')
-    )
-
-    # Organize by workout
-    workout_signups = {}
-    for signup in signups:
-        if signup['workout_id'] not in workout_signups:
-            workout_signups[signup['workout_id']] = []
-        workout_signups[signup['workout_id']].append(signup)
-
-    return render_template('location_detail.html',
-                         location=location,
-                         workouts=workouts,
-                         workout_signups=workout_signups)
+    end_date = today + timedelta(days=6)
+    radius_km = context['radius_km']
+    for _ in range(NEARBY_MAX_ROUNDS):
+        # Every filter, open_only included, applies before deciding to widen
+        results = _nearby_results(lat, lon, radius_km, context, today, end_date)
+        if (len(results) >= limit or not context['expand']
+                or radius_km >= models.NEARBY_MAX_RADIUS_KM):
+            break
+        radius_km = min(radius_km * 2, models.NEARBY_MAX_RADIUS_KM)
+
+    context['results'] = results[:limit]
+    context['searched_km'] = radius_km
+    context['expanded'] = radius_km > context['radius_km']
+    return context
+
+
+def _nearby_results(lat, lon, radius_km, context, today, end_date):
+    """Every workout within radius_km matching the find_nearby filters, dated this week"""
+    nearby = models.get_nearby_workouts(lat, lon, radius_km, context['day'],
+                                        context['time_from'], context['time_to'])
+    taken = {(signup.workout_id, signup.date): signup for signup in models.get_signups_for_workouts(
+        {workout.id for _, workout in nearby},
+        today.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+    )}
+
+    results = []
+    for distance, workout in nearby:
+        # Convert Python weekday (Mon=0) to our format (Sun=0)
+        offset = (workout.day_of_week - (today.weekday() + 1) % 7) % 7
+        day_str = (today + timedelta(days=offset)).strftime('%Y-%m-%d')
+        signup = taken.get((workout.id, day_str))
+        if signup and context['open_only']:
+            continue
+        results.append({
+            'date': day_str,
+            'day_name': models.get_day_name(workout.day_of_week),
+            'workout_id': workout.id,
+            'time': workout.time,
+            'workout_type': workout.workout_type,
+            'location_id': workout.location_id,
+            'location_name': workout.location_name,
+            'address': workout.address,
+            'latitude': workout.location.latitude,
+            'longitude': workout.location.longitude,
+            'distance_km': round(distance, 2),
+            'q_name': signup.q_name if signup else None,
+            'open': signup is None,
+        })
+    return results
+
+
+@app.route('/nearby')
+def nearby():
+    """Closest upcoming workouts and open Q slots (uses the browser's location)"""
+    context = find_nearby(request.args)
+    if 'lat' not in request.args:
+        context['error'] = None  # First visit: just the form
+    return render_template('nearby.html', **context)
+
+
+@app.route('/my-qs')
+def my_qs():
+    """Find a Q's upcoming signups by name"""
+    return render_template('my_qs.html', **find_my_qs(request.args))
 
 
 # ==================== ADMIN ROUTES ====================
@@ -254,8 +560,13 @@ def admin_login():
     """Admin login page"""
     if request.method == 'POST':
         password = request.form.get('password', '')
+        if not auth.allow_attempt('admin', request.remote_addr):
+            return render_template('admin/login.html',
+                                   error="Too many attempts, please wait a minute"), 429
         if check_admin_password(password):
+            auth.refund_attempt('admin', request.remote_addr)
             session['admin_logged_in'] = True
+            session['admin_region'] = get_current_region()
             next_page = request.args.get('next')
             return redirect(next_page or url_for('admin_dashboard'))
         else:
@@ -268,6 +579,7 @@ def admin_login():
 def admin_logout():
     """Admin logout"""
     session.pop('admin_logged_in', None)
+    session.pop('admin_region', None)
     return redirect(url_for('index'))
 
 
@@ -284,6 +596,12 @@ def admin_dashboard():
         end_date.strftime('%Y-%m-%d')
     )
 
+    # Weekly trend: last 8 weeks through the next 4 (pre-aggregated rollups)
+    trend = models.get_weekly_coverage_trend(
+        (today - timedelta(weeks=8)).strftime('%Y-%m-%d'),
+        end_date.strftime('%Y-%m-%d')
+    )
+
     # Get upcoming signups
     recent_signups = models.get_signups_for_date_range(
         today.strftime('%Y-%m-%d'),
@@ -292,7 +610,24 @@ def admin_dashboard():
 
     return render_template('admin/dashboard.html',
                          stats=stats,
-                         recent_signups=recent_signups)
+                         trend=trend,
+                         recent_signups=recent_signups,
+                         multi_region=len(region_names()) > 1)
+
+
+@app.route('/admin/regions')
+@login_required
+def admin_regions():
+    """Coverage report across every region (shards queried in parallel)"""
+    today = date.today()
+    end_date = today + timedelta(days=28)
+
+    region_stats = models.get_region_coverage_stats(
+        today.strftime('%Y-%m-%d'),
+        end_date.strftime('%Y-%m-%d')
+    )
+
+    return render_template('admin/regions.html', region_stats=region_stats)
 
 
 @app.route('/admin/locations')
@@ -314,18 +649,195 @@ def admin_workouts():
 @app.route('/admin/signups')
 @login_required
 def admin_signups():
-    """Manage signups"""
-    today = date.today()
-    end_date = today + timedelta(days=28)
-    signups = models.get_signups_for_date_range(
-        today.strftime('%Y-%m-%d'),
-        end_date.strftime('%Y-%m-%d')
+    """Manage signups: search by Q name, notes or AO, one keyset page at a time"""
+    q = request.args.get('q', '').strip()[:100]
+    start = request.args.get('start', '')
+    try:
+        datetime.strptime(start, '%Y-%m-%d')
+    except ValueError:
+        start = date.today().strftime('%Y-%m-%d')
+    signups, next_key = models.search_signups(
+        q or None, start, after=parse_page_key(request.args.get('after'))
     )
-    return render_template('admin/signups.html', signups=signups)
+    return render_template('admin/signups.html', signups=signups, q=q, start=start,
+                           next_after=format_page_key(next_key))
+
+
+EXPORT_FIELDS = ('id', 'date', 'day_of_week', 'time', 'location_name', 'workout_type',
+                 'q_name', 'q_email', 'notes', 'reminded', 'created_at')
+
+
+@app.route('/admin/export/signups.<fmt>')
+@login_required
+def admin_export_signups(fmt):
+    """Download every signup (live and archived) as CSV, JSON or NDJSON, streamed row by row"""
+    if fmt not in ('csv', 'json', 'ndjson'):
+        return "Unknown export format", 404
+    signups = models.iter_all_signups(request.args.get('start'), request.args.get('end'))
+    if fmt == 'csv':
+        response = Response(records.iter_csv(signups, EXPORT_FIELDS), mimetype='text/csv')
+    else:
+        response = stream_records(signups, ndjson=fmt == 'ndjson')
+    filename = f"signups-{get_current_region()}-{date.today().strftime('%Y%m%d')}.{fmt}"
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@app.route('/admin/analytics')
+@login_required
+def admin_analytics():
+    """Q leaderboards over the full signup history (served from snapshots)"""
+    location_id = request.args.get('location_id', type=int)
+    return render_template('admin/analytics.html',
+                         top_qs=analytics.get_top_qs(25),
+                         streaks=analytics.get_longest_streaks(10),
+                         regulars=analytics.get_ao_regulars(location_id, limit=3 if location_id is None else 10),
+                         first_time=analytics.get_first_time_qs_by_month(12),
+                         locations=models.get_all_locations(active_only=True),
+                         location_id=location_id)
+
+
+@app.route('/admin/profiles')
+@login_required
+def admin_profiles():
+    """Saved request profiles for this region, newest first"""
+    return render_template('admin/profiles.html',
+                         profiles=profiling.list_profiles(get_current_region()))
+
+
+@app.route('/admin/profiles/<name>')
+@login_required
+def admin_profile_detail(name):
+    """One request profile: SQL timings and the top functions"""
+    summary = profiling.load_summary(name)
+    if not summary or summary['region'] != get_current_region():
+        return "Profile not found", 404
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'ncalls'):
+        sort = 'cumulative'
+    return render_template('admin/profile_detail.html', profile=summary, sort=sort,
+                         report=profiling.top_functions(name, sort))
+
+
+@app.route('/admin/profiles/<name>/download')
+@login_required
+def admin_profile_download(name):
+    """Download a profile's pstats file (for snakeviz or python -m pstats)"""
+    summary = profiling.load_summary(name)
+    path = profiling.stats_path(name)
+    if not summary or not path or summary['region'] != get_current_region():
+        return "Profile not found", 404
+    return send_file(os.path.abspath(path), mimetype='application/octet-stream',
+                     as_attachment=True, download_name=f'{name}.prof')
+
+
+BULK_INT_FIELDS = ('location_id', 'day_of_week', 'active')
+
+
+def parse_bulk_value(name, value):
+    """One bulk form value, validated (None when left blank)"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    if name in BULK_INT_FIELDS:
+        return int(value)
+    if name == 'time':
+        return datetime.strptime(value, '%H:%M').strftime('%H:%M')
+    if name in ('start', 'end'):
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    return value[:100]
+
+
+def parse_bulk_form(kind, values):
+    """(filters, changes) for a bulk action; changes are submitted as set_<column>"""
+    target = models.BULK_TARGETS[kind]
+    filters, changes = {}, {}
+    for fields, result, prefix in ((target['filters'], filters, ''),
+                                   (target['changes'], changes, 'set_')):
+        for name in fields:
+            try:
+                result[name] = parse_bulk_value(name, values.get(prefix + name))
+            except ValueError:
+                raise models.BulkActionError(f"Invalid value for {name.replace('_', ' ')}")
+    return filters, changes
+
+
+@app.route('/admin/bulk/<kind>', methods=['GET', 'POST'])
+@login_required
+def admin_bulk(kind):
+    """Bulk edit by filter: preview the matching rows (GET), then apply in one transaction (POST)"""
+    if kind not in models.BULK_TARGETS:
+        return "Unknown bulk action", 404
+    values = request.form if request.method == 'POST' else request.args
+    context = {'kind': kind, 'values': values, 'preview': None, 'applied': None, 'error': None,
+               'locations': models.get_all_locations(active_only=False)}
+    if values:
+        try:
+            filters, changes = parse_bulk_form(kind, values)
+            if request.method == 'POST':
+                expected = request.form.get('expected', type=int)
+                if expected is None:
+                    raise models.BulkActionError("Preview the action before applying it")
+                context['applied'] = models.apply_bulk(kind, filters, changes, expected)
+            else:
+                context['preview'] = models.preview_bulk(kind, filters, changes)
+        except models.BulkActionError as e:
+            context['error'] = str(e)
+        except sqlite3.IntegrityError:
+            context['error'] = "That change would clash with an existing row (one workout per AO, day and time)"
+    return render_template('admin/bulk.html', **context), 400 if context['error'] else 200
+
+
+# ==================== HEALTH CHECKS ====================
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process answers (no database work)"""
+    response = jsonify({'status': 'ok'})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: every region's database is usable, with per-check latencies (503 if not)"""
+    ready, report = health.readiness()
+    response = jsonify(report)
+    response.status_code = 200 if ready else 503
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 
 # ==================== API ROUTES ====================
 
+def json_records(items):
+    """JSON response for a list of records, serialized without intermediate dicts"""
+    return Response(records.to_json(items) + '\n', mimetype='application/json')
+
+
+NDJSON = 'application/x-ndjson'
+
+
+def wants_ndjson(req):
+    """Whether a request asked for NDJSON (?format=ndjson or Accept header)"""
+    return req.args.get('format') == 'ndjson' or req.accept_mimetypes.best == NDJSON
+
+
+def stream_records(items, ndjson=False):
+    """Streamed JSON array (or NDJSON) response for an iterable of records"""
+    if ndjson:
+        return Response(records.iter_ndjson(items), mimetype=NDJSON)
+    return Response(records.iter_json_array(items), mimetype='application/json')
+
+
+def recent_signups_params(args):
+    """Cutoff timestamp and row limit for /api/notifications/recent, clamped to the configured caps"""
+    hours = min(max(args.get('hours', 24, type=int), 0), config.API_MAX_HOURS)
+    limit = min(max(args.get('limit', config.API_MAX_ROWS, type=int), 1), config.API_MAX_ROWS)
+    cutoff = datetime.now() - timedelta(hours=hours)
+    return cutoff.strftime('%Y-%m-%d %H:%M:%S'), limit
+
+
 @app.route('/api/signup', methods=['POST'])
 def api_signup():
     """API endpoint for creating a signup"""
@@ -337,10 +849,12 @@ def api_signup():
     q_email = data.get('q_email', '').strip() or None
     password = data.get('password', '')
     notes = data.get('notes', '').strip() or None
+    token = data.get('signup_token') or request.headers.get('X-Signup-Token')
 
     # Validate
-    if not check_signup_password(password):
-        return jsonify({'error': 'Invalid password'}), 401
+    error, status, new_token = verify_signup(password, token)
+    if error:
+        return jsonify({'error': error}), status
 
     if not q_name:
         return jsonify({'error': 'Name is required'}), 400
@@ -352,33 +866,57 @@ def api_signup():
 
     # Create signup
     signup_id = models.create_signup(workout_id, date_str, q_name, q_email, notes)
+    if signup_id is None:
+        return jsonify({'error': 'Slot already taken'}), 409
 
-    return jsonify({
+    response = {
         'success': True,
         'signup_id': signup_id,
         'message': 'Q signup successful!'
-    }), 201
+    }
+    if new_token:
+        # Send this back as signup_token to skip the password on later calls
+        response['signup_token'] = new_token
+    return jsonify(response), 201
+
+
+@app.route('/api/schedule/week/<int(signed=True):offset>', methods=['GET'])
+def api_week_schedule(offset):
+    """API endpoint for one week's schedule (used by the static publisher)"""
+    return jsonify(build_week_json(offset))
+
+
+LEADERBOARD_MAX_ROWS = 100
+
+
+def leaderboard_limit(args):
+    """Rows per leaderboard for /api/analytics/leaderboards, clamped to 1..LEADERBOARD_MAX_ROWS"""
+    return min(max(args.get('limit', 10, type=int), 1), LEADERBOARD_MAX_ROWS)
+
+
+@app.route('/api/analytics/leaderboards', methods=['GET'])
+def api_analytics_leaderboards():
+    """API endpoint for Q leaderboards (names only, no emails)"""
+    return jsonify(analytics.get_leaderboards(leaderboard_limit(request.args)))
 
 
 @app.route('/api/notifications/recent', methods=['GET'])
 def api_notifications_recent():
-    """API endpoint for recent signups (for notifications)"""
-    hours = request.args.get('hours', 24, type=int)
-    cutoff = datetime.now() - timedelta(hours=hours)
+    """API endpoint for recent signups (for notifications), streamed as JSON or NDJSON"""
+    since, limit = recent_signups_params(request.args)
+    response = stream_records(models.iter_recent_signups(since, limit), wants_ndjson(request))
+    response.headers['X-Result-Limit'] = str(limit)
+    return response
 
-    with models.db_transaction() as conn:
-        signups = conn.execute(
-            '''SELECT s.*, w.day_of_week, w.time, w.workout_type,
-                      l.name as location_name
-               FROM q_signups s
-               JOIN workouts w ON s.workout_id = w.id
-               JOIN locations l ON w.location_id = l.id
-               WHERE s.created_at >= ?
-               ORDER BY s.created_at DESC''',
-            (cutoff.strftime('%Y-%m-%d %H:%M:%S'),)
-        ).fetchall()
 
-    return jsonify([dict(s) for s in signups])
+@app.route('/api/nearby', methods=['GET'])
+def api_nearby():
+    """API endpoint for the closest upcoming workouts to ?lat=&lon="""
+    context = find_nearby(request.args)
+    if context['error']:
+        return jsonify({'error': context['error']}), 400
+    del context['error']
+    return jsonify(context)
 
 
 @app.route('/api/notifications/upcoming', methods=['GET'])
@@ -386,20 +924,8 @@ def api_notifications_upcoming():
     """API endpoint for upcoming workouts needing reminders"""
     days = request.args.get('days', 2, type=int)
     reminder_date = (date.today() + timedelta(days=days)).strftime('%Y-%m-%d')
-
-    with models.db_transaction() as conn:
-        signups = conn.execute(
-            '''SELECT s.*, w.day_of_week, w.time, w.workout_type,
-                      l.name as location_name, l.address
-               FROM q_signups s
-               JOIN workouts w ON s.workout_id = w.id
-               JOIN locations l ON w.location_id = l.id
-               WHERE s.date = ? AND s.reminded = 0 AND s.q_email IS NOT NULL
-               ORDER BY w.time''',
-            (reminder_date,)
-        ).fetchall()
-
-    return jsonify([dict(s) for s in signups])
+    signups = models.get_signups_needing_reminder(reminder_date)
+    return json_records(signups)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,161 @@
+"""
+Signup archival (hot/cold split)
+Moves past signups out of the live q_signups table so hot queries (week
+view, reminders, conflict checks) only touch recent rows. History stays
+readable through the q_signups_all view.
+
+Rows move in small batches through the write queue, each a short write, so
+signups are never blocked for long. When ARCHIVE_ATTACHED is on, the
+archive lives in a separate <database>-archive.db file.
+
+Usage:
+    python archive.py                  # Archive signups older than ARCHIVE_AFTER_DAYS
+    python archive.py --days 365       # Override the age
+"""
+import argparse
+import sys
+import time
+from datetime import date, timedelta
+
+from config import get_config
+from database import (db_transaction, get_shard, region_names, use_region,
+                      ARCHIVE_SCHEMA, ARCHIVE_COLUMNS)
+import leases
+import writer
+
+config = get_config()
+
+ARCHIVE_LEASE = 'archive'
+ARCHIVE_LEASE_SECONDS = 1800
+
+
+def get_archive_cutoff(older_than_days=None):
+    """Signups dated before this day belong in the archive"""
+    days = config.ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    return (date.today() - timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def _archive_batch(conn, ids, target):
+    """Copy a batch into the archive table (idempotent)"""
+    placeholders = ','.join('?' * len(ids))
+    conn.execute(
+        f'''INSERT OR REPLACE INTO {target}.q_signups_archive ({ARCHIVE_COLUMNS})
+            SELECT {ARCHIVE_COLUMNS} FROM main.q_signups WHERE id IN ({placeholders})''',
+        ids
+    )
+
+
+def _delete_batch(conn, ids):
+    """Remove archived rows from the live table without touching rollups"""
+    placeholders = ','.join('?' * len(ids))
+    conn.execute("INSERT OR IGNORE INTO trigger_guards (name) VALUES ('archiving')")
+    conn.execute(f'DELETE FROM main.q_signups WHERE id IN ({placeholders})', ids)
+    conn.execute("DELETE FROM trigger_guards WHERE name = 'archiving'")
+
+
+def _move_batch(conn, cutoff, batch_size, target, attached):
+    """Archive the next batch of old signups; returns their ids (empty when done)"""
+    ids = [row['id'] for row in conn.execute(
+        'SELECT id FROM main.q_signups WHERE date < ? ORDER BY date, id LIMIT ?',
+        (cutoff, batch_size)
+    )]
+    if ids:
+        _archive_batch(conn, ids, target)
+        if not attached:
+            # Same file: copy and delete commit atomically
+            _delete_batch(conn, ids)
+    return ids
+
+
+def archive_signups(older_than_days=None, batch_size=None, pause=0.05):
+    """
+    Move signups older than the cutoff into the archive for the current region
+    Returns the number of rows moved.
+    """
+    cutoff = get_archive_cutoff(older_than_days)
+    batch_size = batch_size or config.ARCHIVE_BATCH_SIZE
+    attached = config.ARCHIVE_ATTACHED
+    target = ARCHIVE_SCHEMA if attached else 'main'
+
+    moved = 0
+    while True:
+        # Batches go through the write queue like any other write, so they
+        # take turns with signups instead of racing them for the lock
+        ids = writer.execute(_move_batch, cutoff, batch_size, target, attached)
+        if not ids:
+            break
+
+        if attached:
+            # Transactions spanning attached WAL databases are not atomic as a
+            # set, so the copy is committed before the live rows are removed
+            writer.execute(_delete_batch, ids)
+
+        moved += len(ids)
+        time.sleep(pause)  # Let waiting writers in between batches
+
+    # Tell readers which date ranges must include the archive
+    writer.execute(lambda conn: conn.execute(
+        '''INSERT INTO settings (key, value, description)
+           VALUES ('archive_cutoff', ?, 'Signups before this date may be archived')
+           ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)''',
+        (cutoff,)
+    ))
+    get_shard().cache.pop('archive_cutoff', None)
+
+    return moved
+
+
+def run_scheduled_archive(older_than_days=None):
+    """
+    Timer entry point: archive under a lease so only one worker or container
+    moves rows at a time (None when another process holds it or ran this interval)
+    """
+    if leases.ran_within(ARCHIVE_LEASE, config.ARCHIVE_INTERVAL_SECONDS * 0.9):
+        return None
+    if not leases.acquire(ARCHIVE_LEASE, ARCHIVE_LEASE_SECONDS):
+        return None
+    moved = None
+    try:
+        moved = archive_signups(older_than_days)
+    finally:
+        leases.release(ARCHIVE_LEASE, moved)
+    return moved
+
+
+def archive_all_regions(older_than_days=None):
+    """Archive every region (used by the background timer)"""
+    results = {}
+    for region in region_names():
+        with use_region(region):
+            results[region] = run_scheduled_archive(older_than_days)
+    return results
+
+
+def get_archive_stats():
+    """Row counts for the live and archived signups of the current region"""
+    target = ARCHIVE_SCHEMA if config.ARCHIVE_ATTACHED else 'main'
+    with db_transaction() as conn:
+        live = conn.execute('SELECT COUNT(*) FROM main.q_signups').fetchone()[0]
+        archived = conn.execute(f'SELECT COUNT(*) FROM {target}.q_signups_archive').fetchone()[0]
+        oldest_live = conn.execute('SELECT MIN(date) FROM main.q_signups').fetchone()[0]
+    return {'live': live, 'archived': archived, 'oldest_live_date': oldest_live}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Archive past Q signups')
+    parser.add_argument('--days', type=int, default=None,
+                        help=f'Archive signups older than this many days '
+                             f'(default: {config.ARCHIVE_AFTER_DAYS})')
+    args = parser.parse_args(argv)
+
+    for region in region_names():
+        with use_region(region):
+            moved = archive_signups(args.days)
+            stats = get_archive_stats()
+        print(f"{region}: archived {moved} signups "
+              f"({stats['live']} live, {stats['archived']} archived)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+"""
+ASGI entry point
+Serves the public read routes as async views under an ASGI server (uvicorn)
+
+Read routes await their models calls on a small, bounded thread pool
+(ASYNC_DB_THREADS), so the event loop can hold many slow clients open
+cheaply while only a few threads touch SQLite. Every other route (signups,
+admin) runs the regular Flask app on its own bounded pool
+(ASYNC_WSGI_THREADS), so slow password checks never starve the reads.
+
+Usage:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import contextvars
+import functools
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from flask import Request, render_template
+
+import analytics
+import background
+import health
+import models
+import profiling
+import records
+from app import (app as flask_app, region_router, ensure_background_tasks,
+                 get_week_bounds, build_week_schedule, build_week_json,
+                 get_location_schedule, find_my_qs, find_nearby,
+                 recent_signups_params, leaderboard_limit, wants_ndjson, NDJSON)
+from config import get_config
+from database import use_region
+
+config = get_config()
+
+_db_executor = ThreadPoolExecutor(max_workers=config.ASYNC_DB_THREADS,
+                                  thread_name_prefix='qsheet-db')
+_wsgi_executor = ThreadPoolExecutor(max_workers=config.ASYNC_WSGI_THREADS,
+                                    thread_name_prefix='qsheet-wsgi')
+
+HTML = 'text/html; charset=utf-8'
+JSON = 'application/json'
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking models call on the database pool (keeps the region binding)"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _db_executor, functools.partial(context.run, func, *args, **kwargs)
+    )
+
+
+def render(request, template, **context):
+    """Render a template with the same context processors as the Flask views"""
+    with flask_app.request_context(request.environ):
+        return render_template(template, **context)
+
+
+def to_json(data):
+    """Serialize exactly like jsonify()"""
+    with flask_app.app_context():
+        return flask_app.json.response(data).get_data()
+
+
+# ==================== ASYNC VIEWS ====================
+
+async def index(request):
+    """Homepage with weekly schedule view"""
+    today, monday, sunday = get_week_bounds()
+    schedule = await run_db(build_week_schedule, monday)
+    return 200, HTML, render(request, 'index.html', schedule=schedule,
+                             monday=monday, sunday=sunday, today=today)
+
+
+async def week_schedule(request, offset):
+    """View schedule for a specific week offset from current week"""
+    today, monday, sunday = get_week_bounds(offset)
+    schedule = await run_db(build_week_schedule, monday)
+    return 200, HTML, render(request, 'week_schedule.html', schedule=schedule,
+                             monday=monday, sunday=sunday, today=today, offset=offset)
+
+
+async def locations(request):
+    """List all locations"""
+    all_locations = await run_db(models.get_all_locations, active_only=True)
+    return 200, HTML, render(request, 'locations.html', locations=all_locations)
+
+
+async def location_detail(request, location_id):
+    """View a specific location's schedule"""
+    data = await run_db(get_location_schedule, location_id)
+    if not data:
+        return 404, HTML, "Location not found"
+    return 200, HTML, render(request, 'location_detail.html', **data)
+
+
+async def my_qs(request):
+    """Find a Q's upcoming signups by name"""
+    data = await run_db(find_my_qs, request.args)
+    return 200, HTML, render(request, 'my_qs.html', **data)
+
+
+async def nearby(request):
+    """Closest upcoming workouts and open Q slots"""
+    context = await run_db(find_nearby, request.args)
+    if 'lat' not in request.args:
+        context['error'] = None
+    return 200, HTML, render(request, 'nearby.html', **context)
+
+
+async def api_week_schedule(request, offset):
+    """API endpoint for one week's schedule"""
+    return 200, JSON, to_json(await run_db(build_week_json, offset))
+
+
+async def api_analytics_leaderboards(request):
+    """API endpoint for Q leaderboards (names only, no emails)"""
+    limit = leaderboard_limit(request.args)
+    return 200, JSON, to_json(await run_db(analytics.get_leaderboards, limit))
+
+
+async def api_nearby(request):
+    """API endpoint for the closest upcoming workouts to ?lat=&lon="""
+    context = await run_db(find_nearby, request.args)
+    if context['error']:
+        return 400, JSON, to_json({'error': context['error']})
+    del context['error']
+    return 200, JSON, to_json(context)
+
+
+async def api_notifications_recent(request):
+    """API endpoint for recent signups (for notifications), streamed from the database pool"""
+    since, limit = recent_signups_params(request.args)
+    signups = models.iter_recent_signups(since, limit)
+    if wants_ndjson(request):
+        return 200, NDJSON, records.iter_ndjson(signups), {'X-Result-Limit': str(limit)}
+    return 200, JSON, records.iter_json_array(signups), {'X-Result-Limit': str(limit)}
+
+
+async def api_notifications_upcoming(request):
+    """API endpoint for upcoming workouts needing reminders"""
+    days = request.args.get('days', 2, type=int)
+    reminder_date = (date.today() + timedelta(days=days)).strftime('%Y-%m-%d')
+    signups = await run_db(models.get_signups_needing_reminder, reminder_date)
+    return 200, JSON, records.to_json(signups) + '\n'
+
+
+async def healthz(request):
+    """Liveness: answered on the event loop, never queued behind other requests"""
+    return 200, JSON, '{"status":"ok"}\n', {'Cache-Control': 'no-store'}
+
+
+async def readyz(request):
+    """Readiness of every region's database"""
+    ready, report = await run_db(health.readiness)
+    return 200 if ready else 503, JSON, to_json(report), {'Cache-Control': 'no-store'}
+
+
+# Flask endpoint -> async view; anything else is served by the Flask app
+ASYNC_VIEWS = {
+    'index': index,
+    'week_schedule': week_schedule,
+    'locations': locations,
+    'location_detail': location_detail,
+    'my_qs': my_qs,
+    'nearby': nearby,
+    'api_week_schedule': api_week_schedule,
+    'api_analytics_leaderboards': api_analytics_leaderboards,
+    'api_nearby': api_nearby,
+    'api_notifications_recent': api_notifications_recent,
+    'api_notifications_upcoming': api_notifications_upcoming,
+    'healthz': healthz,
+    'readyz': readyz,
+}
+
+
+# ==================== ASGI PLUMBING ====================
+
+def build_environ(scope, body=b''):
+    """WSGI environ for an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_start(send, status, headers):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+    })
+
+
+async def send_response(send, status, headers, body):
+    await send_start(send, status, headers)
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_stream(send, status, headers, chunks, executor, send_body=True):
+    """
+    Send a streamed body, pulling each chunk from a blocking iterable on an
+    executor thread (generators reading SQLite must not run on the event loop)
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(chunks)
+    try:
+        await send_start(send, status, headers)
+        while send_body:
+            chunk = await loop.run_in_executor(executor, next, iterator, None)
+            if chunk is None:
+                break
+            if chunk:
+                chunk = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            await loop.run_in_executor(executor, close)
+
+
+def match_view(environ):
+    """Find the async view (and URL arguments) for a routed environ, if any"""
+    if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+        return None, {}
+    try:
+        endpoint, args = flask_app.url_map.bind_to_environ(environ).match()
+    except Exception:  # NotFound, redirects: let Flask produce the response
+        return None, {}
+    return ASYNC_VIEWS.get(endpoint), args
+
+
+def _start_wsgi(environ):
+    """
+    Call the Flask app for one request (on the WSGI pool)
+    Returns the status, headers and the unconsumed body iterable; Flask
+    calls start_response before returning, so streamed bodies stay lazy.
+    """
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+        return lambda data: None  # Flask never uses the legacy write() callable
+
+    result = flask_app(environ, start_response)
+    return response['status'], response['headers'], result
+
+
+async def run_wsgi(environ, send):
+    loop = asyncio.get_running_loop()
+    status, headers, result = await loop.run_in_executor(_wsgi_executor, _start_wsgi, environ)
+    await send_stream(send, status, headers, result, _wsgi_executor)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            background.stop_all()
+            _db_executor.shutdown(wait=False)
+            _wsgi_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI application: async read views, Flask for everything else"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    body = await read_body(receive)
+    if body is None:
+        return  # Client went away
+    environ = build_environ(scope, body)
+    ensure_background_tasks()
+
+    # Route a copy: the Flask fallback applies the region middleware itself
+    routed = dict(environ)
+    region = region_router.route(routed)
+    view, args = match_view(routed)
+    if view is None or profiling.flagged(routed):  # Flask checks the profiling admin
+        return await run_wsgi(environ, send)
+
+    request = Request(routed)
+    try:
+        with use_region(region):
+            status, content_type, content, *extra = await view(request, **args)
+    except Exception:
+        flask_app.logger.exception(f"Exception on {routed['PATH_INFO']} [{routed['REQUEST_METHOD']}]")
+        status, content_type, content, extra = 500, HTML, 'Internal Server Error', []
+
+    headers = [('Content-Type', content_type)] + list(extra[0].items() if extra else [])
+    send_body = routed['REQUEST_METHOD'] != 'HEAD'
+    if not isinstance(content, (str, bytes)):
+        # Streamed body: the generator holds its own connection until exhausted
+        return await send_stream(send, status, headers, content, _db_executor, send_body)
+    content = content.encode('utf-8') if isinstance(content, str) else content
+    headers.append(('Content-Length', str(len(content))))
+    await send_response(send, status, headers, content if send_body else b'')
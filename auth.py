@@ -0,0 +1,243 @@
+"""
+Authentication helpers
+bcrypt-hashed shared passwords, signed signup tokens and a login rate limiter
+
+Passwords are stored as bcrypt hashes in the settings table. A bcrypt check
+costs ~100ms, so after one successful signup password check the user gets a
+short-lived signed token (kept in the session, or sent back by API clients);
+later signups verify the token's signature instead of the password. Tokens
+carry a fingerprint of the password hash, so changing the password revokes
+them.
+
+Usage:
+    python auth.py set-password signup            # Prompt for a new signup password
+    python auth.py set-password admin --region cobb
+"""
+import argparse
+import getpass
+import hashlib
+import hmac
+import sys
+import threading
+import time
+
+import bcrypt
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from config import get_config
+from database import db_transaction, get_current_region, get_shard, region_names, use_region
+import writer
+
+config = get_config()
+
+PASSWORD_SETTINGS = {
+    'signup': ('signup_password', 'Shared password for Q sign-ups (bcrypt hash)'),
+    'admin': ('admin_password', 'Admin interface password (bcrypt hash)'),
+}
+
+HASH_CACHE_TTL = 60  # Seconds before a cached hash is re-read from settings
+
+TOKEN_SALT = 'qsheet-signup-token'
+
+
+# ==================== HASHING ====================
+
+def hash_password(password):
+    """Hash a password with bcrypt"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('ascii')
+
+
+def is_hashed(value):
+    """Whether a stored value is a bcrypt hash rather than a legacy plaintext password"""
+    return bool(value) and value.startswith(('$2a$', '$2b$', '$2y$'))
+
+
+def _default_password(kind):
+    return config.SIGNUP_PASSWORD if kind == 'signup' else config.ADMIN_PASSWORD
+
+
+def _load_hash(kind):
+    """
+    Read a password hash from settings, upgrading plaintext values in place
+    Regions without the setting get a hash of the configured default.
+    """
+    key, description = PASSWORD_SETTINGS[kind]
+    with db_transaction() as conn:
+        row = conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+    stored = row['value'] if row else None
+    if is_hashed(stored):
+        return stored
+
+    hashed = hash_password(stored if stored is not None else _default_password(kind))
+    # Only replace the value we read: a password set meanwhile must not be
+    # overwritten by the old one
+    upgraded = writer.execute(lambda conn: conn.execute(
+        '''INSERT INTO settings (key, value, description) VALUES (?, ?, ?)
+           ON CONFLICT(key) DO UPDATE SET value = excluded.value,
+                                          description = excluded.description,
+                                          updated_at = CURRENT_TIMESTAMP
+           WHERE settings.value IS ?''',
+        (key, hashed, description, stored)
+    ).rowcount == 1)
+    return hashed if upgraded else _load_hash(kind)
+
+
+def get_password_hash(kind):
+    """Password hash for the current region, cached in the shard for HASH_CACHE_TTL"""
+    cache = get_shard().cache.setdefault('password_hashes', {})
+    cached = cache.get(kind)
+    if cached and time.monotonic() - cached[1] < HASH_CACHE_TTL:
+        return cached[0]
+
+    hashed = _load_hash(kind)
+    cache[kind] = (hashed, time.monotonic())
+    return hashed
+
+
+def check_password(kind, password):
+    """Check a password against the current region's stored hash"""
+    if not password:
+        return False
+    return bcrypt.checkpw(password.encode('utf-8'), get_password_hash(kind).encode('ascii'))
+
+
+def set_password(kind, password):
+    """Store a new password hash (revokes outstanding signup tokens)"""
+    key, description = PASSWORD_SETTINGS[kind]
+    hashed = hash_password(password)  # Outside the write queue: bcrypt is slow
+    writer.execute(lambda conn: conn.execute(
+        '''INSERT INTO settings (key, value, description) VALUES (?, ?, ?)
+           ON CONFLICT(key) DO UPDATE SET value = excluded.value,
+                                          updated_at = CURRENT_TIMESTAMP''',
+        (key, hashed, description)
+    ))
+    get_shard().cache.pop('password_hashes', None)
+
+
+# ==================== SIGNUP TOKENS ====================
+
+def _serializer():
+    return URLSafeTimedSerializer(config.SECRET_KEY, salt=TOKEN_SALT)
+
+
+def _fingerprint(hashed):
+    return hashlib.sha256(hashed.encode('ascii')).hexdigest()[:16]
+
+
+def issue_signup_token():
+    """Signed token proving the signup password was checked for this region"""
+    return _serializer().dumps({
+        'region': get_current_region(),
+        'pw': _fingerprint(get_password_hash('signup')),
+    })
+
+
+def check_signup_token(token):
+    """Whether a signup token is valid, unexpired and issued for the current region"""
+    if not token:
+        return False
+    try:
+        data = _serializer().loads(token, max_age=config.SIGNUP_TOKEN_SECONDS)
+    except BadSignature:  # Also covers SignatureExpired
+        return False
+    if not isinstance(data, dict) or data.get('region') != get_current_region():
+        return False
+    return hmac.compare_digest(str(data.get('pw', '')),
+                               _fingerprint(get_password_hash('signup')))
+
+
+# ==================== RATE LIMITING ====================
+
+class RateLimiter:
+    """
+    In-memory token bucket per key (per process)
+    Each key may make `burst` attempts at once, refilled at `per_minute`.
+    """
+
+    MAX_KEYS = 10000
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.burst = burst or per_minute
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Take one attempt for a key; returns False when the key is over its limit"""
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if len(self._buckets) > self.MAX_KEYS:
+                self._prune(now)
+            return allowed
+
+    def refund(self, key):
+        """Give back an attempt taken by allow()"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            if key in self._buckets:
+                tokens, last = self._buckets[key]
+                self._buckets[key] = (min(self.burst, tokens + 1), last)
+
+    def _prune(self, now):
+        """Drop keys whose buckets have refilled (they behave like new keys)"""
+        full_after = self.burst / self.rate
+        self._buckets = {
+            key: (tokens, last) for key, (tokens, last) in self._buckets.items()
+            if now - last < full_after
+        }
+
+    def reset(self, key=None):
+        """Forget one key (or every key)"""
+        with self._lock:
+            if key is None:
+                self._buckets.clear()
+            else:
+                self._buckets.pop(key, None)
+
+
+login_limiter = RateLimiter(config.LOGIN_ATTEMPTS_PER_MINUTE)
+
+
+def allow_attempt(kind, client):
+    """
+    Reserve a password attempt (per region, password kind and client address)
+    Taken before the bcrypt check so parallel guesses cannot all slip past
+    the limit; refund_attempt() gives it back when the password was right.
+    """
+    return login_limiter.allow((get_current_region(), kind, client))
+
+
+def refund_attempt(kind, client):
+    """Return a reserved attempt after a correct password (only failures count)"""
+    login_limiter.refund((get_current_region(), kind, client))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage Q-Sheet passwords')
+    sub = parser.add_subparsers(dest='command', required=True)
+    set_pw = sub.add_parser('set-password', help='Store a new password hash')
+    set_pw.add_argument('kind', choices=sorted(PASSWORD_SETTINGS))
+    set_pw.add_argument('--region', default=None, help='Only this region (default: all)')
+    args = parser.parse_args(argv)
+
+    password = getpass.getpass(f'New {args.kind} password: ')
+    if not password or password != getpass.getpass('Repeat: '):
+        print("Passwords empty or do not match")
+        return 1
+
+    for region in [args.region] if args.region else region_names():
+        with use_region(region):
+            set_password(args.kind, password)
+        print(f"{region}: {args.kind} password updated")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
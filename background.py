@@ -0,0 +1,67 @@
+"""
+Background tasks
+Small in-process periodic timers (one daemon thread per task)
+"""
+import threading
+import time
+import traceback
+
+_tasks = {}
+_tasks_lock = threading.Lock()
+
+
+class PeriodicTask(threading.Thread):
+    """Run a function every `interval` seconds on a daemon thread"""
+
+    def __init__(self, name, interval, func, initial_delay=None):
+        super().__init__(name=f'qsheet-{name}', daemon=True)
+        self.task_name = name
+        self.interval = interval
+        self.func = func
+        self.initial_delay = interval if initial_delay is None else initial_delay
+        self.last_run = None
+        self.last_error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        if self._stop_event.wait(self.initial_delay):
+            return
+        while True:
+            try:
+                self.func()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Background task {self.task_name} failed: {e}")
+                traceback.print_exc()
+            self.last_run = time.time()
+            if self._stop_event.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_periodic(name, interval, func, initial_delay=None):
+    """Start a named periodic task once per process (returns the task)"""
+    with _tasks_lock:
+        task = _tasks.get(name)
+        if task is None or not task.is_alive():
+            task = PeriodicTask(name, interval, func, initial_delay)
+            _tasks[name] = task
+            task.start()
+        return task
+
+
+def stop_all():
+    """Stop every running periodic task"""
+    with _tasks_lock:
+        for task in _tasks.values():
+            task.stop()
+        _tasks.clear()
+
+
+def get_tasks():
+    """Get the running tasks, keyed by name"""
+    with _tasks_lock:
+        return dict(_tasks)
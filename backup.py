@@ -0,0 +1,325 @@
+"""
+Online backups
+Consistent, compressed snapshots of each region's database while the app runs
+
+A snapshot copies the database with the SQLite backup API, BACKUP_PAGES_PER_STEP
+pages at a time with a short pause between steps, inside one read
+transaction: the copy is a consistent point in time and, in WAL mode,
+writers carry on meanwhile (the read transaction also stops the backup from
+restarting when they commit). The copy is checked with quick_check, gzipped
+to BACKUP_DIR/<region>/<region>-<timestamp>.db.gz and given a sha256sum-style
+.sha256 file.
+
+With ARCHIVE_ATTACHED the archive file is copied right after, as
+<...>-archive.db.gz. It is not in WAL mode, and a read lock held on it
+would stall every commit, so it gets its own page steps with the lock
+released in between; signups archived during a backup may be in both copies.
+
+Retention keeps the newest BACKUP_KEEP snapshots plus the last snapshot of
+each day for BACKUP_KEEP_DAYS days. Restores always go to a new file.
+
+Usage:
+    python backup.py create                       # Snapshot every region now
+    python backup.py create --region cobb
+    python backup.py list
+    python backup.py verify                       # Check every snapshot's checksum
+    python backup.py restore new.db --at "2026-10-18 06:00"   # Latest snapshot at or before
+    python backup.py restore new.db --snapshot backups/default/default-20261018-060000.db.gz
+    python backup.py prune
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from config import get_config
+from database import (ARCHIVE_SCHEMA, archive_path_for, db_transaction, get_current_region,
+                      region_names, use_region)
+import leases
+
+config = get_config()
+
+BACKUP_LEASE = 'backup'
+BACKUP_LEASE_SECONDS = 3600
+TIMESTAMP_FORMAT = '%Y%m%d-%H%M%S'
+CHUNK_SIZE = 1024 * 1024
+
+Snapshot = namedtuple('Snapshot', ['region', 'created_at', 'path', 'archive_path'])
+
+SNAPSHOT_PATTERN = re.compile(r'^(?P<region>.+)-(?P<stamp>\d{8}-\d{6})\.db\.gz$')
+
+
+# ==================== CREATING ====================
+
+def _copy(source, target_path, name='main'):
+    """Copy one schema of a connection to a new file in page steps"""
+    def pause(status, remaining, total):
+        if remaining:
+            time.sleep(config.BACKUP_STEP_PAUSE_MS / 1000)  # Let other connections at the file
+
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=config.BACKUP_PAGES_PER_STEP, name=name, progress=pause)
+        problems = [row[0] for row in target.execute('PRAGMA quick_check')]
+        if problems != ['ok']:
+            raise sqlite3.DatabaseError(f"Backup copy failed quick_check: {problems[:5]}")
+    finally:
+        target.close()
+
+
+def _compress(source_path, target_path):
+    """gzip a file to target_path (via a temporary name) and write its .sha256 file"""
+    digest = hashlib.sha256()
+    partial = target_path + '.partial'
+    with open(source_path, 'rb') as src, open(partial, 'wb') as raw:
+        with gzip.GzipFile(filename=os.path.basename(target_path)[:-3], mode='wb',
+                           fileobj=raw, mtime=0) as out:
+            while chunk := src.read(CHUNK_SIZE):
+                out.write(chunk)
+    with open(partial, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    os.replace(partial, target_path)
+    with open(target_path + '.sha256', 'w') as f:
+        f.write(f'{digest.hexdigest()}  {os.path.basename(target_path)}\n')
+
+
+def _region_dir(region):
+    return os.path.join(config.BACKUP_DIR, region)
+
+
+def create_snapshot(now=None):
+    """Snapshot the current region's database; returns the Snapshot"""
+    region = get_current_region()
+    stamp = (now or datetime.now()).strftime(TIMESTAMP_FORMAT)
+    directory = _region_dir(region)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{region}-{stamp}.db.gz')
+    archive_path = path[:-len('.db.gz')] + '-archive.db.gz' if config.ARCHIVE_ATTACHED else None
+
+    workdir = tempfile.mkdtemp(prefix='qsheet-backup-', dir=directory)
+    try:
+        with db_transaction() as conn:
+            # Hold one read transaction on main (WAL) for a consistent copy
+            conn.execute('BEGIN')
+            conn.execute('SELECT COUNT(*) FROM main.sqlite_master').fetchone()
+            _copy(conn, os.path.join(workdir, 'main.db'))
+            conn.commit()
+            if archive_path:
+                _copy(conn, os.path.join(workdir, 'archive.db'), name=ARCHIVE_SCHEMA)
+        if archive_path:
+            _compress(os.path.join(workdir, 'archive.db'), archive_path)
+        _compress(os.path.join(workdir, 'main.db'), path)  # Written last: marks the snapshot complete
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return Snapshot(region, datetime.strptime(stamp, TIMESTAMP_FORMAT), path, archive_path)
+
+
+# ==================== LISTING AND RETENTION ====================
+
+def list_snapshots(region=None):
+    """Complete snapshots of a region (default: current), oldest first"""
+    region = region or get_current_region()
+    directory = _region_dir(region)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    snapshots = []
+    for name in sorted(names):
+        match = SNAPSHOT_PATTERN.match(name)
+        if not match or match['region'] != region:
+            continue
+        path = os.path.join(directory, name)
+        archive_path = path[:-len('.db.gz')] + '-archive.db.gz'
+        snapshots.append(Snapshot(region, datetime.strptime(match['stamp'], TIMESTAMP_FORMAT),
+                                  path, archive_path if os.path.exists(archive_path) else None))
+    return snapshots
+
+
+def snapshots_to_keep(snapshots, now=None):
+    """The newest BACKUP_KEEP snapshots plus the last one of each day for BACKUP_KEEP_DAYS"""
+    keep = set(snapshots[-config.BACKUP_KEEP:]) if config.BACKUP_KEEP > 0 else set()
+    first_day = ((now or datetime.now()) - timedelta(days=config.BACKUP_KEEP_DAYS)).date()
+    last_of_day = {}
+    for snapshot in snapshots:
+        if snapshot.created_at.date() > first_day:
+            last_of_day[snapshot.created_at.date()] = snapshot
+    return keep | set(last_of_day.values())
+
+
+def prune(now=None):
+    """Delete the current region's snapshots outside the retention policy; returns how many"""
+    snapshots = list_snapshots()
+    keep = snapshots_to_keep(snapshots, now)
+    removed = 0
+    for snapshot in snapshots:
+        if snapshot in keep:
+            continue
+        for path in (snapshot.path, snapshot.archive_path):
+            for name in (path, path and path + '.sha256'):
+                if name and os.path.exists(name):
+                    os.remove(name)
+        removed += 1
+    return removed
+
+
+# ==================== VERIFYING AND RESTORING ====================
+
+def verify_file(path):
+    """Whether a snapshot file matches its .sha256 file"""
+    try:
+        with open(path + '.sha256') as f:
+            expected = f.read().split()[0]
+    except (FileNotFoundError, IndexError):
+        return False
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest() == expected
+
+
+def verify_snapshot(snapshot):
+    return all(verify_file(path) for path in (snapshot.path, snapshot.archive_path) if path)
+
+
+def find_snapshot(at=None, region=None):
+    """The newest snapshot taken at or before `at` (default: the newest), or None"""
+    candidates = [s for s in list_snapshots(region) if at is None or s.created_at <= at]
+    return candidates[-1] if candidates else None
+
+
+def _decompress(source_path, target_path):
+    """Unpack a snapshot to target_path, which must not exist yet"""
+    partial = target_path + '.partial'
+    with gzip.open(source_path, 'rb') as src, open(partial, 'wb') as out:
+        shutil.copyfileobj(src, out, CHUNK_SIZE)
+    conn = sqlite3.connect(partial)
+    try:
+        problems = [row[0] for row in conn.execute('PRAGMA quick_check')]
+    finally:
+        conn.close()
+    if problems != ['ok']:
+        os.remove(partial)
+        raise sqlite3.DatabaseError(f"Restored copy failed quick_check: {problems[:5]}")
+    os.replace(partial, target_path)
+
+
+def restore(snapshot, target_path):
+    """
+    Restore a snapshot into a fresh database file (and its archive file, if any)
+    Never overwrites: stop the app and move the file into place yourself.
+    """
+    targets = [(snapshot.path, target_path)]
+    if snapshot.archive_path:
+        targets.append((snapshot.archive_path, archive_path_for(target_path)))
+    for _, target in targets:
+        if os.path.exists(target):
+            raise FileExistsError(f"{target} already exists; restore into a new file")
+    if not verify_snapshot(snapshot):
+        raise ValueError(f"Checksum mismatch for {snapshot.path}")
+    for source, target in targets:
+        _decompress(source, target)
+    return target_path
+
+
+# ==================== SCHEDULED BACKUPS ====================
+
+def run_backup(now=None):
+    """
+    Snapshot and prune the current region unless its newest snapshot is still
+    fresh or another process is backing it up; returns the Snapshot or None
+    """
+    now = now or datetime.now()
+    latest = find_snapshot()
+    interval = timedelta(seconds=config.BACKUP_INTERVAL_SECONDS)
+    if latest and now - latest.created_at < interval * 0.9:
+        return None  # Another worker or container already took this one
+    if not leases.acquire(BACKUP_LEASE, BACKUP_LEASE_SECONDS):
+        return None
+    snapshot = None
+    try:
+        snapshot = create_snapshot(now)
+        prune(now)
+    finally:
+        leases.release(BACKUP_LEASE, snapshot and os.path.basename(snapshot.path))
+    return snapshot
+
+
+def backup_all_regions():
+    """Run a scheduled backup for every region (used by the background timer)"""
+    results = {}
+    for region in region_names():
+        with use_region(region):
+            results[region] = run_backup()
+    return results
+
+
+def _size(path):
+    return f'{os.path.getsize(path) / 1024:.0f} KB'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Online database backups')
+    parser.add_argument('--region', default=None, help='Only this region (default: all)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('create', help='Take a snapshot now')
+    sub.add_parser('list', help='List snapshots')
+    sub.add_parser('verify', help='Check snapshot checksums')
+    sub.add_parser('prune', help='Apply the retention policy')
+    rest = sub.add_parser('restore', help='Restore a snapshot into a new file')
+    rest.add_argument('target', help='New database file to create')
+    rest.add_argument('--at', default=None, help='Latest snapshot at or before "YYYY-MM-DD HH:MM"')
+    rest.add_argument('--snapshot', default=None, help='Snapshot file to restore')
+    args = parser.parse_args(argv)
+
+    if args.command == 'restore':
+        if args.snapshot:
+            snapshot = next((s for region in region_names() for s in list_snapshots(region)
+                             if os.path.abspath(s.path) == os.path.abspath(args.snapshot)), None)
+        else:
+            region = args.region or get_current_region()
+            at = datetime.fromisoformat(args.at) if args.at else None
+            snapshot = find_snapshot(at, region)
+        if snapshot is None:
+            print("No matching snapshot")
+            return 1
+        restore(snapshot, args.target)
+        print(f"Restored {snapshot.path} ({snapshot.created_at}) to {args.target}")
+        return 0
+
+    status = 0
+    for region in [args.region] if args.region else region_names():
+        with use_region(region):
+            print(f"{region}:")
+            if args.command == 'create':
+                started = time.monotonic()
+                snapshot = create_snapshot()
+                print(f"  {snapshot.path} ({_size(snapshot.path)}, "
+                      f"{time.monotonic() - started:.1f}s)")
+                print(f"  Pruned {prune()} old snapshots")
+            elif args.command == 'list':
+                for snapshot in list_snapshots():
+                    archive = ' + archive' if snapshot.archive_path else ''
+                    print(f"  {snapshot.created_at}  {snapshot.path}  {_size(snapshot.path)}{archive}")
+            elif args.command == 'verify':
+                for snapshot in list_snapshots():
+                    ok = verify_snapshot(snapshot)
+                    print(f"  {os.path.basename(snapshot.path)}: {'ok' if ok else 'CHECKSUM MISMATCH'}")
+                    status = status or (0 if ok else 1)
+            elif args.command == 'prune':
+                print(f"  Pruned {prune()} old snapshots")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
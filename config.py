@@ -20,17 +20,80 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
     FLASK_ENV = os.getenv('FLASK_ENV', 'production')
 
-    # Database
+    # Database: a file path, "tmpfs:<name>" (a file under TMPFS_DIR) or
+    # "memory:<name>" (shared-cache in-memory, one process: tests and benchmarks)
     DATABASE_PATH = os.getenv('DATABASE_PATH', str(BASE_DIR / 'qsheet.db'))
+    DATABASE_TEMPLATE = os.getenv('DATABASE_TEMPLATE', '')  # New databases are cloned from this one
+    TMPFS_DIR = os.getenv('TMPFS_DIR', '/dev/shm')
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+    DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))  # Wait this long for the write lock
+    # Apply pending schema migrations when the app starts (false: run migrations.py upgrade yourself)
+    AUTO_MIGRATE = os.getenv('AUTO_MIGRATE', 'true').lower() == 'true'
+
+    # Write queue (group commit through one writer thread per process and region)
+    WRITE_QUEUE_ENABLED = os.getenv('WRITE_QUEUE_ENABLED', 'true').lower() == 'true'
+    WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '50'))  # Max writes per transaction
+    WRITE_BATCH_WAIT_MS = float(os.getenv('WRITE_BATCH_WAIT_MS', '2'))  # Wait for writes to join a batch
+    WRITE_RETRIES = int(os.getenv('WRITE_RETRIES', '5'))  # Retries of a batch while the database is locked
+
+    # Archive of past signups (hot/cold split)
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '180'))
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+    # Keep the archive in a separate <database>-archive.db file instead of the main one
+    ARCHIVE_ATTACHED = os.getenv('ARCHIVE_ATTACHED', 'false').lower() == 'true'
+
+    # Region sharding (optional)
+    # Format: "cherokee=/app/data/cherokee.db,cobb=/app/data/cobb.db" (any DATABASE_PATH form)
+    # When empty, a single region backed by DATABASE_PATH is used.
+    REGION_DATABASES = os.getenv('REGION_DATABASES', '')
+    REGION_ROUTING = os.getenv('REGION_ROUTING', 'prefix')  # 'prefix' or 'subdomain'
+    DEFAULT_REGION = os.getenv('DEFAULT_REGION', '')
 
     # Application Settings
     REGION_NAME = os.getenv('REGION_NAME', 'F3 Cherokee')
     SIGNUP_WINDOW_DAYS = int(os.getenv('SIGNUP_WINDOW_DAYS', '90'))
     REMINDER_DAYS_BEFORE = int(os.getenv('REMINDER_DAYS_BEFORE', '2'))
 
-    # Passwords (will also be stored in DB, but env vars take precedence)
+    # Passwords (defaults for regions without a stored bcrypt hash)
     SIGNUP_PASSWORD = os.getenv('SIGNUP_PASSWORD', 'f3cherokee')
     ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'admin123')
+    SIGNUP_TOKEN_SECONDS = int(os.getenv('SIGNUP_TOKEN_SECONDS', '1800'))  # Skip the password for this long
+    LOGIN_ATTEMPTS_PER_MINUTE = int(os.getenv('LOGIN_ATTEMPTS_PER_MINUTE', '10'))  # Failed per client, 0 to disable
+    PROXY_FIX_X_FOR = int(os.getenv('PROXY_FIX_X_FOR', '0'))  # Trusted X-Forwarded-For hops (reverse proxies)
+
+    # ASGI mode (asgi.py): threads for database calls of async views / for other routes
+    ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', '8'))
+    ASYNC_WSGI_THREADS = int(os.getenv('ASYNC_WSGI_THREADS', '4'))
+
+    # API result limits (streamed responses)
+    API_MAX_ROWS = int(os.getenv('API_MAX_ROWS', '5000'))
+    API_MAX_HOURS = int(os.getenv('API_MAX_HOURS', '720'))  # Look-back cap for /api/notifications/recent
+
+    # Readiness (/readyz): a -wal file larger than this means checkpoints are starved
+    READY_MAX_WAL_MB = int(os.getenv('READY_MAX_WAL_MB', '256'))
+
+    # Admin request profiling (?_profile=1): where profiles go and how many are kept
+    PROFILE_DIR = os.getenv('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+    PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
+
+    # Background tasks (seconds, 0 to disable)
+    ANALYTICS_REFRESH_SECONDS = int(os.getenv('ANALYTICS_REFRESH_SECONDS', '300'))
+    ARCHIVE_INTERVAL_SECONDS = int(os.getenv('ARCHIVE_INTERVAL_SECONDS', '0'))
+    MAINTENANCE_INTERVAL_SECONDS = int(os.getenv('MAINTENANCE_INTERVAL_SECONDS', '3600'))
+    REMINDER_INTERVAL_SECONDS = int(os.getenv('REMINDER_INTERVAL_SECONDS', '3600'))
+    DIGEST_INTERVAL_SECONDS = int(os.getenv('DIGEST_INTERVAL_SECONDS', '0'))  # Checks for a due digest
+    BACKUP_INTERVAL_SECONDS = int(os.getenv('BACKUP_INTERVAL_SECONDS', '0'))
+
+    # Online backups (python backup.py)
+    BACKUP_DIR = os.getenv('BACKUP_DIR', str(BASE_DIR / 'backups'))
+    BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '24'))  # Newest snapshots always kept
+    BACKUP_KEEP_DAYS = int(os.getenv('BACKUP_KEEP_DAYS', '14'))  # Plus the last one of each day
+    BACKUP_PAGES_PER_STEP = int(os.getenv('BACKUP_PAGES_PER_STEP', '256'))
+    BACKUP_STEP_PAUSE_MS = float(os.getenv('BACKUP_STEP_PAUSE_MS', '5'))
+
+    # SQLite maintenance
+    MAINTENANCE_PEAK_HOURS = os.getenv('MAINTENANCE_PEAK_HOURS', '5-8')  # Hours to skip heavy steps
+    MAINTENANCE_VACUUM_PAGES = int(os.getenv('MAINTENANCE_VACUUM_PAGES', '1000'))
 
     # SMTP Configuration
     SMTP_ENABLED = os.getenv('SMTP_ENABLED', 'false').lower() == 'true'
@@ -41,6 +104,12 @@ class Config:
     SMTP_FROM_EMAIL = os.getenv('SMTP_FROM_EMAIL', '')
     SMTP_FROM_NAME = os.getenv('SMTP_FROM_NAME', 'F3 Q-Sheet')
 
+    # Weekly open slots digest (day 0=Sunday)
+    PUBLIC_URL = os.getenv('PUBLIC_URL', '')  # Site URL for links in emails
+    DIGEST_DAY = int(os.getenv('DIGEST_DAY', '0'))
+    DIGEST_HOUR = int(os.getenv('DIGEST_HOUR', '18'))
+    DIGEST_PER_MINUTE = int(os.getenv('DIGEST_PER_MINUTE', '60'))  # Send rate, 0 for unthrottled
+
     # Performance
     SEND_FILE_MAX_AGE_DEFAULT = 31536000  # 1 year for static files
 
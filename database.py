@@ -1,57 +1,576 @@
 """
 Database connection and utilities
 Simple SQLite connection with context manager
+
+Each region lives in its own SQLite file (a "shard") with its own
+connection pool and cache. The region for the current request is held
+in a context variable, so models code never has to pass it around.
+
+A shard's storage is named by its DATABASE_PATH: a file path, a file on
+tmpfs ("tmpfs:<name>") or a shared-cache in-memory database
+("memory:<name>") for tests and benchmarks. Any database can be copied
+into another with the SQLite backup API, so a seeded template comes up in
+milliseconds instead of re-running the schema.
 """
+import os
+import queue
 import sqlite3
-from pathlib import Path
+import sys
+import threading
+import time
 from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
 from config import get_config
 
 config = get_config()
 
+DEFAULT_REGION_KEY = 'default'
+
+_current_region = ContextVar('qsheet_region', default=None)
+
+
+# ==================== STORAGE ====================
+
+MEMORY_PREFIX = 'memory:'
+TMPFS_PREFIX = 'tmpfs:'
+
+
+class FileStorage:
+    """A database file on disk (the default)"""
+
+    kind = 'file'
+    uri = False
+
+    def __init__(self, spec, path=None):
+        self.spec = spec
+        self.database = path or spec
+
+    @property
+    def lock_path(self):
+        """File the writer locks so one process writes at a time"""
+        return f'{self.database}.write-lock'
+
+    @property
+    def archive_database(self):
+        return archive_path_for(self.database)
+
+    def open(self):
+        return sqlite3.connect(
+            self.database,
+            timeout=config.DB_BUSY_TIMEOUT_MS / 1000,  # busy_timeout: wait for the write lock
+            check_same_thread=False,  # Allow multi-threaded access
+            uri=self.uri
+        )
+
+    def exists(self):
+        return os.path.exists(self.database)
+
+    def file_bytes(self, suffix=''):
+        """Size of the database file (or its '-wal' companion), 0 when missing"""
+        try:
+            return os.path.getsize(self.database + suffix)
+        except OSError:
+            return 0
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.database}>'
+
+
+class TmpfsStorage(FileStorage):
+    """A database file in RAM-backed TMPFS_DIR: no disk fsyncs, shared between processes"""
+
+    kind = 'tmpfs'
+
+    def __init__(self, spec, name):
+        super().__init__(spec, os.path.join(config.TMPFS_DIR, f'{name}.db'))
+
+
+class MemoryStorage(FileStorage):
+    """
+    A named shared-cache in-memory database (one process)
+    An anchor connection keeps it alive while pooled connections come and
+    go. Shared-cache locks are per table and fail at once instead of
+    waiting, so connections read uncommitted data rather than block on the
+    writer; fine for tests and benchmarks, not for production.
+    """
+
+    kind = 'memory'
+    uri = True
+    lock_path = None  # Nothing to share with other processes
+
+    def __init__(self, spec, name):
+        super().__init__(spec, f'file:qsheet-{name}?mode=memory&cache=shared')
+        self.name = name
+        self._anchor = None
+        self._lock = threading.Lock()
+
+    @property
+    def archive_database(self):
+        return f'file:qsheet-{self.name}-archive?mode=memory&cache=shared'
+
+    def open(self):
+        with self._lock:
+            if self._anchor is None:
+                self._anchor = self._open()
+                if config.ARCHIVE_ATTACHED:
+                    self._anchor.execute('ATTACH DATABASE ? AS anchor_archive',
+                                         (self.archive_database,))
+        return self._open()
+
+    def _open(self):
+        conn = super().open()
+        conn.execute('PRAGMA read_uncommitted=1')
+        return conn
+
+    def exists(self):
+        if self._anchor is None:
+            return False
+        with self._lock:
+            return self._anchor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'"
+            ).fetchone()[0] > 0
+
+    def file_bytes(self, suffix=''):
+        return None  # No files behind an in-memory database
+
+    def close(self):
+        """Drop the database (once every other connection is closed too)"""
+        with self._lock:
+            if self._anchor is not None:
+                self._anchor.close()
+                self._anchor = None
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def parse_storage(spec):
+    """Storage for a DATABASE_PATH value: "memory:<name>", "tmpfs:<name>" or a file path"""
+    for prefix, storage_class in ((MEMORY_PREFIX, MemoryStorage), (TMPFS_PREFIX, TmpfsStorage)):
+        if spec.startswith(prefix):
+            name = spec[len(prefix):]
+            if not name or os.sep in name:
+                raise ValueError(f"Invalid database name in {spec!r}")
+            return storage_class(spec, name)
+    if spec == ':memory:':
+        raise ValueError("Use memory:<name> for an in-memory database shared by every connection")
+    return FileStorage(spec)
+
+
+def get_storage(spec):
+    """The storage for a DATABASE_PATH value (one per value per process)"""
+    storage = _storages.get(spec)
+    if storage is None:
+        with _storages_lock:
+            storage = _storages.get(spec)
+            if storage is None:
+                storage = _storages[spec] = parse_storage(spec)
+    return storage
+
+
+# ==================== SHARDS ====================
+
+class Shard:
+    """A region's SQLite database with its own connection pool and caches"""
+
+    def __init__(self, region, path, pool_size=4):
+        self.region = region
+        self.path = path
+        self.storage = get_storage(path)
+        self.cache = {}  # Region-scoped in-memory caches
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def connect(self):
+        """Open a new connection to this shard"""
+        return get_db_connection(self.path)
+
+    def acquire(self):
+        """Take a connection from the pool, opening one if the pool is empty"""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn):
+        """Return a connection to the pool (closed if the pool is full)"""
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def idle_connections(self):
+        """Connections waiting in the pool"""
+        return self._pool.qsize()
+
+    def close_all(self):
+        """Close every pooled connection"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __repr__(self):
+        return f'<Shard {self.region} {self.path}>'
+
+
+_shards = None
+_shards_lock = threading.Lock()
+
+
+def parse_region_databases(value):
+    """Parse "name=path,name=path" into an ordered dict of region -> path"""
+    regions = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, path = item.partition('=')
+        if not sep or not name.strip() or not path.strip():
+            raise ValueError(f"Invalid REGION_DATABASES entry: {item!r}")
+        regions[name.strip().lower()] = path.strip()
+    return regions
+
+
+def _load_shards():
+    """Build the shard registry from configuration"""
+    regions = parse_region_databases(config.REGION_DATABASES)
+    if not regions:
+        name = (config.DEFAULT_REGION or DEFAULT_REGION_KEY).lower()
+        regions = {name: config.DATABASE_PATH}
+    return {
+        name: Shard(name, path, config.DB_POOL_SIZE)
+        for name, path in regions.items()
+    }
+
+
+def get_shards():
+    """Get all configured shards, keyed by region name"""
+    global _shards
+    if _shards is None:
+        with _shards_lock:
+            if _shards is None:
+                _shards = _load_shards()
+    return _shards
+
+
+def region_names():
+    """List configured region names"""
+    return list(get_shards().keys())
+
+
+def default_region():
+    """Region used when a request does not name one"""
+    shards = get_shards()
+    name = (config.DEFAULT_REGION or '').lower()
+    return name if name in shards else next(iter(shards))
+
+
+def get_current_region():
+    """Region bound to the current context (falls back to the default)"""
+    return _current_region.get() or default_region()
+
 
-def get_db_connection():
+def get_shard(region=None):
+    """Get the shard for a region (defaults to the current region)"""
+    region = (region or get_current_region()).lower()
+    try:
+        return get_shards()[region]
+    except KeyError:
+        raise LookupError(f"Unknown region: {region}")
+
+
+def set_current_region(region):
+    """Bind a region to the current context, returning a reset token"""
+    get_shard(region)  # Validate
+    return _current_region.set(region.lower())
+
+
+def reset_current_region(token):
+    """Undo a previous set_current_region call"""
+    _current_region.reset(token)
+
+
+@contextmanager
+def use_region(region):
+    """Run a block of code against a specific region's database"""
+    token = set_current_region(region)
+    try:
+        yield get_shard(region)
+    finally:
+        reset_current_region(token)
+
+
+def for_each_region(func, *args, **kwargs):
+    """
+    Run func once per region in parallel, each bound to its own shard
+    Returns a dict of region -> result
+    """
+    names = region_names()
+
+    def run(region):
+        with use_region(region):
+            return func(*args, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        results = executor.map(run, names)
+        return dict(zip(names, results))
+
+
+# ==================== CONNECTIONS ====================
+
+def get_db_connection(path=None):
     """Create a database connection with optimized settings"""
-    conn = sqlite3.connect(
-        config.DATABASE_PATH,
-        check_same_thread=False  # Allow multi-threaded access
-    )
+    storage = get_storage(path) if path else get_shard().storage
+    conn = storage.open()
     conn.row_factory = sqlite3.Row  # Access columns by name
 
     # Performance optimizations
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')  # Only takes effect on new databases
     conn.execute('PRAGMA journal_mode=WAL')  # Write-Ahead Logging for better concurrency
+    conn.execute('PRAGMA journal_size_limit=67108864')  # Truncate -wal back to 64MB after checkpoints
     conn.execute('PRAGMA synchronous=NORMAL')  # Balance between safety and speed
     conn.execute('PRAGMA cache_size=10000')  # Larger cache for better performance
     conn.execute('PRAGMA foreign_keys=ON')  # Enable foreign key constraints
 
+    if config.ARCHIVE_ATTACHED:
+        _attach_archive(conn, storage.archive_database)
+
     return conn
 
 
+# ==================== ARCHIVE ====================
+
+ARCHIVE_SCHEMA = 'archive'
+
+ARCHIVE_COLUMNS = 'id, workout_id, date, q_name, q_email, notes, reminded, created_at, updated_at'
+
+
+def archive_path_for(path):
+    """Path of the separate archive file that goes with a database file"""
+    base, ext = os.path.splitext(path)
+    return f'{base}-archive{ext or ".db"}'
+
+
+def _attach_archive(conn, archive_path):
+    """
+    Attach the archive file and point q_signups_all at it
+    Main-schema views cannot reference attached databases, so a TEMP view
+    (which shadows the main one) is created per connection.
+    """
+    conn.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (archive_path,))
+    conn.executescript(f'''
+        CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.q_signups_archive (
+            id INTEGER PRIMARY KEY,
+            workout_id INTEGER NOT NULL,
+            date DATE NOT NULL,
+            q_name TEXT NOT NULL,
+            q_email TEXT,
+            notes TEXT,
+            reminded BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_date
+            ON q_signups_archive(date);
+        CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_workout_date
+            ON q_signups_archive(workout_id, date);
+        CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_q_name
+            ON q_signups_archive(lower(trim(q_name)));
+        CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_q_email
+            ON q_signups_archive(lower(trim(q_email)));
+        CREATE TEMP VIEW IF NOT EXISTS q_signups_all AS
+            SELECT {ARCHIVE_COLUMNS} FROM main.q_signups
+            UNION ALL
+            SELECT {ARCHIVE_COLUMNS} FROM {ARCHIVE_SCHEMA}.q_signups_archive;
+    ''')
+    _archive_triggers(conn)
+
+
+def _archive_triggers(conn):
+    """
+    TEMP triggers that apply the main-schema workout triggers to the attached archive
+    (main-schema triggers only see main.q_signups_archive). Skipped until the
+    schema exists: init_db closes the pooled connections after creating it.
+    """
+    if not conn.execute(
+        "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = 'workouts'"
+    ).fetchone():
+        return
+    conn.executescript(f'''
+        CREATE TEMP TRIGGER IF NOT EXISTS workouts_delete_archived_attached
+            BEFORE DELETE ON main.workouts
+            WHEN EXISTS (SELECT 1 FROM {ARCHIVE_SCHEMA}.q_signups_archive WHERE workout_id = OLD.id)
+        BEGIN
+            SELECT RAISE(ABORT, 'Workout has archived signups: deactivate it instead');
+        END;
+
+        CREATE TEMP TRIGGER IF NOT EXISTS coverage_workouts_update_location_attached
+            AFTER UPDATE OF location_id ON main.workouts
+            WHEN OLD.location_id != NEW.location_id
+        BEGIN
+            UPDATE coverage_weekly SET covered = covered - (
+                SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.q_signups_archive s
+                WHERE s.workout_id = NEW.id
+                  AND date(s.date, '-6 days', 'weekday 1') = coverage_weekly.week_start
+            )
+            WHERE location_id = OLD.location_id;
+
+            UPDATE coverage_dow SET covered = covered - (
+                SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.q_signups_archive s
+                WHERE s.workout_id = NEW.id
+                  AND CAST(strftime('%w', s.date) AS INTEGER) = coverage_dow.day_of_week
+            )
+            WHERE location_id = OLD.location_id;
+
+            INSERT INTO coverage_weekly (location_id, week_start, covered)
+            SELECT NEW.location_id, date(s.date, '-6 days', 'weekday 1'), COUNT(*)
+            FROM {ARCHIVE_SCHEMA}.q_signups_archive s
+            WHERE s.workout_id = NEW.id
+            GROUP BY date(s.date, '-6 days', 'weekday 1')
+            ON CONFLICT(location_id, week_start) DO UPDATE SET covered = covered + excluded.covered;
+
+            INSERT INTO coverage_dow (location_id, day_of_week, covered)
+            SELECT NEW.location_id, CAST(strftime('%w', s.date) AS INTEGER), COUNT(*)
+            FROM {ARCHIVE_SCHEMA}.q_signups_archive s
+            WHERE s.workout_id = NEW.id
+            GROUP BY CAST(strftime('%w', s.date) AS INTEGER)
+            ON CONFLICT(location_id, day_of_week) DO UPDATE SET covered = covered + excluded.covered;
+        END;
+    ''')
+
+
+# ==================== SQL TRACING ====================
+
+_sql_trace = ContextVar('qsheet_sql_trace', default=None)
+
+
+def start_sql_trace():
+    """
+    Record every db_transaction in the current context (see profiling.py)
+    Returns (trace, token); trace is a list that fills with one dict per
+    transaction: the calling function, wall time and the statements run.
+    """
+    trace = []
+    return trace, _sql_trace.set(trace)
+
+
+def stop_sql_trace(token):
+    _sql_trace.reset(token)
+
+
+def record_sql(caller, started, statements):
+    """Add one timed span to the current trace (no-op when not tracing)"""
+    trace = _sql_trace.get()
+    if trace is not None:
+        trace.append({'caller': caller, 'ms': round((time.perf_counter() - started) * 1000, 3),
+                      'statements': statements})
+
+
+def tracing_sql():
+    """Whether the current context is recording SQL timings"""
+    return _sql_trace.get() is not None
+
+
 @contextmanager
-def db_transaction():
-    """Context manager for database transactions"""
-    conn = get_db_connection()
+def db_transaction(shard=None):
+    """Context manager for database transactions on the current region (or a given shard)"""
+    shard = shard or get_shard()
+    # Only pay for timing while a trace is active (one ContextVar lookup otherwise)
+    traced = _sql_trace.get() is not None
+    if traced:
+        # Frames: 0 this generator, 1 contextlib's __enter__, 2 the caller
+        caller = sys._getframe(2).f_code.co_name
+        started = time.perf_counter()
+        statements = []
+    conn = shard.acquire()
+    if traced:
+        conn.set_trace_callback(statements.append)
     try:
         yield conn
         conn.commit()
     except Exception:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            conn = None
         raise
     finally:
-        conn.close()
+        if traced:
+            if conn is not None:
+                conn.set_trace_callback(None)
+            record_sql(caller, started, statements)
+        if conn is not None:
+            shard.release(conn)
 
 
-def init_db():
-    """Initialize database with schema"""
-    schema_path = Path(__file__).parent / 'schema.sql'
+def database_exists(region=None):
+    """Check whether a region's database has been created"""
+    return get_shard(region).storage.exists()
 
-    with open(schema_path, 'r') as f:
-        schema = f.read()
 
-    with db_transaction() as conn:
-        conn.executescript(schema)
+def init_db(region=None):
+    """
+    Create or upgrade a region's database to the latest schema version
+    A new database is cloned from DATABASE_TEMPLATE when one is configured.
+    """
+    from migrations import upgrade  # Imported here: migrations builds on this module
+
+    shard = get_shard(region)
+    if config.DATABASE_TEMPLATE and not shard.storage.exists():
+        clone_database(config.DATABASE_TEMPLATE, shard.region)
+    with use_region(shard.region):
+        applied = upgrade(verbose=False)
 
-    print(f"Database initialized at {config.DATABASE_PATH}")
+    if applied:
+        shard.close_all()  # Reconnect so per-connection TEMP objects see the new schema
+        print(f"Database initialized at {shard.path} (schema version {applied[-1]})")
+
+
+# ==================== TEMPLATES ====================
+
+def copy_database(source, target, pages=-1):
+    """
+    Copy every page of one connection's main database into another's
+    (SQLite backup API; replaces the target's contents)
+    """
+    source.backup(target, pages=pages)
+
+
+def save_template(spec, region=None):
+    """Copy a region's database (schema and data) to a template database spec"""
+    target = get_storage(spec).open()  # A memory template outlives this connection
+    try:
+        with db_transaction(get_shard(region)) as conn:
+            copy_database(conn, target)
+    finally:
+        target.close()
+
+
+def clone_database(template, region=None):
+    """
+    Replace a region's database with a copy of a template database spec
+    Build the schema and seed data once with save_template (or a prebuilt
+    file), then clone it per test or benchmark run in milliseconds.
+    """
+    shard = get_shard(region)
+    source = get_storage(template).open()
+    try:
+        with db_transaction(shard) as conn:
+            copy_database(source, conn)
+    finally:
+        source.close()
+    shard.cache.clear()  # Cached catalog, settings and cutoffs belong to the old data
+
+
+def init_all_dbs():
+    """Initialize every configured region's database"""
+    for region in region_names():
+        init_db(region)
 
 
 def get_setting(key, default=None):
@@ -67,7 +586,9 @@ def get_setting(key, default=None):
 
 def set_setting(key, value, description=None):
     """Set a setting in the database"""
-    with db_transaction() as conn:
+    import writer  # Imported here: writer builds on this module
+
+    def write(conn):
         if description:
             conn.execute(
                 '''INSERT INTO settings (key, value, description)
@@ -82,8 +603,9 @@ def set_setting(key, value, description=None):
                    ON CONFLICT(key) DO UPDATE SET value = ?''',
                 (key, value, value)
             )
+    writer.execute(write)
 
 
 if __name__ == '__main__':
-    # Initialize database when run directly
-    init_db()
+    # Initialize every region's database when run directly
+    init_all_dbs()
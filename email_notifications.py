@@ -1,57 +1,125 @@
 """
 Email notification system using SMTP
 Simple, standalone email functionality
+
+Reminders are sent by a sweep over every signup due from today through
+reminder_days_before days out that has not been reminded yet, so a missed
+run is caught up by the next one. The sweep runs in-process every
+REMINDER_INTERVAL_SECONDS, or as a daemon or cron job; a job lease keeps
+it to one process per region at a time.
+
+The weekly open-slots digest renders one shared body for every Q and
+sends it over a single throttled SMTP session, recording each recipient
+so an interrupted send resumes where it stopped.
+
+Usage:
+    python email_notifications.py                 # One sweep of every region
+    python email_notifications.py --daemon        # Sweep every REMINDER_INTERVAL_SECONDS
+    python email_notifications.py --region cobb
+    python email_notifications.py --digest        # Send (or resume) this week's digest
+    python email_notifications.py --preview       # Print the digest without sending
 """
+import argparse
 import smtplib
+import sys
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, date, timedelta
-from database import get_setting
+from html import escape
+from pathlib import Path
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from config import get_config
+from database import (db_transaction, get_current_region, get_setting, region_names,
+                      use_region)
+import leases
 import models
+import writer
 
+config = get_config()
 
-def send_email(to_email, subject, body_html, body_text=None):
+REMINDER_LEASE = 'reminders'
+REMINDER_LEASE_SECONDS = 300  # Renewed while a sweep is still sending
+RENEW_EVERY = 10  # Emails sent between lease renewals
+SMTP_TIMEOUT = 30  # Seconds
+
+DIGEST_LEASE = 'digest'
+DIGEST_LEASE_SECONDS = 300
+DIGEST_DAYS = 14
+GREETING_MARKER = '@@GREETING@@'
+TEMPLATES_DIR = Path(__file__).parent / 'templates'
+
+_jinja = None
+
+
+def get_smtp_settings():
     """
-    Send an email using configured SMTP settings
-    Returns True if successful, False otherwise
+    SMTP settings of the current region, or None (with a message) if email is off
+    Username and password are optional, so a local stand-in server (e.g.
+    `python -m aiosmtpd -n -l localhost:1025` with smtp_security=none) works.
     """
     # Check if SMTP is enabled
     smtp_enabled = get_setting('smtp_enabled', '0') == '1'
     if not smtp_enabled:
         print("SMTP is not enabled in settings")
-        return False
+        return None
+
+    settings = {
+        'host': get_setting('smtp_host'),
+        'port': int(get_setting('smtp_port', '587')),
+        'security': get_setting('smtp_security', 'starttls'),
+        'username': get_setting('smtp_username'),
+        'password': get_setting('smtp_password'),
+        'from_email': get_setting('smtp_from_email'),
+        'from_name': get_setting('smtp_from_name', 'F3 Q-Sheet'),
+    }
+    if not all([settings['host'], settings['from_email']]):
+        print("SMTP configuration incomplete")
+        return None
+    return settings
 
-    # Get SMTP configuration
-    smtp_host = get_setting('smtp_host')
-    smtp_port = int(get_setting('smtp_port', '587'))
-    smtp_username = get_setting('smtp_username')
-    smtp_password = get_setting('smtp_password')
-    from_email = get_setting('smtp_from_email')
-    from_name = get_setting('smtp_from_name', 'F3 Q-Sheet')
 
-    if not all([smtp_host, smtp_username, smtp_password, from_email]):
-        print("SMTP configuration incomplete")
+def open_smtp(settings):
+    """Connect and log in to the SMTP server; the session can send many messages"""
+    if settings['security'] == 'ssl':
+        server = smtplib.SMTP_SSL(settings['host'], settings['port'], timeout=SMTP_TIMEOUT)
+    else:
+        server = smtplib.SMTP(settings['host'], settings['port'], timeout=SMTP_TIMEOUT)
+        if settings['security'] == 'starttls':
+            server.starttls()
+    if settings['username']:
+        server.login(settings['username'], settings['password'])
+    return server
+
+
+def build_message(settings, to_email, subject, body_html, body_text=None):
+    """Multipart (text + HTML) message from the configured sender"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = f"{settings['from_name']} <{settings['from_email']}>"
+    msg['To'] = to_email
+
+    # Add plain text and HTML parts
+    if body_text:
+        msg.attach(MIMEText(body_text, 'plain'))
+    msg.attach(MIMEText(body_html, 'html'))
+    return msg
+
+
+def send_email(to_email, subject, body_html, body_text=None):
+    """
+    Send an email using configured SMTP settings
+    Returns True if successful, False otherwise
+    """
+    settings = get_smtp_settings()
+    if settings is None:
         return False
 
     try:
-        # Create message
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = f"{from_name} <{from_email}>"
-        msg['To'] = to_email
-
-        # Add plain text and HTML parts
-        if body_text:
-            part1 = MIMEText(body_text, 'plain')
-            msg.attach(part1)
-
-        part2 = MIMEText(body_html, 'html')
-        msg.attach(part2)
-
-        # Send email
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_username, smtp_password)
+        msg = build_message(settings, to_email, subject, body_html, body_text)
+        with open_smtp(settings) as server:
             server.send_message(msg)
 
         print(f"Email sent successfully to {to_email}")
@@ -62,10 +130,17 @@ def send_email(to_email, subject, body_html, body_text=None):
         return False
 
 
-def send_q_reminder(signup):
-    """Send reminder email to Q before their workout"""
-    if not signup['q_email']:
-        return False
+def _when(workout_date, today=None):
+    """'today', 'tomorrow' or 'in N days' for a workout date"""
+    days = (datetime.strptime(workout_date, '%Y-%m-%d').date() - (today or date.today())).days
+    if days <= 0:
+        return 'today'
+    return 'tomorrow' if days == 1 else f'in {days} days'
+
+
+def build_q_reminder(signup):
+    """(subject, html, text) of a Q's reminder email"""
+    when = _when(signup['date'])
 
     subject = f"Reminder: You're Q'ing at {signup['location_name']} on {signup['date']}"
 
@@ -79,7 +154,7 @@ def send_q_reminder(signup):
         <div style="padding: 20px;">
             <p>Hey <strong>{signup['q_name']}</strong>!</p>
 
-            <p>This is your friendly reminder that you're scheduled to Q in 2 days:</p>
+            <p>This is your friendly reminder that you're scheduled to Q {when}:</p>
 
             <div style="background-color: #f3f4f6; padding: 15px; border-radius: 5px; margin: 20px 0;">
                 <p style="margin: 5px 0;"><strong>Location:</strong> {signup['location_name']}</p>
@@ -112,7 +187,7 @@ Q Reminder
 
 Hey {signup['q_name']}!
 
-This is your friendly reminder that you're scheduled to Q in 2 days:
+This is your friendly reminder that you're scheduled to Q {when}:
 
 Location: {signup['location_name']}
 Address: {signup['address']}
@@ -132,41 +207,356 @@ Thanks for leading the PAX!
 F3 Q-Sheet - Keeping workouts covered
     """
 
-    return send_email(signup['q_email'], subject, body_html, body_text)
+    return subject, body_html, body_text
 
 
-def send_reminders_batch():
+def send_q_reminder(signup):
+    """Send reminder email to Q before their workout"""
+    if not signup['q_email']:
+        return False
+    return send_email(signup['q_email'], *build_q_reminder(signup))
+
+
+# ==================== REMINDER SCHEDULER ====================
+
+def run_reminder_sweep(today=None):
     """
-    Send reminder emails for all upcoming Qs that need reminders
-    This should be run as a daily cron job
+    Send every reminder due from today through reminder_days_before days out
+    Sweeping the whole window catches up on missed runs: a Q whose reminder
+    was missed yesterday still hears from us on the morning of the workout.
+    Only un-reminded signups are read (partial index), and every reminder
+    goes over one SMTP session. Returns the number sent, or None when SMTP
+    is off or another process holds the lease.
     """
-    days_before = int(get_setting('reminder_days_before', '2'))
-    reminder_date = (date.today() + timedelta(days=days_before)).strftime('%Y-%m-%d')
-
-    # Get signups that need reminders
-    with models.db_transaction() as conn:
-        signups = conn.execute(
-            '''SELECT s.*, w.day_of_week, w.time, w.workout_type,
-                      l.name as location_name, l.address
-               FROM q_signups s
-               JOIN workouts w ON s.workout_id = w.id
-               JOIN locations l ON w.location_id = l.id
-               WHERE s.date = ? AND s.reminded = 0 AND s.q_email IS NOT NULL
-               ORDER BY w.time''',
-            (reminder_date,)
-        ).fetchall()
-
-    sent_count = 0
-    for signup in signups:
-        if send_q_reminder(dict(signup)):
-            # Mark as reminded
-            models.update_signup(signup['id'], reminded=True)
+    if get_setting('smtp_enabled', '0') != '1':
+        return None
+    settings = get_smtp_settings()
+    if settings is None or not leases.acquire(REMINDER_LEASE, REMINDER_LEASE_SECONDS):
+        return None
+
+    today = today or date.today()
+    days_before = int(get_setting('reminder_days_before', str(config.REMINDER_DAYS_BEFORE)))
+    start_date = today
+    end_date = today + timedelta(days=days_before)
+    sent_count = failed = 0
+    server = None
+    try:
+        signups = models.get_signups_due_for_reminder(start_date.strftime('%Y-%m-%d'),
+                                                      end_date.strftime('%Y-%m-%d'))
+        for i, signup in enumerate(signups):
+            if i and i % RENEW_EVERY == 0 and not leases.acquire(REMINDER_LEASE, REMINDER_LEASE_SECONDS):
+                print("Reminder lease lost, stopping this sweep")
+                break
+            msg = build_message(settings, signup['q_email'], *build_q_reminder(signup))
+            try:
+                if server is None:
+                    server = open_smtp(settings)
+                try:
+                    server.send_message(msg)
+                except smtplib.SMTPServerDisconnected:
+                    server = open_smtp(settings)  # Dropped idle session: reconnect once
+                    server.send_message(msg)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError,
+                    smtplib.SMTPSenderRefused) as e:
+                print(f"Error sending reminder to {signup['q_email']}: {e}")
+                failed += 1
+                continue
+            except (smtplib.SMTPException, OSError) as e:
+                # The server is unreachable: the next sweep picks up the rest
+                print(f"Error sending reminders: {e}")
+                failed += 1
+                break
+            models.update_signup(signup.id, reminded=True)
             sent_count += 1
-
-    print(f"Sent {sent_count} reminder emails for {reminder_date}")
+    finally:
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        leases.release(REMINDER_LEASE, f'sent {sent_count}, failed {failed}')
+
+    print(f"Sent {sent_count} reminder emails for {start_date} to {end_date}"
+          + (f" ({failed} failed)" if failed else ""))
     return sent_count
 
 
+def send_reminders_batch():
+    """Send reminder emails for all upcoming Qs that need reminders (current region)"""
+    return run_reminder_sweep()
+
+
+def sweep_all_regions():
+    """Run a reminder sweep for every region (used by the background timer)"""
+    results = {}
+    for region in region_names():
+        with use_region(region):
+            results[region] = run_reminder_sweep()
+    return results
+
+
+# ==================== OPEN SLOTS DIGEST ====================
+
+def _jinja_env():
+    global _jinja
+    if _jinja is None:
+        _jinja = Environment(loader=FileSystemLoader(TEMPLATES_DIR),
+                             autoescape=select_autoescape(['html']),
+                             trim_blocks=True, lstrip_blocks=True)
+    return _jinja
+
+
+def get_open_slots(start, days=DIGEST_DAYS):
+    """Active workouts without a Q from start for days, grouped by date"""
+    end = start + timedelta(days=days - 1)
+    workouts_by_day = models.get_workouts_by_day()
+    taken = {(signup.workout_id, signup.date) for signup in models.get_signups_for_date_range(
+        start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+    )}
+
+    open_days = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        day_str = day.strftime('%Y-%m-%d')
+        # Convert Python weekday (Mon=0) to our format (Sun=0)
+        day_of_week = (day.weekday() + 1) % 7
+        workouts = [w for w in workouts_by_day.get(day_of_week, [])
+                    if (w.id, day_str) not in taken]  # Sorted by time, then AO
+        if workouts:
+            open_days.append({'date': day_str, 'day_name': models.get_day_name(day_of_week),
+                              'workouts': workouts})
+    return open_days
+
+
+def get_public_url():
+    """Base URL for links in emails (public_url setting, else PUBLIC_URL plus region prefix)"""
+    url = get_setting('public_url', '')
+    if not url:
+        url = config.PUBLIC_URL.rstrip('/')
+        if config.REGION_ROUTING == 'prefix' and len(region_names()) > 1:
+            url += f'/{get_current_region()}'
+    return url.rstrip('/')
+
+
+def render_digest(open_days):
+    """
+    Render the digest once for every recipient
+    Returns (subject, html, text); html and text are split in two around the
+    greeting so each recipient only costs a short string join.
+    """
+    env = _jinja_env()
+    context = {
+        'days': open_days,
+        'count': sum(len(day['workouts']) for day in open_days),
+        'base_url': get_public_url(),
+        'region_name': get_setting('region_name', config.REGION_NAME),
+        'greeting': GREETING_MARKER,
+    }
+    html = env.get_template('email/open_slots_digest.html').render(**context)
+    text = env.get_template('email/open_slots_digest.txt').render(**context)
+    subject = f"{context['count']} open Q slots in the next two weeks - {context['region_name']}"
+    return subject, html.split(GREETING_MARKER, 1), text.split(GREETING_MARKER, 1)
+
+
+def digest_period(now=None):
+    """Date of the most recent scheduled digest (DIGEST_DAY at DIGEST_HOUR) at or before now"""
+    now = now or datetime.now()
+    # Convert Python weekday (Mon=0) to our format (Sun=0)
+    days_since = ((now.weekday() + 1) % 7 - config.DIGEST_DAY) % 7
+    period = now.date() - timedelta(days=days_since)
+    if days_since == 0 and now.hour < config.DIGEST_HOUR:
+        period -= timedelta(days=7)
+    return period.strftime('%Y-%m-%d')
+
+
+def _start_run(period, open_slots):
+    """
+    The digest run for a period, created with a snapshot of every Q's email on first call
+    Recipients come straight from the signups (archived ones included), not
+    the analytics snapshots, which may not be refreshed yet. A run with no
+    open slots or nobody to send to is finished at once.
+    """
+    def write(conn):
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO digest_runs (period, open_slots) VALUES (?, ?)',
+            (period, open_slots)
+        )
+        run_id = conn.execute('SELECT id FROM digest_runs WHERE period = ?', (period,)).fetchone()[0]
+        if cursor.rowcount:
+            recipients = 0
+            if open_slots:
+                recipients = conn.execute(
+                    '''INSERT OR IGNORE INTO digest_recipients (run_id, email, name)
+                       SELECT ?, lower(trim(q_email)), MAX(q_name)
+                       FROM q_signups_all
+                       WHERE q_email IS NOT NULL AND trim(q_email) != ''
+                       GROUP BY lower(trim(q_email))''',
+                    (run_id,)
+                ).rowcount
+            if not recipients:
+                conn.execute('UPDATE digest_runs SET finished_at = CURRENT_TIMESTAMP WHERE id = ?',
+                             (run_id,))
+        return dict(conn.execute('SELECT * FROM digest_runs WHERE id = ?', (run_id,)).fetchone())
+    return writer.execute(write)
+
+
+def _pending_recipients(run_id):
+    with db_transaction() as conn:
+        return [tuple(row) for row in conn.execute(
+            '''SELECT email, name FROM digest_recipients
+               WHERE run_id = ? AND status = 'pending' ORDER BY email''',
+            (run_id,)
+        )]
+
+
+def _mark_recipient(run_id, email, error=None):
+    writer.execute(lambda conn: conn.execute(
+        '''UPDATE digest_recipients SET status = ?, error = ?, sent_at = CURRENT_TIMESTAMP
+           WHERE run_id = ? AND email = ?''',
+        ('failed' if error else 'sent', error, run_id, email)
+    ))
+
+
+def _skip_pending(run_id):
+    """Drop a resumed run's remaining recipients once no slot is open any more"""
+    writer.execute(lambda conn: conn.execute(
+        "UPDATE digest_recipients SET status = 'skipped' WHERE run_id = ? AND status = 'pending'",
+        (run_id,)
+    ))
+
+
+def _finish_run(run_id):
+    """Close a run once no recipient is pending; returns the run's counts"""
+    def write(conn):
+        conn.execute(
+            '''UPDATE digest_runs SET
+                   sent = (SELECT COUNT(*) FROM digest_recipients WHERE run_id = ?1 AND status = 'sent'),
+                   failed = (SELECT COUNT(*) FROM digest_recipients WHERE run_id = ?1 AND status = 'failed'),
+                   finished_at = CASE WHEN EXISTS (SELECT 1 FROM digest_recipients
+                                                   WHERE run_id = ?1 AND status = 'pending')
+                                      THEN NULL ELSE CURRENT_TIMESTAMP END
+               WHERE id = ?1''',
+            (run_id,)
+        )
+        return dict(conn.execute('SELECT * FROM digest_runs WHERE id = ?', (run_id,)).fetchone())
+    return writer.execute(write)
+
+
+def send_open_slots_digest(period=None, today=None):
+    """
+    Send (or resume) the weekly open-slots digest of the current region
+    Open slots are computed and the body rendered once per call; messages go
+    out over one reused SMTP session at most DIGEST_PER_MINUTE per minute,
+    and each recipient is marked as soon as it is sent, so a restart
+    continues where it stopped. Returns the run's counts, or None when SMTP
+    is off or another process holds the lease.
+    """
+    settings = get_smtp_settings()
+    if settings is None or not leases.acquire(DIGEST_LEASE, DIGEST_LEASE_SECONDS):
+        return None
+
+    period = period or digest_period()
+    run_id = None
+    server = None
+    try:
+        open_days = get_open_slots((today or date.today()) + timedelta(days=1))
+        run = _start_run(period, sum(len(day['workouts']) for day in open_days))
+        run_id = run['id']
+        if run['finished_at']:
+            return run
+        if not open_days:
+            _skip_pending(run_id)  # Nothing left to announce: close the run
+        recipients = _pending_recipients(run_id) if open_days else []
+        if recipients:
+            subject, html, text = render_digest(open_days)
+            server = open_smtp(settings)
+
+        interval = 60.0 / config.DIGEST_PER_MINUTE if config.DIGEST_PER_MINUTE > 0 else 0
+        for i, (email, name) in enumerate(recipients):
+            if i and i % RENEW_EVERY == 0 and not leases.acquire(DIGEST_LEASE, DIGEST_LEASE_SECONDS):
+                print("Digest lease lost, stopping")
+                break
+            started = time.monotonic()
+            greeting = name or 'PAX'
+            msg = build_message(
+                settings, email, subject,
+                html[0] + f'Hey <strong>{escape(greeting)}</strong>,' + html[1],
+                text[0] + f'Hey {greeting},' + text[1],
+            )
+            try:
+                try:
+                    server.send_message(msg)
+                except smtplib.SMTPServerDisconnected:
+                    server = open_smtp(settings)  # Dropped idle session: reconnect once
+                    server.send_message(msg)
+                _mark_recipient(run_id, email)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError,
+                    smtplib.SMTPSenderRefused) as e:
+                _mark_recipient(run_id, email, error=str(e))
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    finally:
+        if server is not None:
+            try:
+                server.quit()
+            except smtplib.SMTPException:
+                pass
+        result = _finish_run(run_id) if run_id is not None else None
+        leases.release(DIGEST_LEASE, result and f"{result['sent']} sent, {result['failed']} failed")
+
+    print(f"Digest {period}: {result['sent']} sent, {result['failed']} failed"
+          + ("" if result['finished_at'] else " (unfinished, will resume)"))
+    return result
+
+
+def digest_all_regions():
+    """Send or resume any due digest in every region (used by the background timer)"""
+    results = {}
+    period = digest_period()
+    for region in region_names():
+        with use_region(region):
+            with db_transaction() as conn:
+                done = conn.execute(
+                    'SELECT 1 FROM digest_runs WHERE period = ? AND finished_at IS NOT NULL',
+                    (period,)
+                ).fetchone()
+            if not done:
+                results[region] = send_open_slots_digest(period)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Send Q reminder emails')
+    parser.add_argument('--digest', action='store_true',
+                        help="Send (or resume) this week's open slots digest instead")
+    parser.add_argument('--preview', action='store_true',
+                        help='Print the digest text without sending it')
+    parser.add_argument('--daemon', action='store_true', help='Keep sweeping on an interval')
+    parser.add_argument('--interval', type=int, default=config.REMINDER_INTERVAL_SECONDS or 3600,
+                        help='Seconds between sweeps with --daemon')
+    parser.add_argument('--region', default=None, help='Only this region (default: all)')
+    args = parser.parse_args(argv)
+
+    if args.digest or args.preview:
+        for region in [args.region] if args.region else region_names():
+            with use_region(region):
+                if args.preview:
+                    open_days = get_open_slots(date.today() + timedelta(days=1))
+                    subject, _, text = render_digest(open_days)
+                    print(f"{region}: {subject}\n" + text[0] + 'Hey PAX,' + text[1])
+                elif send_open_slots_digest() is None:
+                    print(f"{region}: skipped (SMTP disabled or another process is sending)")
+        return 0
+
+    while True:
+        for region in [args.region] if args.region else region_names():
+            with use_region(region):
+                sent = run_reminder_sweep()
+            if sent is None:
+                print(f"{region}: skipped (SMTP disabled or another process is sweeping)")
+        if not args.daemon:
+            return 0
+        time.sleep(args.interval)
+
+
 if __name__ == '__main__':
-    # Run reminder batch when executed directly
-    send_reminders_batch()
+    sys.exit(main())
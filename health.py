@@ -0,0 +1,75 @@
+"""
+Health checks
+Cheap liveness and readiness probes for Docker, load balancers and monitors
+
+/healthz only proves the process answers (no database work). /readyz
+checks every region: a pooled connection answers a trivial query, the
+schema is at the version this code needs, the -wal file has not outgrown
+READY_MAX_WAL_MB (a sign checkpoints are starved) and the workout catalog
+is cached (a cold one is built so traffic lands on a warm cache). Each
+check reports its latency in milliseconds.
+"""
+import time
+
+from config import get_config
+from database import db_transaction, get_shard, region_names, use_region
+from migrations import LATEST_VERSION, REQUIRED_VERSION, get_version
+import models
+
+config = get_config()
+
+
+def _ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def _wal_bytes(shard):
+    """Size of the shard's -wal file (None for in-memory databases)"""
+    return shard.storage.file_bytes('-wal')
+
+
+def check_region():
+    """Readiness checks for the current region: {'ok': bool, 'checks': {...}}"""
+    shard = get_shard()
+    checks = {}
+
+    started = time.perf_counter()
+    try:
+        with db_transaction() as conn:
+            conn.execute('SELECT 1').fetchone()
+            checks['connection'] = {'ok': True, 'ms': _ms(started)}
+            version = get_version(conn)
+    except Exception as e:
+        checks['connection'] = {'ok': False, 'ms': _ms(started), 'error': str(e)}
+        return {'ok': False, 'checks': checks}
+
+    checks['schema'] = {'ok': REQUIRED_VERSION <= version <= LATEST_VERSION,
+                        'version': version, 'required': REQUIRED_VERSION}
+
+    wal_bytes = _wal_bytes(shard)
+    limit = config.READY_MAX_WAL_MB * 1024 * 1024
+    checks['wal'] = {'ok': wal_bytes is None or wal_bytes <= limit,
+                     'bytes': wal_bytes, 'limit': limit}
+
+    warm = 'catalog' in shard.cache
+    started = time.perf_counter()
+    try:
+        models.get_catalog()
+        checks['cache'] = {'ok': True, 'catalog': 'warm' if warm else 'warmed', 'ms': _ms(started),
+                           'idle_connections': shard.idle_connections()}
+    except Exception as e:
+        checks['cache'] = {'ok': False, 'ms': _ms(started), 'error': str(e)}
+
+    return {'ok': all(check['ok'] for check in checks.values()), 'checks': checks}
+
+
+def readiness():
+    """Readiness of every region: (ready, report)"""
+    started = time.perf_counter()
+    regions = {}
+    for region in region_names():
+        with use_region(region):
+            regions[region] = check_region()
+    ready = all(result['ok'] for result in regions.values())
+    return ready, {'status': 'ready' if ready else 'not ready', 'ms': _ms(started),
+                   'regions': regions}
@@ -0,0 +1,59 @@
+"""
+Job leases
+Time-limited leases so only one process (gunicorn worker, container or
+cron run) does a periodic job for a region at a time
+
+A lease is a job_leases row naming its owner and expiry. Taking it succeeds
+when the row is missing, expired or already ours; a process that dies
+mid-job simply lets its lease expire.
+"""
+import os
+import socket
+import time
+
+from database import db_transaction
+import writer
+
+OWNER = f'{socket.gethostname()}:{os.getpid()}'
+
+
+def acquire(name, ttl):
+    """Take (or renew) a lease for ttl seconds; returns False if another process holds it"""
+    now = time.time()
+
+    def write(conn):
+        return conn.execute(
+            '''INSERT INTO job_leases (name, owner, expires_at) VALUES (?, ?, ?)
+               ON CONFLICT(name) DO UPDATE SET owner = excluded.owner,
+                                               expires_at = excluded.expires_at
+               WHERE job_leases.expires_at < ? OR job_leases.owner = excluded.owner''',
+            (name, OWNER, now + ttl, now)
+        ).rowcount == 1
+    return writer.execute(write)
+
+
+def release(name, result=None):
+    """Give up a lease we hold, recording when the job last ran and its result"""
+    writer.execute(lambda conn: conn.execute(
+        '''UPDATE job_leases SET expires_at = 0, last_run_at = CURRENT_TIMESTAMP,
+                                 last_result = ?
+           WHERE name = ? AND owner = ?''',
+        (None if result is None else str(result), name, OWNER)
+    ))
+
+
+def ran_within(name, seconds):
+    """Whether any process finished the job less than `seconds` ago"""
+    with db_transaction() as conn:
+        return conn.execute(
+            "SELECT 1 FROM job_leases WHERE name = ? AND last_run_at > datetime('now', ?)",
+            (name, f'-{int(seconds)} seconds')
+        ).fetchone() is not None
+
+
+def get_leases():
+    """Every lease row of the current region (for status pages)"""
+    with db_transaction() as conn:
+        return [dict(row) for row in conn.execute(
+            'SELECT name, owner, expires_at, last_run_at, last_result FROM job_leases ORDER BY name'
+        )]
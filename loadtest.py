@@ -0,0 +1,393 @@
+"""
+Load test
+Simulates the weekly signup rush against a local gunicorn instance
+
+Builds a synthetic database (sample AOs plus a history of past signups),
+starts gunicorn on it and runs many virtual PAX at once: most load the
+schedule, some submit the signup form and some call /api/signup. A share of
+the signups race for a few popular slots. Reports throughput, latency
+percentiles per request type, status codes, 5xx responses and "database is
+locked" errors found in the server log, so worker/thread counts and SQLite
+settings can be tuned from data.
+
+Usage:
+    python loadtest.py                                # 50 users for 30 seconds
+    python loadtest.py --users 200 --duration 60 --workers 4 --threads 4
+    python loadtest.py --env DB_POOL_SIZE=8 --gunicorn-args "--worker-class gthread"
+    python loadtest.py --asgi                         # uvicorn workers serving asgi.py
+    python loadtest.py --url http://localhost:5000    # Existing server (no log scan)
+"""
+import argparse
+import json
+import os
+import random
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from http.cookiejar import CookieJar
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+
+# Request mix (weights) used when --mix is not given
+DEFAULT_MIX = {'read': 80, 'form': 10, 'api': 10}
+
+READ_PATHS = ['/', '/', '/', '/schedule/week/1', '/api/schedule/week/0', '/locations']
+
+LOCKED_MARKER = 'database is locked'
+
+
+# ==================== SYNTHETIC DATABASE ====================
+
+def build_database(path, history_weeks):
+    """Create a database with the sample AOs and past signups; returns {workout_id: day}"""
+    # config is read at import time, so point it at the new file first
+    os.environ['DATABASE_PATH'] = path
+    os.environ['REGION_DATABASES'] = ''
+    sys.path.insert(0, str(BASE_DIR))
+    import analytics
+    import import_f3_data
+    from database import db_transaction, init_db
+
+    init_db()
+    import_f3_data.import_sample_data()
+
+    with db_transaction() as conn:
+        workouts = [(row['id'], row['day_of_week']) for row in conn.execute(
+            'SELECT id, day_of_week FROM workouts WHERE active = 1'
+        )]
+        names = [f'Pax{i:03d}' for i in range(200)]
+        today = date.today()
+        rows = []
+        for week in range(1, history_weeks + 1):
+            monday = today - timedelta(days=today.weekday(), weeks=week)
+            for workout_id, day_of_week in workouts:
+                name = random.choice(names)
+                day = monday + timedelta(days=(day_of_week - 1) % 7)  # Our format is Sun=0
+                rows.append((workout_id, day.isoformat(),
+                             name, f'{name.lower()}@example.com'))
+        conn.executemany(
+            'INSERT OR IGNORE INTO q_signups (workout_id, date, q_name, q_email) VALUES (?, ?, ?, ?)',
+            rows
+        )
+    analytics.refresh()
+    return dict(workouts)
+
+
+def upcoming_slots(workout_days, weeks):
+    """Every (workout_id, date) in the next few weeks"""
+    today = date.today()
+    monday = today - timedelta(days=today.weekday())
+    slots = []
+    for week in range(weeks):
+        for workout_id, day_of_week in workout_days.items():
+            day = monday + timedelta(days=(day_of_week - 1) % 7, weeks=week)  # Sun=0
+            if day >= today:
+                slots.append((workout_id, day.isoformat()))
+    return slots
+
+
+# ==================== SERVER ====================
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(db_path, port, workers, threads, extra_args, extra_env, log_path, asgi=False):
+    """Start gunicorn on the synthetic database and wait until it answers"""
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_PATH': db_path,
+        'REGION_DATABASES': '',
+    })
+    env.update(extra_env)
+    command = ['gunicorn', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--timeout', '60']
+    if asgi:
+        # Threads come from ASYNC_DB_THREADS / ASYNC_WSGI_THREADS instead
+        command += ['--worker-class', 'uvicorn.workers.UvicornWorker', *extra_args, 'asgi:application']
+    else:
+        command += ['--threads', str(threads), *extra_args, 'app:app']
+    log = open(log_path, 'w')
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited early, see {log_path}")
+        try:
+            urllib.request.urlopen(url + '/', timeout=2).read()
+            return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"gunicorn did not start, see {log_path}")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# ==================== VIRTUAL USERS ====================
+
+class Results:
+    """Thread-safe collection of request outcomes"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.outcomes = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, kind, status, seconds, outcome=None):
+        with self._lock:
+            self.latencies[kind].append(seconds)
+            self.statuses[kind][status] += 1
+            if outcome:
+                self.outcomes[outcome] += 1
+
+
+def _request(opener, url, data=None, json_body=None, headers=None):
+    """Make one request; returns (status, body)"""
+    headers = dict(headers or {})
+    if json_body is not None:
+        data = json.dumps(json_body).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    elif data is not None:
+        data = urllib.parse.urlencode(data).encode('utf-8')
+    request = urllib.request.Request(url, data=data, headers=headers)
+    try:
+        with opener.open(request, timeout=60) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except OSError as e:
+        return f'error:{type(e).__name__}', b''
+
+
+def _form_outcome(status, body):
+    if status != 200:
+        return None
+    if b"You're Signed Up" in body:
+        return 'form_created'
+    if b'already taken' in body or b'already has a Q' in body:
+        return 'form_taken'
+    return 'form_rejected'
+
+
+def _api_outcome(status):
+    return {201: 'api_created', 409: 'api_taken'}.get(status)
+
+
+def virtual_user(base_url, mix, slots, hot_slots, hot_ratio, password, think,
+                 stop_at, results, seed):
+    """One PAX: keeps its own cookies (and signup token) like a browser would"""
+    rng = random.Random(seed)
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    kinds, weights = zip(*mix.items())
+    api_token = None
+    n = 0
+
+    while time.monotonic() < stop_at:
+        kind = rng.choices(kinds, weights)[0]
+        workout_id, day = rng.choice(hot_slots if rng.random() < hot_ratio else slots)
+        name = f'Load{seed:04d}-{n}'
+        n += 1
+        started = time.perf_counter()
+
+        if kind == 'read':
+            status, _ = _request(opener, base_url + rng.choice(READ_PATHS))
+            outcome = None
+        elif kind == 'form':
+            status, body = _request(opener, f'{base_url}/signup/{workout_id}/{day}',
+                                    data={'q_name': name, 'password': password})
+            outcome = _form_outcome(status, body)
+        else:
+            payload = {'workout_id': workout_id, 'date': day, 'q_name': name}
+            if api_token:
+                payload['signup_token'] = api_token
+            else:
+                payload['password'] = password
+            status, body = _request(opener, base_url + '/api/signup', json_body=payload)
+            outcome = _api_outcome(status)
+            if status == 201:
+                api_token = json.loads(body).get('signup_token') or api_token
+
+        results.record(kind, status, time.perf_counter() - started, outcome)
+        if think:
+            time.sleep(rng.uniform(0, think))
+
+
+# ==================== REPORT ====================
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def count_locked_errors(log_path):
+    """Count "database is locked" errors in the gunicorn log"""
+    if not log_path or not os.path.exists(log_path):
+        return None
+    with open(log_path, 'r', errors='replace') as f:
+        return sum(line.count(LOCKED_MARKER) for line in f)
+
+
+def print_report(results, elapsed, locked, settings):
+    total = sum(len(v) for v in results.latencies.values())
+    print()
+    print(f"Settings: {settings}")
+    print(f"Requests: {total} in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+    print()
+    print(f"{'type':<6} {'count':>7} {'req/s':>7} {'p50':>8} {'p90':>8} "
+          f"{'p95':>8} {'p99':>8} {'max':>8}   (ms)")
+    for kind in sorted(results.latencies):
+        values = results.latencies[kind]
+        row = [percentile(values, p) * 1000 for p in (50, 90, 95, 99)] + [max(values) * 1000]
+        print(f"{kind:<6} {len(values):>7} {len(values) / elapsed:>7.1f} "
+              + ' '.join(f'{v:>8.1f}' for v in row))
+
+    print()
+    all_statuses = Counter()
+    for kind, statuses in sorted(results.statuses.items()):
+        all_statuses.update(statuses)
+        print(f"{kind:<6} status: " + ', '.join(
+            f'{status}={count}' for status, count in sorted(statuses.items(), key=str)))
+    server_errors = sum(count for status, count in all_statuses.items()
+                        if isinstance(status, int) and status >= 500)
+    connection_errors = sum(count for status, count in all_statuses.items()
+                            if not isinstance(status, int))
+    print()
+    print(f"5xx responses: {server_errors}")
+    print(f"Connection errors: {connection_errors}")
+    print(f"'database is locked' errors: {'n/a (external server)' if locked is None else locked}")
+    print("Signups: " + ', '.join(f'{k}={v}' for k, v in sorted(results.outcomes.items())))
+    return server_errors
+
+
+# ==================== MAIN ====================
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        if kind.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown request type: {kind}")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def parse_env(values):
+    env = {}
+    for item in values:
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise SystemExit(f"--env expects KEY=VALUE, got {item!r}")
+        env[key] = value
+    return env
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate the weekly signup rush')
+    parser.add_argument('--users', type=int, default=50, help='Concurrent virtual PAX')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='Request weights, e.g. read=80,form=10,api=10')
+    parser.add_argument('--hot-slots', type=int, default=5,
+                        help='Number of popular slots everyone races for')
+    parser.add_argument('--hot-ratio', type=float, default=0.5,
+                        help='Share of signups aimed at the popular slots')
+    parser.add_argument('--weeks', type=int, default=4, help='Weeks of open slots to target')
+    parser.add_argument('--history-weeks', type=int, default=104,
+                        help='Weeks of past signups in the synthetic database')
+    parser.add_argument('--think', type=float, default=0.0,
+                        help='Max random pause between a user\'s requests (seconds)')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=2, help='gunicorn threads per worker')
+    parser.add_argument('--gunicorn-args', default='', help='Extra gunicorn arguments')
+    parser.add_argument('--asgi', action='store_true',
+                        help='Serve asgi:application with uvicorn workers')
+    parser.add_argument('--env', action='append', default=[],
+                        help='Extra server environment, e.g. DB_POOL_SIZE=8 (repeatable)')
+    parser.add_argument('--url', default=None,
+                        help='Test an already running server instead (its database must '
+                             'have the same AOs as the sample data)')
+    parser.add_argument('--password', default=os.getenv('SIGNUP_PASSWORD', 'f3cherokee'))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary directory')
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix='qsheet-loadtest-')
+    db_path = os.path.join(workdir, 'loadtest.db')
+    log_path = None if args.url else os.path.join(workdir, 'gunicorn.log')
+
+    print(f"Building synthetic database ({args.history_weeks} weeks of history)...")
+    workout_days = build_database(db_path, args.history_weeks)
+    slots = upcoming_slots(workout_days, args.weeks)
+    hot_slots = slots[:max(1, args.hot_slots)]
+
+    process = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            process, base_url = start_server(
+                db_path, free_port(), args.workers, args.threads,
+                shlex.split(args.gunicorn_args), parse_env(args.env), log_path, args.asgi
+            )
+        print(f"Running {args.users} users for {args.duration:.0f}s against {base_url}...")
+
+        results = Results()
+        started = time.monotonic()
+        stop_at = started + args.duration
+        users = [
+            threading.Thread(target=virtual_user, daemon=True, args=(
+                base_url, args.mix, slots, hot_slots, args.hot_ratio, args.password,
+                args.think, stop_at, results, args.seed * 100000 + i
+            ))
+            for i in range(args.users)
+        ]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.monotonic() - started
+    finally:
+        if process:
+            stop_server(process)
+
+    settings = (f"users={args.users} workers={args.workers} "
+                f"{'asgi' if args.asgi else f'threads={args.threads}'} "
+                f"mix={args.mix} env={parse_env(args.env) or '{}'}")
+    server_errors = print_report(results, elapsed, count_locked_errors(log_path), settings)
+    if args.keep:
+        print(f"\nDatabase and server log kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if server_errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
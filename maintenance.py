@@ -0,0 +1,253 @@
+"""
+SQLite maintenance
+Keeps long-running databases healthy: refreshes planner statistics
+(PRAGMA optimize), merges the full-text search index, checkpoints the WAL
+so the -wal file does not grow, reclaims free pages with incremental
+vacuum, runs integrity checks and reports size metrics.
+
+Heavy steps are skipped during MAINTENANCE_PEAK_HOURS; only a passive
+checkpoint runs then.
+
+Usage:
+    python maintenance.py                 # Run a maintenance pass now
+    python maintenance.py --report        # Print metrics only
+    python maintenance.py --integrity     # Full integrity check
+    python maintenance.py --analyze       # Full ANALYZE
+    python maintenance.py --enable-incremental-vacuum   # One-time VACUUM to switch modes
+"""
+import argparse
+import sys
+import time
+from datetime import datetime
+
+from config import get_config
+from database import db_transaction, get_shard, region_names, use_region
+import leases
+import writer
+
+config = get_config()
+
+MAINTENANCE_LEASE = 'maintenance'
+MAINTENANCE_LEASE_SECONDS = 1800
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+def parse_peak_hours(value):
+    """Parse "5-8,17-20" into a set of hours (end exclusive)"""
+    hours = set()
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = part.partition('-')
+        start = int(start)
+        end = int(end) if sep else start + 1
+        if end <= start:
+            end += 24
+        hours.update(h % 24 for h in range(start, end))
+    return hours
+
+
+def is_peak_hour(now=None):
+    """Whether heavy maintenance should be avoided right now"""
+    hour = (now or datetime.now()).hour
+    return hour in parse_peak_hours(config.MAINTENANCE_PEAK_HOURS)
+
+
+def get_metrics():
+    """
+    Size and fragmentation metrics for the current region's database
+    File sizes come from the shard's storage (the tmpfs file for tmpfs:
+    paths) and are None for in-memory databases.
+    """
+    storage = get_shard().storage
+    with db_transaction() as conn:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+
+    return {
+        'path': storage.database,
+        'page_size': page_size,
+        'page_count': page_count,
+        'freelist_count': freelist_count,
+        'freelist_percent': (freelist_count / page_count * 100) if page_count else 0,
+        'auto_vacuum': AUTO_VACUUM_MODES.get(auto_vacuum, auto_vacuum),
+        'journal_mode': journal_mode,
+        'db_bytes': storage.file_bytes(),
+        'wal_bytes': storage.file_bytes('-wal'),
+    }
+
+
+def optimize():
+    """Let SQLite re-analyze tables whose statistics are stale"""
+    with db_transaction() as conn:
+        conn.execute('PRAGMA optimize')
+
+
+def analyze():
+    """Full ANALYZE of every table and index"""
+    with db_transaction() as conn:
+        conn.execute('ANALYZE')
+
+
+def checkpoint(mode='PASSIVE'):
+    """
+    Checkpoint the WAL
+    PASSIVE never waits on readers or writers; TRUNCATE also resets the -wal file.
+    Returns (busy, wal_frames, checkpointed_frames).
+    """
+    mode = mode.upper()
+    if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+        raise ValueError(f"Invalid checkpoint mode: {mode}")
+    with db_transaction() as conn:
+        return tuple(conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone())
+
+
+def incremental_vacuum(max_pages=None):
+    """Return free pages to the filesystem (needs auto_vacuum=incremental)"""
+    max_pages = config.MAINTENANCE_VACUUM_PAGES if max_pages is None else max_pages
+    with db_transaction() as conn:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        # execute() only steps the pragma once (one page); executescript runs it to completion
+        conn.executescript(f'PRAGMA incremental_vacuum({int(max_pages)})')
+        after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return before - after
+
+
+def merge_search_index(pages=500):
+    """Merge the signup search index's FTS5 segments (bounded work per call)"""
+    writer.execute(lambda conn: conn.execute(
+        "INSERT INTO q_signups_fts (q_signups_fts, rank) VALUES ('merge', ?)", (int(pages),)
+    ))
+
+
+def integrity_check(quick=True):
+    """Run quick_check (or the full integrity_check); returns a list of problems"""
+    pragma = 'quick_check' if quick else 'integrity_check'
+    with db_transaction() as conn:
+        results = [row[0] for row in conn.execute(f'PRAGMA {pragma}')]
+    return [] if results == ['ok'] else results
+
+
+def enable_incremental_vacuum():
+    """Switch an existing database to auto_vacuum=incremental (runs a full VACUUM)"""
+    with db_transaction() as conn:
+        conn.commit()
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+
+
+def run_maintenance(force=False):
+    """
+    One maintenance pass on the current region
+    Returns a report dict (also kept in the shard cache for status pages).
+    """
+    started = time.monotonic()
+    report = {'ran_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'steps': {}}
+    peak = is_peak_hour() and not force
+    report['peak_hours'] = peak
+
+    if peak:
+        report['steps']['checkpoint'] = checkpoint('PASSIVE')
+    else:
+        optimize()
+        report['steps']['optimize'] = 'ok'
+        merge_search_index()
+        report['steps']['search_index'] = 'merged'
+        report['steps']['vacuumed_pages'] = incremental_vacuum()
+        report['steps']['checkpoint'] = checkpoint('TRUNCATE')
+        problems = integrity_check(quick=True)
+        report['steps']['quick_check'] = problems or 'ok'
+        if problems:
+            print(f"Integrity problems in {get_shard().path}: {problems}")
+
+    report['metrics'] = get_metrics()
+    report['seconds'] = round(time.monotonic() - started, 3)
+    get_shard().cache['maintenance_report'] = report
+    return report
+
+
+def run_scheduled_maintenance():
+    """
+    Timer entry point: one maintenance pass per interval across every
+    worker and container (None when another process holds the lease or
+    already ran it this interval)
+    """
+    if leases.ran_within(MAINTENANCE_LEASE, config.MAINTENANCE_INTERVAL_SECONDS * 0.9):
+        return None
+    if not leases.acquire(MAINTENANCE_LEASE, MAINTENANCE_LEASE_SECONDS):
+        return None
+    report = None
+    try:
+        report = run_maintenance()
+    finally:
+        leases.release(MAINTENANCE_LEASE, report and f"{report['seconds']}s")
+    return report
+
+
+def run_all_regions():
+    """Run a scheduled maintenance pass on every region (used by the background timer)"""
+    results = {}
+    for region in region_names():
+        with use_region(region):
+            results[region] = run_scheduled_maintenance()
+    return results
+
+
+def _print_metrics(metrics):
+    print(f"  database: {metrics['path']}")
+    if metrics['db_bytes'] is None:
+        print(f"  size: in memory ({metrics['page_count']:,} pages x {metrics['page_size']})")
+    else:
+        print(f"  size: {metrics['db_bytes']:,} bytes "
+              f"({metrics['page_count']:,} pages x {metrics['page_size']})")
+        print(f"  wal: {metrics['wal_bytes']:,} bytes")
+    print(f"  freelist: {metrics['freelist_count']:,} pages "
+          f"({metrics['freelist_percent']:.1f}%)")
+    print(f"  auto_vacuum: {metrics['auto_vacuum']}, journal_mode: {metrics['journal_mode']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SQLite maintenance')
+    parser.add_argument('--report', action='store_true', help='Print metrics only')
+    parser.add_argument('--integrity', action='store_true', help='Run a full integrity check')
+    parser.add_argument('--analyze', action='store_true', help='Run a full ANALYZE')
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help='Switch to auto_vacuum=incremental (runs VACUUM, locks the database)')
+    parser.add_argument('--respect-peak', action='store_true',
+                        help='Skip heavy steps during MAINTENANCE_PEAK_HOURS')
+    args = parser.parse_args(argv)
+
+    status = 0
+    for region in region_names():
+        with use_region(region):
+            print(f"{region}:")
+            if args.enable_incremental_vacuum:
+                enable_incremental_vacuum()
+                print("  auto_vacuum set to incremental")
+            if args.analyze:
+                analyze()
+                print("  ANALYZE complete")
+            if args.integrity:
+                problems = integrity_check(quick=False)
+                print(f"  integrity_check: {'ok' if not problems else problems}")
+                status = status or (1 if problems else 0)
+            if args.report:
+                _print_metrics(get_metrics())
+                continue
+
+            report = run_maintenance(force=not args.respect_peak)
+            for step, result in report['steps'].items():
+                print(f"  {step}: {result}")
+            _print_metrics(report['metrics'])
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,586 @@
+"""
+Schema migrations
+Versioned upgrades keyed on PRAGMA user_version
+
+Each migration runs in its own IMMEDIATE transaction, so the write lock is
+held only for that one step, and verifies its result before committing.
+Index changes build the replacement index before dropping the old one, so
+queries never run without an index.
+
+Usage:
+    python migrations.py status          # Show each region's schema version
+    python migrations.py upgrade         # Apply pending migrations
+    python migrations.py upgrade --to 2  # Stop at a version
+    python migrations.py verify          # Re-run every applied migration's checks
+"""
+import argparse
+import functools
+import sqlite3
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+from config import get_config
+from database import db_transaction, get_shard, region_names, use_region
+
+config = get_config()
+
+SCHEMA_PATH = Path(__file__).parent / 'schema.sql'
+
+
+class SchemaVersionError(RuntimeError):
+    """Database schema is older than this code requires"""
+
+
+Migration = namedtuple('Migration', ['version', 'name', 'apply', 'verify'])
+
+
+# ==================== HELPERS ====================
+
+def split_statements(script):
+    """Split an SQL script into complete statements (trigger bodies stay whole)"""
+    statements, current = [], ''
+    for line in script.splitlines(keepends=True):
+        if not current and (not line.strip() or line.strip().startswith('--')):
+            continue
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ''
+    if current.strip():
+        statements.append(current.strip())
+    return statements
+
+
+def run_script(conn, script):
+    """Run a script statement by statement inside the caller's transaction"""
+    for statement in split_statements(script):
+        conn.execute(statement)
+
+
+def _existing(conn, kind):
+    return {row[0] for row in conn.execute(
+        'SELECT name FROM sqlite_master WHERE type = ?', (kind,)
+    )}
+
+
+def require(conn, tables=(), indexes=(), triggers=(), views=(), absent_indexes=()):
+    """Raise if expected schema objects are missing (used by verify steps)"""
+    missing = []
+    for kind, names in (('table', tables), ('index', indexes),
+                        ('trigger', triggers), ('view', views)):
+        existing = _existing(conn, kind)
+        missing += [f'{kind} {name}' for name in names if name not in existing]
+    present = _existing(conn, 'index') & set(absent_indexes)
+    if missing or present:
+        raise SchemaVersionError(
+            f"Migration check failed: missing {missing or 'nothing'}, "
+            f"unexpected {sorted(present) or 'nothing'}"
+        )
+
+
+# ==================== MIGRATIONS ====================
+
+@functools.lru_cache(maxsize=None)
+def _baseline_statements():
+    """schema.sql split into statements (read once per process)"""
+    with open(SCHEMA_PATH, 'r') as f:
+        return tuple(split_statements(f.read()))
+
+
+def _apply_baseline(conn):
+    for statement in _baseline_statements():
+        conn.execute(statement)
+
+
+def _verify_baseline(conn):
+    require(
+        conn,
+        tables=['locations', 'workouts', 'q_signups', 'settings', 'data_versions',
+                'signup_date_versions', 'coverage_slots', 'coverage_weekly',
+                'coverage_dow', 'q_identities', 'q_identity_aliases',
+                'q_identity_locations', 'q_analytics_queue', 'q_signups_archive',
+                'trigger_guards'],
+        views=['q_signups_all'],
+        triggers=['version_signups_insert', 'coverage_signups_insert',
+                  'analytics_signups_insert'],
+    )
+
+
+def _apply_date_index(conn):
+    # Build the replacement first so range queries always have an index
+    run_script(conn, '''
+        CREATE INDEX IF NOT EXISTS idx_signups_date_workout ON q_signups(date, workout_id);
+        DROP INDEX IF EXISTS idx_signups_date;
+        -- Already covered by the UNIQUE(workout_id, date) and
+        -- UNIQUE(location_id, day_of_week, time) autoindexes
+        DROP INDEX IF EXISTS idx_signups_workout;
+        DROP INDEX IF EXISTS idx_workouts_location;
+    ''')
+
+
+def _verify_date_index(conn):
+    require(conn, indexes=['idx_signups_date_workout'],
+            absent_indexes=['idx_signups_date', 'idx_signups_workout',
+                            'idx_workouts_location'])
+
+
+def _apply_password_hashes(conn):
+    from auth import PASSWORD_SETTINGS, hash_password, is_hashed
+    for key, description in PASSWORD_SETTINGS.values():
+        row = conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        if row and not is_hashed(row['value']):
+            conn.execute(
+                '''UPDATE settings SET value = ?, description = ?, updated_at = CURRENT_TIMESTAMP
+                   WHERE key = ?''',
+                (hash_password(row['value']), description, key)
+            )
+
+
+def _verify_password_hashes(conn):
+    from auth import PASSWORD_SETTINGS, is_hashed
+    keys = [key for key, _ in PASSWORD_SETTINGS.values()]
+    plaintext = [row['key'] for row in conn.execute(
+        f"SELECT key, value FROM settings WHERE key IN ({','.join('?' * len(keys))})", keys
+    ) if not is_hashed(row['value'])]
+    if plaintext:
+        raise SchemaVersionError(f"Migration check failed: plaintext passwords in {plaintext}")
+
+
+def _apply_signup_search(conn):
+    # Own copy of the text (location names are not q_signups columns);
+    # rowid is the signup ID. Archiving deletes from q_signups, so archived
+    # signups drop out of the index with it.
+    run_script(conn, '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS q_signups_fts USING fts5(
+            q_name, notes, location_name,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS search_signups_insert
+            AFTER INSERT ON q_signups
+        BEGIN
+            INSERT INTO q_signups_fts (rowid, q_name, notes, location_name)
+            SELECT NEW.id, NEW.q_name, COALESCE(NEW.notes, ''), l.name
+            FROM workouts w JOIN locations l ON w.location_id = l.id
+            WHERE w.id = NEW.workout_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS search_signups_update
+            AFTER UPDATE OF q_name, notes, workout_id ON q_signups
+        BEGIN
+            DELETE FROM q_signups_fts WHERE rowid = OLD.id;
+            INSERT INTO q_signups_fts (rowid, q_name, notes, location_name)
+            SELECT NEW.id, NEW.q_name, COALESCE(NEW.notes, ''), l.name
+            FROM workouts w JOIN locations l ON w.location_id = l.id
+            WHERE w.id = NEW.workout_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS search_signups_delete
+            AFTER DELETE ON q_signups
+        BEGIN
+            DELETE FROM q_signups_fts WHERE rowid = OLD.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS search_locations_rename
+            AFTER UPDATE OF name ON locations
+            WHEN OLD.name != NEW.name
+        BEGIN
+            UPDATE q_signups_fts SET location_name = NEW.name
+            WHERE rowid IN (SELECT s.id FROM q_signups s
+                            JOIN workouts w ON s.workout_id = w.id
+                            WHERE w.location_id = NEW.id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS search_workouts_update_location
+            AFTER UPDATE OF location_id ON workouts
+            WHEN OLD.location_id != NEW.location_id
+        BEGIN
+            UPDATE q_signups_fts
+            SET location_name = (SELECT name FROM locations WHERE id = NEW.location_id)
+            WHERE rowid IN (SELECT id FROM q_signups WHERE workout_id = NEW.id);
+        END;
+
+        DELETE FROM q_signups_fts;
+        INSERT INTO q_signups_fts (rowid, q_name, notes, location_name)
+        SELECT s.id, s.q_name, COALESCE(s.notes, ''), l.name
+        FROM q_signups s
+        JOIN workouts w ON s.workout_id = w.id
+        JOIN locations l ON w.location_id = l.id;
+    ''')
+
+
+def _verify_signup_search(conn):
+    require(conn, tables=['q_signups_fts'],
+            triggers=['search_signups_insert', 'search_signups_update',
+                      'search_signups_delete', 'search_locations_rename',
+                      'search_workouts_update_location'])
+    signups = conn.execute('SELECT COUNT(*) FROM q_signups').fetchone()[0]
+    indexed = conn.execute('SELECT COUNT(*) FROM q_signups_fts').fetchone()[0]
+    if signups != indexed:
+        raise SchemaVersionError(
+            f"Migration check failed: {indexed} of {signups} signups in the search index"
+        )
+
+
+def _apply_location_rtree(conn):
+    # One point box per AO that has coordinates; rowid is the location ID
+    run_script(conn, '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS locations_rtree USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        );
+
+        CREATE TRIGGER IF NOT EXISTS rtree_locations_insert
+            AFTER INSERT ON locations
+            WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+        BEGIN
+            INSERT INTO locations_rtree VALUES
+                (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS rtree_locations_update
+            AFTER UPDATE OF latitude, longitude ON locations
+        BEGIN
+            DELETE FROM locations_rtree WHERE id = OLD.id;
+            INSERT INTO locations_rtree
+            SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+            WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS rtree_locations_delete
+            AFTER DELETE ON locations
+        BEGIN
+            DELETE FROM locations_rtree WHERE id = OLD.id;
+        END;
+
+        DELETE FROM locations_rtree;
+        INSERT INTO locations_rtree
+        SELECT id, latitude, latitude, longitude, longitude FROM locations
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL;
+    ''')
+
+
+def _verify_location_rtree(conn):
+    require(conn, tables=['locations_rtree'],
+            triggers=['rtree_locations_insert', 'rtree_locations_update',
+                      'rtree_locations_delete'])
+    located = conn.execute(
+        'SELECT COUNT(*) FROM locations WHERE latitude IS NOT NULL AND longitude IS NOT NULL'
+    ).fetchone()[0]
+    indexed = conn.execute('SELECT COUNT(*) FROM locations_rtree').fetchone()[0]
+    if located != indexed:
+        raise SchemaVersionError(
+            f"Migration check failed: {indexed} of {located} located AOs in the R*Tree"
+        )
+
+
+def _apply_reminder_index(conn):
+    # Only signups still owed a reminder are indexed, so the index stays tiny
+    # however long the history grows; it replaces the low-selectivity
+    # index on reminded alone
+    run_script(conn, '''
+        CREATE INDEX IF NOT EXISTS idx_signups_reminder_due ON q_signups(date)
+            WHERE reminded = 0 AND q_email IS NOT NULL;
+        DROP INDEX IF EXISTS idx_signups_reminded;
+
+        CREATE TABLE IF NOT EXISTS job_leases (
+            name TEXT PRIMARY KEY,   -- Job name, e.g. 'reminders'
+            owner TEXT NOT NULL,     -- host:pid of the process holding the lease
+            expires_at REAL NOT NULL,
+            last_run_at TIMESTAMP,
+            last_result TEXT
+        );
+    ''')
+
+
+def _verify_reminder_index(conn):
+    require(conn, tables=['job_leases'], indexes=['idx_signups_reminder_due'],
+            absent_indexes=['idx_signups_reminded'])
+
+
+def _apply_digest_tables(conn):
+    run_script(conn, '''
+        -- One row per weekly digest; recipients are snapshotted when it starts
+        -- so an interrupted send resumes with exactly the addresses left
+        CREATE TABLE IF NOT EXISTS digest_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            period DATE NOT NULL UNIQUE, -- Scheduled digest date
+            open_slots INTEGER NOT NULL DEFAULT 0,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0
+        );
+
+        CREATE TABLE IF NOT EXISTS digest_recipients (
+            run_id INTEGER NOT NULL,
+            email TEXT NOT NULL,
+            name TEXT,
+            status TEXT NOT NULL DEFAULT 'pending', -- pending, sent, failed
+            error TEXT,
+            sent_at TIMESTAMP,
+            PRIMARY KEY (run_id, email),
+            FOREIGN KEY (run_id) REFERENCES digest_runs(id) ON DELETE CASCADE
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_digest_recipients_pending
+            ON digest_recipients(run_id, email) WHERE status = 'pending';
+
+        INSERT OR IGNORE INTO settings (key, value, description) VALUES
+            ('smtp_security', 'starttls', 'SMTP connection security: starttls, ssl or none'),
+            ('public_url', '', 'Public site URL used for links in emails');
+    ''')
+
+
+def _verify_digest_tables(conn):
+    require(conn, tables=['digest_runs', 'digest_recipients'],
+            indexes=['idx_digest_recipients_pending'])
+
+
+def _apply_archived_coverage(conn):
+    # Workout deletes and AO moves counted live signups only, so rollups
+    # drifted from rebuild_coverage_rollups() once signups were archived.
+    # Archived history is kept whole: a workout with archived signups cannot be
+    # deleted (deactivate it instead). The ARCHIVE_ATTACHED file is covered by
+    # TEMP triggers created per connection (database._attach_archive).
+    run_script(conn, '''
+        DROP TRIGGER IF EXISTS coverage_workouts_delete;
+        DROP TRIGGER IF EXISTS coverage_workouts_update_location;
+
+        CREATE TRIGGER IF NOT EXISTS workouts_delete_archived
+            BEFORE DELETE ON workouts
+            WHEN EXISTS (SELECT 1 FROM q_signups_archive WHERE workout_id = OLD.id)
+        BEGIN
+            SELECT RAISE(ABORT, 'Workout has archived signups: deactivate it instead');
+        END;
+
+        -- Runs before the cascade removes the workout's signups
+        CREATE TRIGGER IF NOT EXISTS coverage_workouts_delete
+            BEFORE DELETE ON workouts
+        BEGIN
+            UPDATE coverage_slots SET slots = slots - 1
+            WHERE OLD.active = 1
+              AND location_id = OLD.location_id AND day_of_week = OLD.day_of_week;
+
+            UPDATE coverage_weekly SET covered = covered - (
+                SELECT COUNT(*) FROM (
+                    SELECT date FROM q_signups WHERE workout_id = OLD.id
+                    UNION ALL
+                    SELECT date FROM q_signups_archive WHERE workout_id = OLD.id
+                ) s
+                WHERE date(s.date, '-6 days', 'weekday 1') = coverage_weekly.week_start
+            )
+            WHERE location_id = OLD.location_id;
+
+            UPDATE coverage_dow SET covered = covered - (
+                SELECT COUNT(*) FROM (
+                    SELECT date FROM q_signups WHERE workout_id = OLD.id
+                    UNION ALL
+                    SELECT date FROM q_signups_archive WHERE workout_id = OLD.id
+                ) s
+                WHERE CAST(strftime('%w', s.date) AS INTEGER) = coverage_dow.day_of_week
+            )
+            WHERE location_id = OLD.location_id;
+        END;
+
+        -- Moving a workout to another location moves its signup counts with it
+        CREATE TRIGGER IF NOT EXISTS coverage_workouts_update_location
+            AFTER UPDATE OF location_id ON workouts
+            WHEN OLD.location_id != NEW.location_id
+        BEGIN
+            UPDATE coverage_weekly SET covered = covered - (
+                SELECT COUNT(*) FROM (
+                    SELECT date FROM q_signups WHERE workout_id = NEW.id
+                    UNION ALL
+                    SELECT date FROM q_signups_archive WHERE workout_id = NEW.id
+                ) s
+                WHERE date(s.date, '-6 days', 'weekday 1') = coverage_weekly.week_start
+            )
+            WHERE location_id = OLD.location_id;
+
+            UPDATE coverage_dow SET covered = covered - (
+                SELECT COUNT(*) FROM (
+                    SELECT date FROM q_signups WHERE workout_id = NEW.id
+                    UNION ALL
+                    SELECT date FROM q_signups_archive WHERE workout_id = NEW.id
+                ) s
+                WHERE CAST(strftime('%w', s.date) AS INTEGER) = coverage_dow.day_of_week
+            )
+            WHERE location_id = OLD.location_id;
+
+            INSERT INTO coverage_weekly (location_id, week_start, covered)
+            SELECT NEW.location_id, date(s.date, '-6 days', 'weekday 1'), COUNT(*)
+            FROM (
+                SELECT date FROM q_signups WHERE workout_id = NEW.id
+                UNION ALL
+                SELECT date FROM q_signups_archive WHERE workout_id = NEW.id
+            ) s
+            GROUP BY date(s.date, '-6 days', 'weekday 1')
+            ON CONFLICT(location_id, week_start) DO UPDATE SET covered = covered + excluded.covered;
+
+            INSERT INTO coverage_dow (location_id, day_of_week, covered)
+            SELECT NEW.location_id, CAST(strftime('%w', s.date) AS INTEGER), COUNT(*)
+            FROM (
+                SELECT date FROM q_signups WHERE workout_id = NEW.id
+                UNION ALL
+                SELECT date FROM q_signups_archive WHERE workout_id = NEW.id
+            ) s
+            GROUP BY CAST(strftime('%w', s.date) AS INTEGER)
+            ON CONFLICT(location_id, day_of_week) DO UPDATE SET covered = covered + excluded.covered;
+        END;
+
+        -- Repair rollups that already drifted (q_signups_all also reads an
+        -- attached archive file)
+        DELETE FROM coverage_slots;
+        DELETE FROM coverage_weekly;
+        DELETE FROM coverage_dow;
+
+        INSERT INTO coverage_slots (location_id, day_of_week, slots)
+        SELECT location_id, day_of_week, COUNT(*)
+        FROM workouts WHERE active = 1
+        GROUP BY location_id, day_of_week;
+
+        INSERT INTO coverage_weekly (location_id, week_start, covered)
+        SELECT w.location_id, date(s.date, '-6 days', 'weekday 1'), COUNT(*)
+        FROM q_signups_all s
+        JOIN workouts w ON s.workout_id = w.id
+        GROUP BY w.location_id, date(s.date, '-6 days', 'weekday 1');
+
+        INSERT INTO coverage_dow (location_id, day_of_week, covered)
+        SELECT w.location_id, CAST(strftime('%w', s.date) AS INTEGER), COUNT(*)
+        FROM q_signups_all s
+        JOIN workouts w ON s.workout_id = w.id
+        GROUP BY w.location_id, CAST(strftime('%w', s.date) AS INTEGER);
+    ''')
+
+
+def _verify_archived_coverage(conn):
+    require(conn, triggers=['workouts_delete_archived', 'coverage_workouts_delete',
+                            'coverage_workouts_update_location'])
+
+
+MIGRATIONS = [
+    Migration(1, 'Baseline schema (schema.sql)', _apply_baseline, _verify_baseline),
+    Migration(2, 'Covering date index, drop redundant indexes',
+              _apply_date_index, _verify_date_index),
+    Migration(3, 'Store passwords as bcrypt hashes',
+              _apply_password_hashes, _verify_password_hashes),
+    Migration(4, 'Full-text search index for signups (FTS5)',
+              _apply_signup_search, _verify_signup_search),
+    Migration(5, 'R*Tree index of AO coordinates',
+              _apply_location_rtree, _verify_location_rtree),
+    Migration(6, 'Partial index for due reminders, job leases',
+              _apply_reminder_index, _verify_reminder_index),
+    Migration(7, 'Open slots digest progress tables',
+              _apply_digest_tables, _verify_digest_tables),
+    Migration(8, 'Archived signups in workout coverage triggers, keep their workouts',
+              _apply_archived_coverage, _verify_archived_coverage),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+# Oldest schema this code can serve
+REQUIRED_VERSION = LATEST_VERSION
+
+
+# ==================== RUNNER ====================
+
+def get_version(conn=None):
+    """Current schema version of the current region"""
+    if conn is not None:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+    with db_transaction() as conn:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def pending(version=None):
+    """Migrations not yet applied to the current region"""
+    version = get_version() if version is None else version
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def upgrade(target=None, verbose=True):
+    """Apply pending migrations to the current region, one transaction each"""
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    for migration in pending():
+        if migration.version > target:
+            break
+        with db_transaction() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # Re-check under the write lock in case another process got here first
+            if get_version(conn) >= migration.version:
+                continue
+            migration.apply(conn)
+            migration.verify(conn)
+            conn.execute(f'PRAGMA user_version = {int(migration.version)}')
+        applied.append(migration.version)
+        if verbose:
+            print(f"  Applied migration {migration.version}: {migration.name}")
+    return applied
+
+
+def verify():
+    """Re-run the checks of every applied migration; returns a list of failures"""
+    failures = []
+    with db_transaction() as conn:
+        version = get_version(conn)
+        for migration in MIGRATIONS:
+            if migration.version > version:
+                break
+            try:
+                migration.verify(conn)
+            except SchemaVersionError as e:
+                failures.append(f'{migration.version}: {e}')
+    return failures
+
+
+def check_schema(region=None):
+    """Raise SchemaVersionError if a region's schema is too old to serve"""
+    shard = get_shard(region)
+    with use_region(shard.region):
+        version = get_version()
+    if version < REQUIRED_VERSION:
+        raise SchemaVersionError(
+            f"Database {shard.path} is at schema version {version}, "
+            f"but version {REQUIRED_VERSION} is required. "
+            f"Run: python migrations.py upgrade"
+        )
+    if version > LATEST_VERSION:
+        print(f"Warning: {shard.path} is at schema version {version}, "
+              f"newer than this code knows ({LATEST_VERSION})")
+    return version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Schema migrations')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status', help='Show schema versions')
+    up = sub.add_parser('upgrade', help='Apply pending migrations')
+    up.add_argument('--to', type=int, default=None, help='Target version')
+    sub.add_parser('verify', help='Check applied migrations')
+    args = parser.parse_args(argv)
+
+    status = 0
+    for region in region_names():
+        with use_region(region):
+            if args.command == 'status':
+                version = get_version()
+                waiting = [m.version for m in pending(version)]
+                print(f"{region}: version {version} (latest {LATEST_VERSION}), "
+                      f"pending: {waiting or 'none'}")
+            elif args.command == 'upgrade':
+                print(f"{region}:")
+                applied = upgrade(args.to)
+                if not applied:
+                    print("  Up to date")
+            elif args.command == 'verify':
+                failures = verify()
+                print(f"{region}: {'ok' if not failures else failures}")
+                status = status or (1 if failures else 0)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
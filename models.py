@@ -2,40 +2,140 @@
 Data models and database helpers
 Simple functions to interact with the database
 """
+import json
+import math
+import re
+import time
 from datetime import datetime, date, timedelta
-from database import db_transaction
+from database import db_transaction, for_each_region, get_shard
+from records import Location, Workout, Signup
+import writer
+
+ARCHIVE_CUTOFF_TTL = 60  # Seconds to cache the archive cutoff per region
+STREAM_BATCH_SIZE = 500  # Rows per fetchmany() when streaming results
+SEARCH_PAGE_SIZE = 50  # Signups per page of search results
+MAX_SEARCH_WORDS = 8
+EARTH_RADIUS_KM = 6371.0
+NEARBY_RADIUS_KM = 25  # Default search radius
+NEARBY_MAX_RADIUS_KM = 400  # Largest radius, also the limit of ?expand=1 widening
+
+LOCATION_COLUMNS = ', '.join(f'l.{name}' for name in Location._fields)
+WORKOUT_COLUMNS = ', '.join(f'w.{name}' for name in Workout._fields)
+SIGNUP_COLUMNS = ', '.join(f's.{name}' for name in Signup._fields)
+
+
+def _tuples(conn, query, params=()):
+    """Run a query returning plain tuples (records are built from them directly)"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor.execute(query, params)
+
+
+def _workouts(rows):
+    """Workouts from rows of workout + location columns, sharing one Location per AO"""
+    split = len(Workout._fields)
+    locations = {}
+    workouts = []
+    for row in rows:
+        location = locations.get(row[1])
+        if location is None:
+            location = locations[row[1]] = Location(*row[split:])
+        workouts.append(Workout(*row[:split], location=location))
+    return workouts
+
+
+# ==================== CATALOG ====================
+
+class Catalog:
+    """
+    One region's locations and workouts, indexed for schedule lookups
+    Rebuilt only when the locations or workouts change version moves
+    (triggers bump it on every insert, update and delete). Records are
+    shared between requests: treat them as read-only.
+    """
+
+    def __init__(self, version, location_rows, workout_rows):
+        self.version = version
+        self.locations = {row[0]: Location(*row) for row in location_rows}  # By ID, in name order
+        workouts = sorted(
+            (Workout(*row, location=self.locations.get(row[1])) for row in workout_rows),
+            key=lambda w: (w.location.name, w.day_of_week, w.time)
+        )
+        self.workouts = {workout.id: workout for workout in workouts}
+        self.active = [w for w in workouts if w.active and w.location.active]
+        self.by_day = {}
+        for workout in sorted(self.active, key=lambda w: w.time):  # Stable: AO name order within a time
+            self.by_day.setdefault(workout.day_of_week, []).append(workout)
+        self.by_location = {}
+        for workout in workouts:
+            self.by_location.setdefault(workout.location_id, []).append(workout)
+
+
+def _catalog_version(conn):
+    """Versions only ever increase, so any catalog change moves the sum"""
+    return conn.execute(
+        "SELECT SUM(version) FROM data_versions WHERE name IN ('locations', 'workouts')"
+    ).fetchone()[0]
+
+
+def _catalog(conn, shard=None):
+    """The shard's catalog, rebuilt when its change version has moved"""
+    cache = (shard or get_shard()).cache
+    version = _catalog_version(conn)
+    catalog = cache.get('catalog')
+    if catalog is None or catalog.version != version:
+        catalog = Catalog(
+            version,
+            _tuples(conn, f'SELECT {LOCATION_COLUMNS} FROM locations l ORDER BY l.name'),
+            _tuples(conn, f'SELECT {WORKOUT_COLUMNS} FROM workouts w')
+        )
+        cache['catalog'] = catalog
+    return catalog
+
+
+def get_catalog():
+    """The current region's catalog of locations and workouts"""
+    with db_transaction() as conn:
+        return _catalog(conn)
+
+
+def _workout_map(conn, shard=None):
+    """Every workout (active or not) by ID, for attaching to signups"""
+    return _catalog(conn, shard).workouts
+
+
+def _signups(conn, query, params=()):
+    """Signups for a query selecting SIGNUP_COLUMNS, each referencing its Workout"""
+    workouts = _workout_map(conn)
+    return [Signup(*row, workout=workouts.get(row[1]))
+            for row in _tuples(conn, query, params)]
 
 
 # ==================== LOCATIONS ====================
 
 def get_all_locations(active_only=True):
-    """Get all locations, optionally filtered by active status"""
-    with db_transaction() as conn:
-        query = 'SELECT * FROM locations'
-        if active_only:
-            query += ' WHERE active = 1'
-        query += ' ORDER BY name'
-        return conn.execute(query).fetchall()
+    """Get all locations, optionally filtered by active status (from the catalog)"""
+    locations = get_catalog().locations.values()
+    if active_only:
+        return [location for location in locations if location.active]
+    return list(locations)
 
 
 def get_location(location_id):
-    """Get a single location by ID"""
-    with db_transaction() as conn:
-        return conn.execute(
-            'SELECT * FROM locations WHERE id = ?',
-            (location_id,)
-        ).fetchone()
+    """Get a single location by ID (from the catalog)"""
+    return get_catalog().locations.get(location_id)
 
 
 def create_location(name, address, region='Cherokee', latitude=None, longitude=None):
     """Create a new location"""
-    with db_transaction() as conn:
+    def write(conn):
         cursor = conn.execute(
             '''INSERT INTO locations (name, address, region, latitude, longitude)
                VALUES (?, ?, ?, ?, ?)''',
             (name, address, region, latitude, longitude)
         )
         return cursor.lastrowid
+    return writer.execute(write)
 
 
 def update_location(location_id, **kwargs):
@@ -49,68 +149,56 @@ def update_location(location_id, **kwargs):
     set_clause = ', '.join([f'{k} = ?' for k in updates.keys()])
     values = list(updates.values()) + [location_id]
 
-    with db_transaction() as conn:
-        conn.execute(
-            f'UPDATE locations SET {set_clause} WHERE id = ?',
-            values
-        )
-        return True
+    writer.execute(lambda conn: conn.execute(
+        f'UPDATE locations SET {set_clause} WHERE id = ?',
+        values
+    ))
+    return True
 
 
 def delete_location(location_id):
-    """Delete a location (will cascade to workouts and signups)"""
-    with db_transaction() as conn:
-        conn.execute('DELETE FROM locations WHERE id = ?', (location_id,))
+    """Delete a location (will cascade to workouts and signups; refused if any have archived signups)"""
+    writer.execute(lambda conn: conn.execute(
+        'DELETE FROM locations WHERE id = ?', (location_id,)
+    ))
 
 
 # ==================== WORKOUTS ====================
 
 def get_workouts_by_location(location_id, active_only=True):
-    """Get all workouts for a location"""
-    with db_transaction() as conn:
-        query = '''SELECT w.*, l.name as location_name
-                   FROM workouts w
-                   JOIN locations l ON w.location_id = l.id
-                   WHERE w.location_id = ?'''
-        if active_only:
-            query += ' AND w.active = 1'
-        query += ' ORDER BY w.day_of_week, w.time'
-        return conn.execute(query, (location_id,)).fetchall()
+    """Get all workouts for a location (from the catalog)"""
+    workouts = get_catalog().by_location.get(location_id, [])
+    if active_only:
+        return [workout for workout in workouts if workout.active]
+    return list(workouts)
 
 
 def get_all_workouts(active_only=True):
-    """Get all workouts with location info"""
-    with db_transaction() as conn:
-        query = '''SELECT w.*, l.name as location_name, l.address
-                   FROM workouts w
-                   JOIN locations l ON w.location_id = l.id'''
-        if active_only:
-            query += ' WHERE w.active = 1 AND l.active = 1'
-        query += ' ORDER BY l.name, w.day_of_week, w.time'
-        return conn.execute(query).fetchall()
+    """Get all workouts with location info, by AO name, day and time (from the catalog)"""
+    catalog = get_catalog()
+    return list(catalog.active if active_only else catalog.workouts.values())
+
+
+def get_workouts_by_day():
+    """Active workouts by day of week (0=Sunday), each day sorted by time"""
+    return get_catalog().by_day
 
 
 def get_workout(workout_id):
-    """Get a single workout by ID"""
-    with db_transaction() as conn:
-        return conn.execute(
-            '''SELECT w.*, l.name as location_name, l.address
-               FROM workouts w
-               JOIN locations l ON w.location_id = l.id
-               WHERE w.id = ?''',
-            (workout_id,)
-        ).fetchone()
+    """Get a single workout by ID (from the catalog)"""
+    return get_catalog().workouts.get(workout_id)
 
 
 def create_workout(location_id, day_of_week, time, workout_type='Boot Camp'):
     """Create a new workout schedule"""
-    with db_transaction() as conn:
+    def write(conn):
         cursor = conn.execute(
             '''INSERT INTO workouts (location_id, day_of_week, time, workout_type)
                VALUES (?, ?, ?, ?)''',
             (location_id, day_of_week, time, workout_type)
         )
         return cursor.lastrowid
+    return writer.execute(write)
 
 
 def update_workout(workout_id, **kwargs):
@@ -124,60 +212,174 @@ def update_workout(workout_id, **kwargs):
     set_clause = ', '.join([f'{k} = ?' for k in updates.keys()])
     values = list(updates.values()) + [workout_id]
 
-    with db_transaction() as conn:
-        conn.execute(
-            f'UPDATE workouts SET {set_clause} WHERE id = ?',
-            values
-        )
-        return True
+    writer.execute(lambda conn: conn.execute(
+        f'UPDATE workouts SET {set_clause} WHERE id = ?',
+        values
+    ))
+    return True
 
 
 def delete_workout(workout_id):
-    """Delete a workout (will cascade to signups)"""
+    """Delete a workout (will cascade to signups; refused if it has archived signups)"""
+    writer.execute(lambda conn: conn.execute(
+        'DELETE FROM workouts WHERE id = ?', (workout_id,)
+    ))
+
+
+# ==================== NEARBY ====================
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance in kilometres"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _bounding_boxes(lat, lon, radius_km):
+    """
+    (min_lat, max_lat, min_lon, max_lon) boxes together containing every point within radius_km
+    A box crossing the antimeridian is split in two, one each side of ±180°.
+    """
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    # Longitude degrees shrink towards the poles; near them, take every longitude
+    cos_lat = math.cos(math.radians(lat))
+    dlon = 180.0 if cos_lat < 0.01 else min(180.0, dlat / cos_lat)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if dlon >= 180.0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+    if min_lon < -180.0:
+        return [(min_lat, max_lat, -180.0, max_lon), (min_lat, max_lat, min_lon + 360.0, 180.0)]
+    if max_lon > 180.0:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360.0)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+def get_nearby_workouts(lat, lon, radius_km=NEARBY_RADIUS_KM, day_of_week=None,
+                        time_from=None, time_to=None):
+    """
+    Active workouts within radius_km of a point, as (distance_km, workout), nearest first
+    Bounding boxes on locations_rtree (split at the antimeridian) find
+    candidate AOs; exact distances rank them and drop the box corners.
+    Optional filters: day of week (0=Sunday) and a start time window
+    ('05:00' to '06:00').
+    """
+    if not math.isfinite(radius_km):
+        raise ValueError(f"radius_km must be finite, got {radius_km}")
+    conditions, params = ['w.active = 1', 'l.active = 1'], []
+    if day_of_week is not None:
+        conditions.append('w.day_of_week = ?')
+        params.append(day_of_week)
+    if time_from:
+        conditions.append('w.time >= ?')
+        params.append(time_from)
+    if time_to:
+        conditions.append('w.time <= ?')
+        params.append(time_to)
+
+    workouts = {}
     with db_transaction() as conn:
-        conn.execute('DELETE FROM workouts WHERE id = ?', (workout_id,))
+        for box in _bounding_boxes(lat, lon, radius_km):
+            workouts.update((w.id, w) for w in _workouts(_tuples(
+                conn,
+                f'''SELECT {WORKOUT_COLUMNS}, {LOCATION_COLUMNS}
+                    FROM locations_rtree r
+                    JOIN locations l ON l.id = r.id
+                    JOIN workouts w ON w.location_id = l.id
+                    WHERE r.max_lat >= ? AND r.min_lat <= ?
+                      AND r.max_lon >= ? AND r.min_lon <= ?
+                      AND {' AND '.join(conditions)}''',
+                list(box) + params
+            )))
+
+    nearby = [(distance_km(lat, lon, w.location.latitude, w.location.longitude), w)
+              for w in workouts.values()]
+    nearby = [item for item in nearby if item[0] <= radius_km]
+    nearby.sort(key=lambda item: (item[0], item[1].day_of_week, item[1].time))
+    return nearby
 
 
 # ==================== Q SIGNUPS ====================
 
+def get_archive_cutoff():
+    """Dates before this may be in the archive (None if nothing was archived)"""
+    cache = get_shard().cache
+    cached = cache.get('archive_cutoff')
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    with db_transaction() as conn:
+        row = conn.execute(
+            "SELECT value FROM settings WHERE key = 'archive_cutoff'"
+        ).fetchone()
+    cutoff = row['value'] if row else None
+    cache['archive_cutoff'] = (cutoff, time.monotonic() + ARCHIVE_CUTOFF_TTL)
+    return cutoff
+
+
+def _signups_source(start_date):
+    """Live table for recent ranges, live + archive view for ranges reaching into history"""
+    cutoff = get_archive_cutoff()
+    return 'q_signups_all' if cutoff and start_date < cutoff else 'q_signups'
+
+
 def get_signups_for_date_range(start_date, end_date):
     """Get all Q signups within a date range with workout and location info"""
     with db_transaction() as conn:
-        return conn.execute(
-            '''SELECT s.*, w.day_of_week, w.time, w.workout_type,
-                      l.name as location_name, l.address
-               FROM q_signups s
-               JOIN workouts w ON s.workout_id = w.id
-               JOIN locations l ON w.location_id = l.id
-               WHERE s.date >= ? AND s.date <= ?
-               ORDER BY s.date, w.time''',
+        signups = _signups(
+            conn,
+            f'''SELECT {SIGNUP_COLUMNS}
+                FROM {_signups_source(start_date)} s
+                WHERE s.date >= ? AND s.date <= ?
+                ORDER BY s.date''',
             (start_date, end_date)
-        ).fetchall()
+        )
+    # Times come from the cached catalog instead of a JOIN on workouts
+    signups.sort(key=lambda signup: (signup.date, signup.time or ''))
+    return signups
+
+
+def get_signups_for_workouts(workout_ids, start_date, end_date):
+    """Signups for a set of workouts within a date range"""
+    with db_transaction() as conn:
+        return _signups(
+            conn,
+            f'''SELECT {SIGNUP_COLUMNS}
+                FROM q_signups s
+                WHERE s.workout_id IN (SELECT value FROM json_each(?))
+                  AND s.date >= ? AND s.date <= ?''',
+            (json.dumps(list(workout_ids)), start_date, end_date)
+        )
 
 
 def get_signup_for_workout_date(workout_id, workout_date):
     """Get signup for a specific workout on a specific date"""
     with db_transaction() as conn:
-        return conn.execute(
-            '''SELECT s.*, w.day_of_week, w.time, w.workout_type,
-                      l.name as location_name
-               FROM q_signups s
-               JOIN workouts w ON s.workout_id = w.id
-               JOIN locations l ON w.location_id = l.id
-               WHERE s.workout_id = ? AND s.date = ?''',
+        signups = _signups(
+            conn,
+            f'''SELECT {SIGNUP_COLUMNS}
+                FROM q_signups s
+                WHERE s.workout_id = ? AND s.date = ?''',
             (workout_id, workout_date)
-        ).fetchone()
+        )
+        return signups[0] if signups else None
 
 
 def create_signup(workout_id, workout_date, q_name, q_email=None, notes=None):
-    """Create a new Q signup"""
-    with db_transaction() as conn:
+    """
+    Create a new Q signup
+    Returns the new signup's ID, or None if someone else took the slot first.
+    """
+    def write(conn):
         cursor = conn.execute(
             '''INSERT INTO q_signups (workout_id, date, q_name, q_email, notes)
-               VALUES (?, ?, ?, ?, ?)''',
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(workout_id, date) DO NOTHING''',
             (workout_id, workout_date, q_name, q_email, notes)
         )
-        return cursor.lastrowid
+        return cursor.lastrowid if cursor.rowcount else None
+    return writer.execute(write)
 
 
 def update_signup(signup_id, **kwargs):
@@ -191,18 +393,152 @@ def update_signup(signup_id, **kwargs):
     set_clause = ', '.join([f'{k} = ?' for k in updates.keys()])
     values = list(updates.values()) + [signup_id]
 
-    with db_transaction() as conn:
-        conn.execute(
-            f'UPDATE q_signups SET {set_clause} WHERE id = ?',
-            values
-        )
-        return True
+    writer.execute(lambda conn: conn.execute(
+        f'UPDATE q_signups SET {set_clause} WHERE id = ?',
+        values
+    ))
+    return True
 
 
 def delete_signup(signup_id):
     """Delete a Q signup"""
+    writer.execute(lambda conn: conn.execute(
+        'DELETE FROM q_signups WHERE id = ?', (signup_id,)
+    ))
+
+
+def get_recent_signups(since, limit=None):
+    """Signups created since a timestamp, newest first (for notifications)"""
+    return list(iter_recent_signups(since, limit))
+
+
+def get_signups_needing_reminder(reminder_date):
+    """Signups on a date whose Q has an email and has not been reminded"""
+    with db_transaction() as conn:
+        return _signups(
+            conn,
+            f'''SELECT {SIGNUP_COLUMNS}
+                FROM q_signups s
+                JOIN workouts w ON s.workout_id = w.id
+                WHERE s.date = ? AND s.reminded = 0 AND s.q_email IS NOT NULL
+                ORDER BY w.time''',
+            (reminder_date,)
+        )
+
+
+def get_signups_due_for_reminder(start_date, end_date):
+    """Signups in a date range whose Q has an email and has not been reminded (partial index)"""
+    with db_transaction() as conn:
+        return _signups(
+            conn,
+            f'''SELECT {SIGNUP_COLUMNS}
+                FROM q_signups s
+                WHERE s.reminded = 0 AND s.q_email IS NOT NULL
+                  AND s.date >= ? AND s.date <= ?
+                ORDER BY s.date, s.workout_id''',
+            (start_date, end_date)
+        )
+
+
+def _iter_signups(query, params=(), limit=None, batch_size=STREAM_BATCH_SIZE):
+    """
+    Lazily yield signups for a query selecting SIGNUP_COLUMNS
+    Rows are fetched batch_size at a time on a connection held only while
+    the caller iterates. The region is resolved now, not on first iteration,
+    so the generator can be consumed after the request's region binding ends.
+    """
+    shard = get_shard()
+    if limit is not None:
+        query += ' LIMIT ?'
+        params = tuple(params) + (limit,)
+
+    def generate():
+        with db_transaction(shard) as conn:
+            workouts = _workout_map(conn, shard)
+            cursor = _tuples(conn, query, params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        return
+                    for row in rows:
+                        yield Signup(*row, workout=workouts.get(row[1]))
+            finally:
+                cursor.close()
+    return generate()
+
+
+def iter_recent_signups(since, limit=None):
+    """Lazily yield signups created since a timestamp, newest first, at most limit rows"""
+    return _iter_signups(
+        f'''SELECT {SIGNUP_COLUMNS}
+            FROM q_signups s
+            WHERE s.created_at >= ?
+            ORDER BY s.created_at DESC''',
+        (since,), limit
+    )
+
+
+def iter_all_signups(start_date=None, end_date=None):
+    """Stream every signup (live and archived), oldest first, for exports"""
+    query = f'''SELECT {SIGNUP_COLUMNS}
+                 FROM q_signups_all s
+                 WHERE s.date >= ? AND s.date <= ?
+                 ORDER BY s.date, s.workout_id'''
+    return _iter_signups(query, (start_date or '0000-00-00', end_date or '9999-99-99'))
+
+
+def search_terms(text, column=None):
+    """
+    FTS5 query for free text: every word must match as a prefix
+    Quoting each word keeps FTS5 operators and punctuation in user input
+    from being parsed as query syntax. Returns None when there are no words.
+    """
+    words = re.findall(r'\w+', text or '')[:MAX_SEARCH_WORDS]
+    if not words:
+        return None
+    query = ' '.join(f'"{word}"*' for word in words)
+    return f'{column} : ({query})' if column else query
+
+
+def search_signups(text=None, start_date=None, after=None, limit=SEARCH_PAGE_SIZE,
+                   name_only=False):
+    """
+    One keyset page of live signups on or after start_date, by date and workout
+    text filters through the q_signups_fts index (Q name, notes and AO name,
+    or only the Q name with name_only). after is the (date, workout_id) key of
+    the previous page's last row. Returns (signups, next_key), next_key being
+    None on the last page; each page reads at most limit + 1 rows in index order.
+    """
+    conditions, params = [], []
+    if text is not None:
+        match = search_terms(text, 'q_name' if name_only else None)
+        if match is None:
+            return [], None
+        conditions.append('s.id IN (SELECT rowid FROM q_signups_fts WHERE q_signups_fts MATCH ?)')
+        params.append(match)
+    if start_date:
+        conditions.append('s.date >= ?')
+        params.append(start_date)
+    if after:
+        conditions.append('(s.date, s.workout_id) > (?, ?)')
+        params.extend(after)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
     with db_transaction() as conn:
-        conn.execute('DELETE FROM q_signups WHERE id = ?', (signup_id,))
+        signups = _signups(
+            conn,
+            f'''SELECT {SIGNUP_COLUMNS}
+                FROM q_signups s
+                {where}
+                ORDER BY s.date, s.workout_id
+                LIMIT ?''',
+            params + [limit + 1]
+        )
+    if len(signups) > limit:
+        last = signups[limit - 1]
+        return signups[:limit], (last.date, last.workout_id)
+    return signups, None
 
 
 def get_empty_slots(start_date, end_date):
@@ -220,34 +556,195 @@ def get_empty_slots(start_date, end_date):
         ).fetchall()
 
 
-# ==================== STATISTICS ====================
+# ==================== BULK ADMIN ====================
+
+class BulkActionError(ValueError):
+    """A bulk action that cannot be applied as requested"""
+
+
+# Each target's filters (name -> condition on the unaliased table, ANDed together)
+# and the columns a bulk UPDATE may set; targets without changes are DELETEs
+BULK_TARGETS = {
+    'workouts': {
+        'table': 'workouts',
+        'filters': {
+            'location_id': 'location_id = ?',
+            'day_of_week': 'day_of_week = ?',
+            'time': 'time = ?',
+            'workout_type': 'workout_type = ?',
+            'active': 'active = ?',
+        },
+        'changes': ('time', 'workout_type', 'active'),
+    },
+    'locations': {
+        'table': 'locations',
+        'filters': {
+            'location_id': 'id = ?',
+            'region': 'region = ?',
+            'active': 'active = ?',
+        },
+        'changes': ('active',),
+    },
+    'signups': {
+        'table': 'q_signups',
+        'filters': {
+            'start': 'date >= ?',
+            'end': 'date <= ?',
+            'location_id': 'workout_id IN (SELECT id FROM workouts WHERE location_id = ?)',
+            'day_of_week': 'workout_id IN (SELECT id FROM workouts WHERE day_of_week = ?)',
+            'time': 'workout_id IN (SELECT id FROM workouts WHERE time = ?)',
+        },
+        'required': ('start', 'end'),  # Never an unbounded delete
+        'changes': (),
+    },
+}
+BULK_PREVIEW_ROWS = 50
+
+
+def _bulk_statement(kind, filters, changes=None):
+    """(target, WHERE clause, params, SET values) for a bulk action, validated"""
+    target = BULK_TARGETS.get(kind)
+    if target is None:
+        raise BulkActionError(f"Unknown bulk target: {kind}")
+    filters = {k: v for k, v in filters.items() if v is not None}
+    changes = {k: v for k, v in (changes or {}).items() if v is not None}
+
+    unknown = set(filters) - set(target['filters']) or set(changes) - set(target['changes'])
+    if unknown:
+        raise BulkActionError(f"Unknown field for {kind}: {', '.join(sorted(unknown))}")
+    missing = [name for name in target.get('required', ()) if name not in filters]
+    if missing:
+        raise BulkActionError(f"Bulk {kind} need a {' and '.join(missing)} filter")
+    if not filters:
+        raise BulkActionError("Choose at least one filter")
+    if target['changes'] and not changes:
+        raise BulkActionError("Choose at least one change")
+
+    where = ' AND '.join(target['filters'][name] for name in filters)
+    return target, where, list(filters.values()), changes
+
+
+def preview_bulk(kind, filters, changes=None, limit=BULK_PREVIEW_ROWS):
+    """Rows a bulk action would touch: {'count': total, 'rows': the first `limit` records}"""
+    target, where, params, _ = _bulk_statement(kind, filters, changes)
+    with db_transaction() as conn:
+        count = conn.execute(
+            f"SELECT COUNT(*) FROM {target['table']} WHERE {where}", params
+        ).fetchone()[0]
+        if kind == 'signups':
+            rows = _signups(
+                conn,
+                f'''SELECT {SIGNUP_COLUMNS} FROM q_signups s
+                    WHERE {where} ORDER BY s.date, s.workout_id LIMIT ?''',
+                params + [limit]
+            )
+        else:
+            ids = {row[0] for row in conn.execute(
+                f"SELECT id FROM {target['table']} WHERE {where}", params
+            )}
+            catalog = _catalog(conn)
+            records = catalog.workouts if kind == 'workouts' else catalog.locations
+            rows = [record for record in records.values() if record.id in ids][:limit]
+    return {'count': count, 'rows': rows}
+
+
+def apply_bulk(kind, filters, changes=None, expected=None):
+    """
+    Apply a bulk action as one set-based UPDATE or DELETE in one transaction
+    With `expected` (the previewed count) nothing is changed, and
+    BulkActionError is raised, if a different number of rows matches now.
+    Returns the number of rows changed. The per-row triggers keep the rollups
+    exact, and caches keyed on the change versions (the catalog, published
+    pages) see one commit, so they are rebuilt once instead of once per row.
+    """
+    target, where, params, changes = _bulk_statement(kind, filters, changes)
+    if changes:
+        set_clause = ', '.join(f'{k} = ?' for k in changes)
+        statement = f"UPDATE {target['table']} SET {set_clause} WHERE {where}"
+        values = list(changes.values()) + params
+    else:
+        statement = f"DELETE FROM {target['table']} WHERE {where}"
+        values = params
+
+    def write(conn):
+        if expected is not None:
+            count = conn.execute(
+                f"SELECT COUNT(*) FROM {target['table']} WHERE {where}", params
+            ).fetchone()[0]
+            if count != expected:
+                raise BulkActionError(
+                    f"{count} {kind} match now but {expected} were previewed; preview again"
+                )
+        return conn.execute(statement, values).rowcount
+    return writer.execute(write)
 
-def get_coverage_stats(start_date, end_date):
-    """Get coverage statistics for a date range"""
-    # Generate all workout instances in the date range
-    workouts = get_all_workouts(active_only=True)
-    signups = get_signups_for_date_range(start_date, end_date)
 
-    # Create a set of (workout_id, date) tuples that have signups
-    covered = {(s['workout_id'], s['date']) for s in signups}
+# ==================== STATISTICS ====================
 
-    # Count total slots and covered slots
-    total_slots = 0
-    current = datetime.strptime(start_date, '%Y-%m-%d').date()
-    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+def _week_start(day):
+    """Monday of the ISO week containing day"""
+    return day - timedelta(days=day.weekday())
 
-    while current <= end:
-        day_of_week = current.weekday()
-        # Convert Python weekday (Mon=0) to our format (Sun=0)
-        db_day = (day_of_week + 1) % 7
 
-        for workout in workouts:
-            if workout['day_of_week'] == db_day:
-                total_slots += 1
+def _get_slots_by_day(conn):
+    """Active workout slots per day of week (0=Sunday), from the coverage_slots rollup"""
+    rows = conn.execute(
+        '''SELECT cs.day_of_week, SUM(cs.slots) as slots
+           FROM coverage_slots cs
+           JOIN locations l ON cs.location_id = l.id
+           WHERE l.active = 1
+           GROUP BY cs.day_of_week'''
+    ).fetchall()
+    slots = [0] * 7
+    for row in rows:
+        slots[row['day_of_week']] = row['slots']
+    return slots
+
 
-        current += timedelta(days=1)
+def get_coverage_stats(start_date, end_date):
+    """
+    Get coverage statistics for a date range
+    Reads the trigger-maintained rollups: whole ISO weeks come from
+    coverage_weekly, and only the partial weeks at either end touch q_signups.
+    """
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
 
-    covered_slots = len(covered)
+    with db_transaction() as conn:
+        slots_by_day = _get_slots_by_day(conn)
+
+        # Count total slots
+        total_slots = 0
+        current = start
+        while current <= end:
+            # Convert Python weekday (Mon=0) to our format (Sun=0)
+            total_slots += slots_by_day[(current.weekday() + 1) % 7]
+            current += timedelta(days=1)
+
+        # Whole weeks inside the range
+        first_monday = _week_start(start + timedelta(days=6))
+        last_monday = _week_start(end - timedelta(days=6))
+
+        if first_monday <= last_monday:
+            covered_slots = conn.execute(
+                '''SELECT COALESCE(SUM(covered), 0) FROM coverage_weekly
+                   WHERE week_start >= ? AND week_start <= ?''',
+                (first_monday.strftime('%Y-%m-%d'), last_monday.strftime('%Y-%m-%d'))
+            ).fetchone()[0]
+            edges = [(start, first_monday - timedelta(days=1)),
+                     (last_monday + timedelta(days=7), end)]
+        else:
+            covered_slots = 0
+            edges = [(start, end)]
+
+        # Partial weeks at either end
+        for edge_start, edge_end in edges:
+            if edge_start <= edge_end:
+                covered_slots += conn.execute(
+                    f'SELECT COUNT(*) FROM {_signups_source(edge_start.strftime("%Y-%m-%d"))} '
+                    'WHERE date >= ? AND date <= ?',
+                    (edge_start.strftime('%Y-%m-%d'), edge_end.strftime('%Y-%m-%d'))
+                ).fetchone()[0]
 
     return {
         'total_slots': total_slots,
@@ -257,6 +754,135 @@ def get_coverage_stats(start_date, end_date):
     }
 
 
+def get_weekly_coverage_trend(start_date, end_date):
+    """
+    Get per-week coverage for the ISO weeks touching a date range
+    Total slots use the current active schedule for every week.
+    """
+    start = _week_start(datetime.strptime(start_date, '%Y-%m-%d').date())
+    end = _week_start(datetime.strptime(end_date, '%Y-%m-%d').date())
+
+    with db_transaction() as conn:
+        slots_per_week = sum(_get_slots_by_day(conn))
+        rows = conn.execute(
+            '''SELECT week_start, SUM(covered) as covered
+               FROM coverage_weekly
+               WHERE week_start >= ? AND week_start <= ?
+               GROUP BY week_start''',
+            (start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+        ).fetchall()
+
+    covered_by_week = {row['week_start']: row['covered'] for row in rows}
+
+    trend = []
+    week = start
+    while week <= end:
+        week_str = week.strftime('%Y-%m-%d')
+        covered = covered_by_week.get(week_str, 0)
+        trend.append({
+            'week_start': week_str,
+            'total_slots': slots_per_week,
+            'covered_slots': covered,
+            'coverage_percent': (covered / slots_per_week * 100) if slots_per_week > 0 else 0
+        })
+        week += timedelta(weeks=1)
+    return trend
+
+
+def get_location_coverage(start_date, end_date):
+    """Get per-location covered slots for the ISO weeks touching a date range"""
+    start = _week_start(datetime.strptime(start_date, '%Y-%m-%d').date())
+    end = _week_start(datetime.strptime(end_date, '%Y-%m-%d').date())
+
+    with db_transaction() as conn:
+        return conn.execute(
+            '''SELECT l.id as location_id, l.name as location_name,
+                      COALESCE((SELECT SUM(slots) FROM coverage_slots
+                                WHERE location_id = l.id), 0) as weekly_slots,
+                      COALESCE((SELECT SUM(covered) FROM coverage_weekly
+                                WHERE location_id = l.id
+                                  AND week_start >= ? AND week_start <= ?), 0) as covered_slots
+               FROM locations l
+               WHERE l.active = 1
+               ORDER BY l.name''',
+            (start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+        ).fetchall()
+
+
+def get_coverage_by_day():
+    """Get all-time covered slots per day of week (0=Sunday)"""
+    with db_transaction() as conn:
+        rows = conn.execute(
+            '''SELECT day_of_week, SUM(covered) as covered
+               FROM coverage_dow
+               GROUP BY day_of_week
+               ORDER BY day_of_week'''
+        ).fetchall()
+        return {row['day_of_week']: row['covered'] for row in rows}
+
+
+def rebuild_coverage_rollups():
+    """Recompute the coverage rollup tables from scratch (repair tool)"""
+    with db_transaction() as conn:
+        rebuild_coverage(conn)
+
+
+def rebuild_coverage(conn):
+    """Recompute the coverage rollups inside the caller's transaction"""
+    conn.execute('DELETE FROM coverage_slots')
+    conn.execute('DELETE FROM coverage_weekly')
+    conn.execute('DELETE FROM coverage_dow')
+    conn.execute(
+        '''INSERT INTO coverage_slots (location_id, day_of_week, slots)
+           SELECT location_id, day_of_week, COUNT(*)
+           FROM workouts WHERE active = 1
+           GROUP BY location_id, day_of_week'''
+    )
+    conn.execute(
+        '''INSERT INTO coverage_weekly (location_id, week_start, covered)
+           SELECT w.location_id, date(s.date, '-6 days', 'weekday 1'), COUNT(*)
+           FROM q_signups_all s
+           JOIN workouts w ON s.workout_id = w.id
+           GROUP BY w.location_id, date(s.date, '-6 days', 'weekday 1')'''
+    )
+    conn.execute(
+        '''INSERT INTO coverage_dow (location_id, day_of_week, covered)
+           SELECT w.location_id, CAST(strftime('%w', s.date) AS INTEGER), COUNT(*)
+           FROM q_signups_all s
+           JOIN workouts w ON s.workout_id = w.id
+           GROUP BY w.location_id, CAST(strftime('%w', s.date) AS INTEGER)'''
+    )
+
+
+def get_region_coverage_stats(start_date, end_date):
+    """Get coverage statistics for every region, queried in parallel across shards"""
+    return for_each_region(get_coverage_stats, start_date, end_date)
+
+
+# ==================== CHANGE VERSIONS ====================
+
+def get_data_versions():
+    """Get the change version of each tracked table (bumped by triggers)"""
+    with db_transaction() as conn:
+        rows = conn.execute('SELECT name, version FROM data_versions').fetchall()
+        return {row['name']: row['version'] for row in rows}
+
+
+def get_signup_range_version(start_date, end_date):
+    """
+    Get a version number for the signups in a date range
+    Per-date versions only ever increase, so any change in the range moves the sum
+    """
+    with db_transaction() as conn:
+        row = conn.execute(
+            '''SELECT COALESCE(SUM(version), 0) AS version
+               FROM signup_date_versions
+               WHERE date >= ? AND date <= ?''',
+            (start_date, end_date)
+        ).fetchone()
+        return row['version']
+
+
 # ==================== UTILITY FUNCTIONS ====================
 
 def get_day_name(day_of_week):
@@ -0,0 +1,145 @@
+"""
+Request profiling
+On-demand cProfile runs of single requests for admins
+
+Add ?_profile=1 to any URL (or send an X-Profile: 1 header) while logged in
+as that region's admin, and the request runs under cProfile with every
+db_transaction timed and its statements recorded. Each profile is saved to
+PROFILE_DIR as a pstats file (python -m pstats, or snakeviz for a flame
+graph) next to a JSON summary with the SQL timings; only the newest
+PROFILE_KEEP profiles are kept. They are listed under /admin/profiles.
+
+Requests without the flag pay for one query-string lookup. Streamed bodies
+are produced after the view returns, so the profile covers the view only.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import time
+from datetime import datetime
+
+from config import get_config
+from database import start_sql_trace, stop_sql_trace
+
+config = get_config()
+
+PROFILE_ARG = '_profile'
+PROFILE_HEADER = 'X-Profile'
+
+NAME_PATTERN = re.compile(r'^[\w-]+$')
+
+
+def requested(req):
+    """Whether a request asks to be profiled (the caller checks it is an admin)"""
+    return req.args.get(PROFILE_ARG) == '1' or req.headers.get(PROFILE_HEADER) == '1'
+
+
+def flagged(environ):
+    """Cheap pre-check on a raw WSGI environ (ASGI routing)"""
+    return 'HTTP_X_PROFILE' in environ or f'{PROFILE_ARG}=' in environ.get('QUERY_STRING', '')
+
+
+# ==================== RECORDING ====================
+
+class RequestProfile:
+    """cProfile plus SQL trace for one request (start and finish on the same thread)"""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.sql, self._token = start_sql_trace()
+        self.started = time.perf_counter()
+        self.profiler.enable()
+
+    def finish(self, region, method, path, status):
+        """Stop profiling and save the profile; returns its name"""
+        self.profiler.disable()
+        total_ms = (time.perf_counter() - self.started) * 1000
+        stop_sql_trace(self._token)
+
+        now = datetime.now()
+        name = f"{now:%Y%m%d-%H%M%S-%f}-{os.getpid()}"
+        os.makedirs(config.PROFILE_DIR, exist_ok=True)
+        self.profiler.dump_stats(_path(name, '.prof'))
+        summary = {
+            'name': name,
+            'region': region,
+            'method': method,
+            'path': path,
+            'status': status,
+            'created_at': now.isoformat(timespec='seconds'),
+            'total_ms': round(total_ms, 3),
+            'sql_ms': round(sum(span['ms'] for span in self.sql), 3),
+            'statements': sum(len(span['statements']) for span in self.sql),
+            'transactions': self.sql,
+        }
+        with open(_path(name, '.json'), 'w') as f:
+            json.dump(summary, f)
+        rotate()
+        return name
+
+
+def _path(name, suffix):
+    return os.path.join(config.PROFILE_DIR, name + suffix)
+
+
+def rotate(keep=None):
+    """Delete all but the newest `keep` profiles"""
+    keep = config.PROFILE_KEEP if keep is None else keep
+    names = _names()
+    for name in names[:max(0, len(names) - keep)]:
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(_path(name, suffix))
+            except FileNotFoundError:
+                pass
+
+
+# ==================== READING ====================
+
+def _names():
+    """Saved profile names, oldest first"""
+    try:
+        files = os.listdir(config.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(f[:-5] for f in files if f.endswith('.json'))
+
+
+def list_profiles(region=None):
+    """Profile summaries (without SQL detail), newest first"""
+    profiles = []
+    for name in reversed(_names()):
+        summary = load_summary(name)
+        if summary and (region is None or summary['region'] == region):
+            del summary['transactions']
+            profiles.append(summary)
+    return profiles
+
+
+def load_summary(name):
+    """A profile's JSON summary, or None if it does not exist"""
+    if not NAME_PATTERN.match(name):
+        return None
+    try:
+        with open(_path(name, '.json')) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def stats_path(name):
+    """Path of a profile's pstats file, or None"""
+    if not NAME_PATTERN.match(name) or not os.path.exists(_path(name, '.prof')):
+        return None
+    return _path(name, '.prof')
+
+
+def top_functions(name, sort='cumulative', limit=40):
+    """pstats text report of a profile's top functions"""
+    stream = io.StringIO()
+    stats = pstats.Stats(stats_path(name), stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
@@ -0,0 +1,244 @@
+"""
+Static site publisher
+Renders the read-only pages (schedule, locations, JSON schedule) to a
+directory of static files so nginx can serve read traffic with no Python
+involved. Flask then only handles signups and admin.
+
+Publishing is incremental: each page carries a version key built from the
+trigger-maintained change versions, and only pages whose key moved are
+re-rendered. Unchanged pages are hard-linked from the previous release, and
+the new release is swapped in atomically through the `current` symlink.
+
+Usage:
+    python publish_static.py --output data/static
+    python publish_static.py --output data/static --weeks 6 --watch 30
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from app import app, get_week_bounds
+from config import get_config
+from database import region_names, use_region
+import models
+
+config = get_config()
+
+MANIFEST_NAME = 'manifest.json'
+
+Page = namedtuple('Page', ['url', 'path', 'version'])
+
+
+def collect_pages(weeks=4):
+    """List every publishable page of the current region with its version key"""
+    today = date.today()
+    today_str = today.strftime('%Y-%m-%d')
+    versions = models.get_data_versions()
+    catalog = f"{versions.get('locations', 0)}.{versions.get('workouts', 0)}"
+
+    pages = []
+
+    # Current week plus the next N weeks (HTML and JSON)
+    for offset in range(weeks + 1):
+        _, monday, sunday = get_week_bounds(offset)
+        signups = models.get_signup_range_version(
+            monday.strftime('%Y-%m-%d'),
+            sunday.strftime('%Y-%m-%d')
+        )
+        version = f'{today_str}:{catalog}:{signups}'
+        if offset == 0:
+            pages.append(Page('/', 'index.html', version))
+        else:
+            pages.append(Page(f'/schedule/week/{offset}',
+                              f'schedule/week/{offset}/index.html', version))
+        pages.append(Page(f'/api/schedule/week/{offset}',
+                          f'api/schedule/week/{offset}.json', version))
+
+    # Locations list and each location's next 4 weeks
+    pages.append(Page('/locations', 'locations/index.html', catalog))
+
+    upcoming = models.get_signup_range_version(
+        today_str,
+        (today + timedelta(days=28)).strftime('%Y-%m-%d')
+    )
+    for location in models.get_all_locations(active_only=True):
+        pages.append(Page(f"/location/{location['id']}",
+                          f"location/{location['id']}/index.html",
+                          f'{today_str}:{catalog}:{upcoming}'))
+
+    return pages
+
+
+def _render(client, page, region):
+    """Render one page through the Flask app"""
+    if config.REGION_ROUTING == 'subdomain':
+        response = client.get(page.url, headers={'Host': f'{region}.localhost'})
+    elif len(region_names()) > 1:
+        response = client.get(f'/{region}{page.url}')
+    else:
+        response = client.get(page.url)
+
+    if response.status_code != 200:
+        raise RuntimeError(f'{page.url} returned {response.status_code}')
+    return response.get_data()
+
+
+def _load_manifest(release):
+    """Read a release's page -> version manifest"""
+    if release is None:
+        return {}
+    try:
+        with open(release / MANIFEST_NAME, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _link_or_copy(src, dst):
+    """Reuse an unchanged file from the previous release"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _swap_current(output_dir, release):
+    """Atomically point output_dir/current at a release"""
+    current = output_dir / 'current'
+    tmp_link = output_dir / 'current.tmp'
+    if tmp_link.is_symlink() or tmp_link.exists():
+        tmp_link.unlink()
+    os.symlink(os.path.relpath(release, output_dir), tmp_link)
+    os.replace(tmp_link, current)
+
+
+def _prune_releases(output_dir, keep):
+    """Remove old releases, always keeping the live one and any build in progress"""
+    releases_dir = output_dir / 'releases'
+    live = (output_dir / 'current').resolve()
+    releases = sorted(p for p in releases_dir.iterdir()
+                      if p.is_dir() and not p.name.endswith('.tmp'))
+    for release in releases[:-keep] if keep > 0 else []:
+        if release.resolve() != live:
+            shutil.rmtree(release, ignore_errors=True)
+
+
+def publish_region(region, output_dir, weeks=4, keep=3, force=False):
+    """
+    Publish one region's pages into output_dir
+    Returns the number of pages re-rendered (0 when nothing changed)
+    """
+    output_dir = Path(output_dir)
+    (output_dir / 'releases').mkdir(parents=True, exist_ok=True)
+
+    current = output_dir / 'current'
+    previous = current.resolve() if current.exists() else None
+    old_manifest = _load_manifest(previous)
+
+    with use_region(region):
+        pages = collect_pages(weeks)
+
+    changed = [
+        page for page in pages
+        if force or previous is None or old_manifest.get(page.path) != page.version
+    ]
+    removed = set(old_manifest) - {page.path for page in pages}
+
+    if not changed and not removed:
+        return 0
+
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    release = output_dir / 'releases' / stamp
+    build_dir = output_dir / 'releases' / f'.{stamp}.tmp'
+    build_dir.mkdir()
+
+    try:
+        client = app.test_client()
+        changed_paths = {page.path for page in changed}
+        for page in pages:
+            target = build_dir / page.path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if page.path in changed_paths:
+                target.write_bytes(_render(client, page, region))
+            else:
+                _link_or_copy(previous / page.path, target)
+
+        with open(build_dir / MANIFEST_NAME, 'w') as f:
+            json.dump({page.path: page.version for page in pages}, f, indent=2)
+
+        os.rename(build_dir, release)
+    except Exception:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+    _swap_current(output_dir, release)
+    _prune_releases(output_dir, keep)
+
+    return len(changed)
+
+
+def publish(output_dir, weeks=4, keep=3, force=False):
+    """Publish every region (each into its own subdirectory when there are several)"""
+    output_dir = Path(output_dir)
+    regions = region_names()
+    results = {}
+    for region in regions:
+        target = output_dir / region if len(regions) > 1 else output_dir
+        results[region] = publish_region(region, target, weeks, keep, force)
+    return results
+
+
+def _change_state():
+    """Cheap snapshot of everything that can invalidate a published page"""
+    state = {}
+    for region in region_names():
+        with use_region(region):
+            state[region] = models.get_data_versions()
+    return date.today(), state
+
+
+def watch(output_dir, interval, weeks=4, keep=3):
+    """Poll the change versions and republish whenever data (or the date) changes"""
+    last_state = None
+    while True:
+        state = _change_state()
+        if state != last_state:
+            results = publish(output_dir, weeks, keep)
+            rendered = sum(results.values())
+            if rendered:
+                print(f"{datetime.now():%Y-%m-%d %H:%M:%S} Published {rendered} pages")
+            last_state = state
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Publish static schedule pages')
+    parser.add_argument('--output', required=True, help='Output directory')
+    parser.add_argument('--weeks', type=int, default=4,
+                        help='Number of weeks after the current week (default: 4)')
+    parser.add_argument('--keep', type=int, default=3,
+                        help='Number of releases to keep (default: 3)')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-render every page')
+    parser.add_argument('--watch', type=int, metavar='SECONDS',
+                        help='Keep running and republish on data changes')
+    args = parser.parse_args(argv)
+
+    if args.watch:
+        watch(args.output, args.watch, args.weeks, args.keep)
+        return 0
+
+    results = publish(args.output, args.weeks, args.keep, args.force)
+    for region, rendered in results.items():
+        print(f"{region}: {rendered} pages rendered")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
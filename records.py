@@ -0,0 +1,245 @@
+"""
+Result records
+Compact __slots__ objects for locations, workouts and signups
+
+A signup references its Workout, and a workout its Location, instead of
+repeating their columns on every row, so a long date range costs one small
+object per signup. Repeated strings (AO names, addresses, times, workout
+types, Q names) are interned. Records support both attribute and item
+access (record.q_name, record['q_name']) and dict(record), so templates and
+older callers keep working, and they serialize straight to JSON text
+without building intermediate dicts.
+"""
+import csv
+import io
+import sys
+from json import dumps
+from json.encoder import encode_basestring_ascii
+
+
+class Record:
+    """Base class: stored columns in _fields, delegated read-only attributes in _derived"""
+
+    __slots__ = ()
+    _fields = ()
+    _derived = ()
+    _json_keys = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Sorted like jsonify() output, with the "key": prefix encoded once
+        cls._json_keys = tuple((name, f'{encode_basestring_ascii(name)}:')
+                               for name in sorted(cls._fields + cls._derived))
+
+    def __init__(self, *values):
+        for name, value in zip(self._fields, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(cls, row):
+        """Build a record from a sqlite3.Row (or any mapping) with these columns"""
+        return cls(*(row[name] for name in cls._fields))
+
+    def keys(self):
+        return self._fields + self._derived
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __contains__(self, key):
+        return key in self._fields or key in self._derived
+
+    def __eq__(self, other):
+        return (type(self) is type(other)
+                and all(self[name] == other[name] for name in self._fields))
+
+    __hash__ = None
+
+    def __repr__(self):
+        pairs = ', '.join(f'{name}={getattr(self, name)!r}' for name in self._fields[:4])
+        return f'<{type(self).__name__} {pairs}>'
+
+    def to_json(self):
+        """JSON object text for this record (no intermediate dict)"""
+        return '{' + ','.join(prefix + encode_value(getattr(self, name))
+                              for name, prefix in self._json_keys) + '}'
+
+
+def encode_value(value):
+    """Encode one scalar column value as JSON text"""
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, Record):
+        return value.to_json()
+    return dumps(value, separators=(',', ':'), sort_keys=True)
+
+
+def to_json(records):
+    """JSON array text for a sequence of records"""
+    return '[' + ','.join(record.to_json() for record in records) + ']'
+
+
+def iter_json_array(records, chunk_size=200):
+    """Yield a JSON array's text in chunks of records (constant memory)"""
+    yield '['
+    first = True
+    chunk = []
+    for record in records:
+        chunk.append(record.to_json())
+        if len(chunk) >= chunk_size:
+            yield ('' if first else ',') + ','.join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield ('' if first else ',') + ','.join(chunk)
+    yield ']\n'
+
+
+def iter_ndjson(records, chunk_size=200):
+    """Yield newline-delimited JSON (one record per line) in chunks"""
+    chunk = []
+    for record in records:
+        chunk.append(record.to_json())
+        if len(chunk) >= chunk_size:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+def iter_csv(records, fields, chunk_size=200):
+    """Yield CSV text (header row first) in chunks of records"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    count = 0
+    for record in records:
+        writer.writerow([getattr(record, name) for name in fields])
+        count += 1
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def intern(value):
+    """Intern a string column value (other values pass through)"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+# ==================== RECORDS ====================
+
+class Location(Record):
+    __slots__ = ('id', 'name', 'address', 'region', 'latitude', 'longitude',
+                 'active', 'created_at', 'updated_at')
+    _fields = __slots__
+
+    def __init__(self, id, name, address, region, latitude, longitude,
+                 active, created_at, updated_at):
+        self.id = id
+        self.name = intern(name)
+        self.address = intern(address)
+        self.region = intern(region)
+        self.latitude = latitude
+        self.longitude = longitude
+        self.active = active
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+
+class Workout(Record):
+    __slots__ = ('id', 'location_id', 'day_of_week', 'time', 'workout_type',
+                 'active', 'created_at', 'updated_at', 'location')
+    _fields = __slots__[:-1]
+    _derived = ('location_name', 'address')
+
+    def __init__(self, id, location_id, day_of_week, time, workout_type,
+                 active, created_at, updated_at, location=None):
+        self.id = id
+        self.location_id = location_id
+        self.day_of_week = day_of_week
+        self.time = intern(time)
+        self.workout_type = intern(workout_type)
+        self.active = active
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.location = location
+
+    @property
+    def location_name(self):
+        return self.location.name if self.location else None
+
+    @property
+    def address(self):
+        return self.location.address if self.location else None
+
+
+class Signup(Record):
+    __slots__ = ('id', 'workout_id', 'date', 'q_name', 'q_email', 'notes',
+                 'reminded', 'created_at', 'updated_at', 'workout')
+    _fields = __slots__[:-1]
+    _derived = ('day_of_week', 'time', 'workout_type', 'location_id',
+                'location_name', 'address')
+
+    def __init__(self, id, workout_id, date, q_name, q_email, notes,
+                 reminded, created_at, updated_at, workout=None):
+        self.id = id
+        self.workout_id = workout_id
+        self.date = intern(date)
+        self.q_name = intern(q_name)
+        self.q_email = q_email
+        self.notes = notes
+        self.reminded = reminded
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.workout = workout
+
+    @property
+    def day_of_week(self):
+        return self.workout.day_of_week if self.workout else None
+
+    @property
+    def time(self):
+        return self.workout.time if self.workout else None
+
+    @property
+    def workout_type(self):
+        return self.workout.workout_type if self.workout else None
+
+    @property
+    def location_id(self):
+        return self.workout.location_id if self.workout else None
+
+    @property
+    def location_name(self):
+        return self.workout.location_name if self.workout else None
+
+    @property
+    def address(self):
+        return self.workout.address if self.workout else None
+
+
+class Slot(Record):
+    """One workout on one day of a schedule, with its signup if taken"""
+    __slots__ = ('workout', 'signup', 'date')
+    _fields = __slots__
+
+    def __init__(self, workout, signup, date):
+        self.workout = workout
+        self.signup = signup
+        self.date = date
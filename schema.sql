@@ -1,5 +1,8 @@
 -- F3 Q-Sheet Database Schema
 -- Optimized for speed and simplicity
+--
+-- This is migration 1 (the baseline). Later schema changes are numbered
+-- migrations in migrations.py; do not edit this file for them.
 
 -- Locations table (AO = Area of Operation in F3 terminology)
 CREATE TABLE IF NOT EXISTS locations (
@@ -51,6 +54,107 @@ CREATE TABLE IF NOT EXISTS settings (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Archived (cold) Q sign-ups, moved out of q_signups by archive.py
+CREATE TABLE IF NOT EXISTS q_signups_archive (
+    id INTEGER PRIMARY KEY, -- Same id as in q_signups
+    workout_id INTEGER NOT NULL,
+    date DATE NOT NULL,
+    q_name TEXT NOT NULL,
+    q_email TEXT,
+    notes TEXT,
+    reminded BOOLEAN DEFAULT 0,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- All sign-ups, live and archived (read by history queries)
+CREATE VIEW IF NOT EXISTS q_signups_all AS
+    SELECT id, workout_id, date, q_name, q_email, notes, reminded, created_at, updated_at
+    FROM q_signups
+    UNION ALL
+    SELECT id, workout_id, date, q_name, q_email, notes, reminded, created_at, updated_at
+    FROM q_signups_archive;
+
+-- Guards set inside a transaction to silence triggers (e.g. while archiving)
+CREATE TABLE IF NOT EXISTS trigger_guards (
+    name TEXT PRIMARY KEY
+);
+
+-- Change versions (bumped by triggers, used to invalidate caches and static pages)
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY, -- Table name: locations, workouts, q_signups
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+-- Per-date signup versions, so a page covering a date range can tell if it changed
+CREATE TABLE IF NOT EXISTS signup_date_versions (
+    date DATE PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+-- Coverage rollups (maintained by triggers, read by the admin dashboard)
+-- Active workout slots per location and day of week
+CREATE TABLE IF NOT EXISTS coverage_slots (
+    location_id INTEGER NOT NULL,
+    day_of_week INTEGER NOT NULL, -- 0=Sunday, 1=Monday, ..., 6=Saturday
+    slots INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (location_id, day_of_week)
+) WITHOUT ROWID;
+
+-- Covered slots (signups) per location per ISO week
+CREATE TABLE IF NOT EXISTS coverage_weekly (
+    location_id INTEGER NOT NULL,
+    week_start DATE NOT NULL, -- Monday of the ISO week (YYYY-MM-DD)
+    covered INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (location_id, week_start)
+) WITHOUT ROWID;
+
+-- Covered slots (signups) per location per day of week, all time
+CREATE TABLE IF NOT EXISTS coverage_dow (
+    location_id INTEGER NOT NULL,
+    day_of_week INTEGER NOT NULL,
+    covered INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (location_id, day_of_week)
+) WITHOUT ROWID;
+
+-- Q analytics snapshots (refreshed incrementally by analytics.py)
+-- One row per normalized Q identity with precomputed leaderboard stats
+CREATE TABLE IF NOT EXISTS q_identities (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    display_name TEXT NOT NULL, -- Most recently used name
+    email TEXT, -- Most recently used email
+    total_qs INTEGER NOT NULL DEFAULT 0,
+    first_q_date DATE,
+    last_q_date DATE,
+    longest_streak INTEGER NOT NULL DEFAULT 0, -- Consecutive ISO weeks with a Q
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Normalized names and emails that resolve to an identity
+CREATE TABLE IF NOT EXISTS q_identity_aliases (
+    alias TEXT PRIMARY KEY, -- 'name:<lower(trim(q_name))>' or 'email:<lower(trim(q_email))>'
+    identity_id INTEGER NOT NULL,
+    FOREIGN KEY (identity_id) REFERENCES q_identities(id) ON DELETE CASCADE
+);
+
+-- Qs per identity per AO
+CREATE TABLE IF NOT EXISTS q_identity_locations (
+    identity_id INTEGER NOT NULL,
+    location_id INTEGER NOT NULL,
+    q_count INTEGER NOT NULL DEFAULT 0,
+    last_q_date DATE,
+    PRIMARY KEY (identity_id, location_id),
+    FOREIGN KEY (identity_id) REFERENCES q_identities(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- Names/emails whose signups changed since the last refresh (filled by triggers)
+CREATE TABLE IF NOT EXISTS q_analytics_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name_key TEXT,
+    email_key TEXT
+);
+
 -- Indexes for performance
 CREATE INDEX IF NOT EXISTS idx_workouts_location ON workouts(location_id);
 CREATE INDEX IF NOT EXISTS idx_workouts_day ON workouts(day_of_week);
@@ -59,6 +163,17 @@ CREATE INDEX IF NOT EXISTS idx_signups_date ON q_signups(date);
 CREATE INDEX IF NOT EXISTS idx_signups_reminded ON q_signups(reminded);
 CREATE INDEX IF NOT EXISTS idx_locations_active ON locations(active);
 CREATE INDEX IF NOT EXISTS idx_workouts_active ON workouts(active);
+CREATE INDEX IF NOT EXISTS idx_signups_q_name ON q_signups(lower(trim(q_name)));
+CREATE INDEX IF NOT EXISTS idx_signups_q_email ON q_signups(lower(trim(q_email)));
+CREATE INDEX IF NOT EXISTS idx_archive_date ON q_signups_archive(date);
+CREATE INDEX IF NOT EXISTS idx_archive_workout_date ON q_signups_archive(workout_id, date);
+CREATE INDEX IF NOT EXISTS idx_archive_q_name ON q_signups_archive(lower(trim(q_name)));
+CREATE INDEX IF NOT EXISTS idx_archive_q_email ON q_signups_archive(lower(trim(q_email)));
+CREATE INDEX IF NOT EXISTS idx_identities_total ON q_identities(total_qs DESC);
+CREATE INDEX IF NOT EXISTS idx_identities_streak ON q_identities(longest_streak DESC);
+CREATE INDEX IF NOT EXISTS idx_identities_first ON q_identities(first_q_date);
+CREATE INDEX IF NOT EXISTS idx_identity_aliases_identity ON q_identity_aliases(identity_id);
+CREATE INDEX IF NOT EXISTS idx_identity_locations_count ON q_identity_locations(location_id, q_count DESC);
 
 -- Default settings
 INSERT OR IGNORE INTO settings (key, value, description) VALUES
@@ -75,6 +190,39 @@ INSERT OR IGNORE INTO settings (key, value, description) VALUES
     ('smtp_from_email', '', 'From email address'),
     ('smtp_from_name', 'F3 Q-Sheet', 'From display name');
 
+INSERT OR IGNORE INTO data_versions (name, version) VALUES
+    ('locations', 0),
+    ('workouts', 0),
+    ('q_signups', 0);
+
+-- Queue every existing Q for the first analytics refresh
+INSERT INTO q_analytics_queue (name_key, email_key)
+SELECT DISTINCT lower(trim(q_name)), lower(trim(q_email))
+FROM q_signups_all
+WHERE NOT EXISTS (SELECT 1 FROM q_identities)
+  AND NOT EXISTS (SELECT 1 FROM q_analytics_queue);
+
+-- Backfill coverage rollups for databases created before they existed
+INSERT INTO coverage_slots (location_id, day_of_week, slots)
+SELECT location_id, day_of_week, COUNT(*)
+FROM workouts
+WHERE active = 1 AND NOT EXISTS (SELECT 1 FROM coverage_slots)
+GROUP BY location_id, day_of_week;
+
+INSERT INTO coverage_weekly (location_id, week_start, covered)
+SELECT w.location_id, date(s.date, '-6 days', 'weekday 1'), COUNT(*)
+FROM q_signups s
+JOIN workouts w ON s.workout_id = w.id
+WHERE NOT EXISTS (SELECT 1 FROM coverage_weekly)
+GROUP BY w.location_id, date(s.date, '-6 days', 'weekday 1');
+
+INSERT INTO coverage_dow (location_id, day_of_week, covered)
+SELECT w.location_id, CAST(strftime('%w', s.date) AS INTEGER), COUNT(*)
+FROM q_signups s
+JOIN workouts w ON s.workout_id = w.id
+WHERE NOT EXISTS (SELECT 1 FROM coverage_dow)
+GROUP BY w.location_id, CAST(strftime('%w', s.date) AS INTEGER);
+
 -- Trigger to update updated_at timestamp
 CREATE TRIGGER IF NOT EXISTS update_locations_timestamp
     AFTER UPDATE ON locations
@@ -99,3 +247,239 @@ CREATE TRIGGER IF NOT EXISTS update_settings_timestamp
 BEGIN
     UPDATE settings SET updated_at = CURRENT_TIMESTAMP WHERE key = NEW.key;
 END;
+
+-- Triggers to bump change versions
+CREATE TRIGGER IF NOT EXISTS version_locations_insert
+    AFTER INSERT ON locations
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'locations';
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_locations_update
+    AFTER UPDATE OF name, address, region, latitude, longitude, active ON locations
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'locations';
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_locations_delete
+    AFTER DELETE ON locations
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'locations';
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_workouts_insert
+    AFTER INSERT ON workouts
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'workouts';
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_workouts_update
+    AFTER UPDATE OF location_id, day_of_week, time, workout_type, active ON workouts
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'workouts';
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_workouts_delete
+    AFTER DELETE ON workouts
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'workouts';
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_signups_insert
+    AFTER INSERT ON q_signups
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'q_signups';
+    INSERT INTO signup_date_versions (date, version) VALUES (NEW.date, 1)
+        ON CONFLICT(date) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_signups_update
+    AFTER UPDATE OF workout_id, date, q_name, q_email, notes, reminded ON q_signups
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'q_signups';
+    INSERT INTO signup_date_versions (date, version) VALUES (OLD.date, 1)
+        ON CONFLICT(date) DO UPDATE SET version = version + 1;
+    INSERT INTO signup_date_versions (date, version) VALUES (NEW.date, 1)
+        ON CONFLICT(date) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_signups_delete
+    AFTER DELETE ON q_signups
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'q_signups';
+    INSERT INTO signup_date_versions (date, version) VALUES (OLD.date, 1)
+        ON CONFLICT(date) DO UPDATE SET version = version + 1;
+END;
+
+-- Triggers to maintain coverage rollups
+CREATE TRIGGER IF NOT EXISTS coverage_signups_insert
+    AFTER INSERT ON q_signups
+BEGIN
+    INSERT INTO coverage_weekly (location_id, week_start, covered)
+    SELECT location_id, date(NEW.date, '-6 days', 'weekday 1'), 1
+    FROM workouts WHERE id = NEW.workout_id
+    ON CONFLICT(location_id, week_start) DO UPDATE SET covered = covered + 1;
+
+    INSERT INTO coverage_dow (location_id, day_of_week, covered)
+    SELECT location_id, CAST(strftime('%w', NEW.date) AS INTEGER), 1
+    FROM workouts WHERE id = NEW.workout_id
+    ON CONFLICT(location_id, day_of_week) DO UPDATE SET covered = covered + 1;
+END;
+
+-- Skipped when the workout itself is being deleted (coverage_workouts_delete handles it)
+-- and when the signup is only moving to the archive
+CREATE TRIGGER IF NOT EXISTS coverage_signups_delete
+    AFTER DELETE ON q_signups
+    WHEN EXISTS (SELECT 1 FROM workouts WHERE id = OLD.workout_id)
+     AND NOT EXISTS (SELECT 1 FROM trigger_guards WHERE name = 'archiving')
+BEGIN
+    UPDATE coverage_weekly SET covered = covered - 1
+    WHERE location_id = (SELECT location_id FROM workouts WHERE id = OLD.workout_id)
+      AND week_start = date(OLD.date, '-6 days', 'weekday 1');
+
+    UPDATE coverage_dow SET covered = covered - 1
+    WHERE location_id = (SELECT location_id FROM workouts WHERE id = OLD.workout_id)
+      AND day_of_week = CAST(strftime('%w', OLD.date) AS INTEGER);
+END;
+
+CREATE TRIGGER IF NOT EXISTS coverage_signups_update
+    AFTER UPDATE OF workout_id, date ON q_signups
+BEGIN
+    UPDATE coverage_weekly SET covered = covered - 1
+    WHERE location_id = (SELECT location_id FROM workouts WHERE id = OLD.workout_id)
+      AND week_start = date(OLD.date, '-6 days', 'weekday 1');
+
+    UPDATE coverage_dow SET covered = covered - 1
+    WHERE location_id = (SELECT location_id FROM workouts WHERE id = OLD.workout_id)
+      AND day_of_week = CAST(strftime('%w', OLD.date) AS INTEGER);
+
+    INSERT INTO coverage_weekly (location_id, week_start, covered)
+    SELECT location_id, date(NEW.date, '-6 days', 'weekday 1'), 1
+    FROM workouts WHERE id = NEW.workout_id
+    ON CONFLICT(location_id, week_start) DO UPDATE SET covered = covered + 1;
+
+    INSERT INTO coverage_dow (location_id, day_of_week, covered)
+    SELECT location_id, CAST(strftime('%w', NEW.date) AS INTEGER), 1
+    FROM workouts WHERE id = NEW.workout_id
+    ON CONFLICT(location_id, day_of_week) DO UPDATE SET covered = covered + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS coverage_workouts_insert
+    AFTER INSERT ON workouts
+    WHEN NEW.active = 1
+BEGIN
+    INSERT INTO coverage_slots (location_id, day_of_week, slots)
+    VALUES (NEW.location_id, NEW.day_of_week, 1)
+    ON CONFLICT(location_id, day_of_week) DO UPDATE SET slots = slots + 1;
+END;
+
+-- Runs before the cascade removes the workout's signups
+CREATE TRIGGER IF NOT EXISTS coverage_workouts_delete
+    BEFORE DELETE ON workouts
+BEGIN
+    UPDATE coverage_slots SET slots = slots - 1
+    WHERE OLD.active = 1
+      AND location_id = OLD.location_id AND day_of_week = OLD.day_of_week;
+
+    UPDATE coverage_weekly SET covered = covered - (
+        SELECT COUNT(*) FROM q_signups s
+        WHERE s.workout_id = OLD.id
+          AND date(s.date, '-6 days', 'weekday 1') = coverage_weekly.week_start
+    )
+    WHERE location_id = OLD.location_id;
+
+    UPDATE coverage_dow SET covered = covered - (
+        SELECT COUNT(*) FROM q_signups s
+        WHERE s.workout_id = OLD.id
+          AND CAST(strftime('%w', s.date) AS INTEGER) = coverage_dow.day_of_week
+    )
+    WHERE location_id = OLD.location_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS coverage_workouts_update_slots
+    AFTER UPDATE OF location_id, day_of_week, active ON workouts
+BEGIN
+    UPDATE coverage_slots SET slots = slots - 1
+    WHERE OLD.active = 1
+      AND location_id = OLD.location_id AND day_of_week = OLD.day_of_week;
+
+    INSERT INTO coverage_slots (location_id, day_of_week, slots)
+    SELECT NEW.location_id, NEW.day_of_week, 1
+    WHERE NEW.active = 1
+    ON CONFLICT(location_id, day_of_week) DO UPDATE SET slots = slots + 1;
+END;
+
+-- Moving a workout to another location moves its signup counts with it
+CREATE TRIGGER IF NOT EXISTS coverage_workouts_update_location
+    AFTER UPDATE OF location_id ON workouts
+    WHEN OLD.location_id != NEW.location_id
+BEGIN
+    UPDATE coverage_weekly SET covered = covered - (
+        SELECT COUNT(*) FROM q_signups s
+        WHERE s.workout_id = NEW.id
+          AND date(s.date, '-6 days', 'weekday 1') = coverage_weekly.week_start
+    )
+    WHERE location_id = OLD.location_id;
+
+    UPDATE coverage_dow SET covered = covered - (
+        SELECT COUNT(*) FROM q_signups s
+        WHERE s.workout_id = NEW.id
+          AND CAST(strftime('%w', s.date) AS INTEGER) = coverage_dow.day_of_week
+    )
+    WHERE location_id = OLD.location_id;
+
+    INSERT INTO coverage_weekly (location_id, week_start, covered)
+    SELECT NEW.location_id, date(s.date, '-6 days', 'weekday 1'), COUNT(*)
+    FROM q_signups s
+    WHERE s.workout_id = NEW.id
+    GROUP BY date(s.date, '-6 days', 'weekday 1')
+    ON CONFLICT(location_id, week_start) DO UPDATE SET covered = covered + excluded.covered;
+
+    INSERT INTO coverage_dow (location_id, day_of_week, covered)
+    SELECT NEW.location_id, CAST(strftime('%w', s.date) AS INTEGER), COUNT(*)
+    FROM q_signups s
+    WHERE s.workout_id = NEW.id
+    GROUP BY CAST(strftime('%w', s.date) AS INTEGER)
+    ON CONFLICT(location_id, day_of_week) DO UPDATE SET covered = covered + excluded.covered;
+END;
+
+CREATE TRIGGER IF NOT EXISTS coverage_locations_delete
+    AFTER DELETE ON locations
+BEGIN
+    DELETE FROM coverage_slots WHERE location_id = OLD.id;
+    DELETE FROM coverage_weekly WHERE location_id = OLD.id;
+    DELETE FROM coverage_dow WHERE location_id = OLD.id;
+END;
+
+-- Triggers to queue analytics refreshes
+CREATE TRIGGER IF NOT EXISTS analytics_signups_insert
+    AFTER INSERT ON q_signups
+BEGIN
+    INSERT INTO q_analytics_queue (name_key, email_key)
+    VALUES (lower(trim(NEW.q_name)), lower(trim(NEW.q_email)));
+END;
+
+CREATE TRIGGER IF NOT EXISTS analytics_signups_update
+    AFTER UPDATE OF q_name, q_email, workout_id, date ON q_signups
+BEGIN
+    INSERT INTO q_analytics_queue (name_key, email_key)
+    VALUES (lower(trim(OLD.q_name)), lower(trim(OLD.q_email))),
+           (lower(trim(NEW.q_name)), lower(trim(NEW.q_email)));
+END;
+
+CREATE TRIGGER IF NOT EXISTS analytics_signups_delete
+    AFTER DELETE ON q_signups
+    WHEN NOT EXISTS (SELECT 1 FROM trigger_guards WHERE name = 'archiving')
+BEGIN
+    INSERT INTO q_analytics_queue (name_key, email_key)
+    VALUES (lower(trim(OLD.q_name)), lower(trim(OLD.q_email)));
+END;
+
+CREATE TRIGGER IF NOT EXISTS analytics_workouts_update_location
+    AFTER UPDATE OF location_id ON workouts
+    WHEN OLD.location_id != NEW.location_id
+BEGIN
+    INSERT INTO q_analytics_queue (name_key, email_key)
+    SELECT DISTINCT lower(trim(q_name)), lower(trim(q_email))
+    FROM q_signups WHERE workout_id = NEW.id;
+END;
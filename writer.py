@@ -0,0 +1,232 @@
+"""
+Write queue
+Funnels each process's SQLite writes through one writer thread per region
+
+Callers hand the writer a function that takes a connection. The writer
+drains whatever writes are waiting into a single IMMEDIATE transaction
+(group commit: one fsync and one lock acquisition for the whole batch). Each
+write runs inside its own SAVEPOINT, so a write that raises is rolled back on
+its own and its exception goes back to its caller while the rest of the
+batch commits.
+
+Across gunicorn processes the writers take turns through an exclusive lock
+on a <database>.write-lock file, so they queue on the lock instead of
+spinning on SQLITE_BUSY. Writers that bypass the queue (CLI tools,
+background jobs) still get DB_BUSY_TIMEOUT_MS from every connection, and
+a batch that hits "database is locked" is retried with backoff.
+"""
+import sqlite3
+import threading
+import time
+import queue
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # Windows: rely on SQLite's busy timeout alone
+    fcntl = None
+
+from config import get_config
+from database import db_transaction, get_shard, record_sql, tracing_sql
+
+config = get_config()
+
+RETRY_BASE_DELAY = 0.01  # Seconds; doubles on each retry
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+# ==================== PROCESS LOCK ====================
+
+class ProcessLock:
+    """Exclusive flock on a lock file next to the database (one writer process at a time)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self, timeout):
+        if fcntl is None or self.path is None:  # In-memory databases have no file to lock
+            return
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise sqlite3.OperationalError('database is locked (write lock timeout)')
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+
+# ==================== WRITER ====================
+
+class Writer(threading.Thread):
+    """Single writer thread for one shard"""
+
+    def __init__(self, shard):
+        super().__init__(name=f'qsheet-writer-{shard.region}', daemon=True)
+        self.shard = shard
+        self.queue = queue.Queue()
+        self.lock = ProcessLock(shard.storage.lock_path)
+        self.batches = 0
+        self.writes = 0
+        self._conn = None
+
+    def submit(self, func, args, kwargs):
+        future = Future()
+        self.queue.put((func, args, kwargs, future))
+        return future
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            # Give writes arriving at the same moment a chance to join the batch
+            deadline = time.monotonic() + config.WRITE_BATCH_WAIT_MS / 1000
+            while len(batch) < config.WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+            if batch:
+                self._commit_batch(batch)
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self.shard.connect()
+        return self._conn
+
+    def _commit_batch(self, batch):
+        """Run a batch in one transaction, retrying the whole batch while the database is busy"""
+        timeout = config.DB_BUSY_TIMEOUT_MS / 1000
+        for attempt in range(config.WRITE_RETRIES + 1):
+            try:
+                self.lock.acquire(timeout)
+                try:
+                    results = self._run_batch(batch)
+                finally:
+                    self.lock.release()
+                break
+            except sqlite3.OperationalError as e:
+                self._reset_connection()
+                if not _is_busy(e) or attempt == config.WRITE_RETRIES:
+                    for *_, future in batch:
+                        future.set_exception(e)
+                    return
+                time.sleep(RETRY_BASE_DELAY * 2 ** attempt)
+            except Exception as e:
+                self._reset_connection()
+                for *_, future in batch:
+                    future.set_exception(e)
+                return
+
+        self.batches += 1
+        self.writes += len(batch)
+        for (*_, future), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _run_batch(self, batch):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        results = []
+        try:
+            for func, args, kwargs, _ in batch:
+                conn.execute('SAVEPOINT write')
+                try:
+                    value = func(conn, *args, **kwargs)
+                except sqlite3.OperationalError as e:
+                    if _is_busy(e):
+                        raise  # Retry the whole batch
+                    conn.execute('ROLLBACK TO write')
+                    results.append((False, e))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write')
+                    results.append((False, e))
+                else:
+                    results.append((True, value))
+                conn.execute('RELEASE write')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return results
+
+    def _reset_connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.rollback()
+            except sqlite3.Error:
+                self._conn.close()
+                self._conn = None
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(shard=None):
+    """Writer thread for a shard (started on first use)"""
+    shard = shard or get_shard()
+    writer = _writers.get(shard.region)
+    if writer is None or not writer.is_alive():
+        with _writers_lock:
+            writer = _writers.get(shard.region)
+            if writer is None or not writer.is_alive():
+                writer = Writer(shard)
+                _writers[shard.region] = writer
+                writer.start()
+    return writer
+
+
+# ==================== PUBLIC API ====================
+
+def submit(func, *args, **kwargs):
+    """
+    Queue func(conn, *args, **kwargs) on the current region's writer
+    Returns a Future with the function's result (or exception).
+    """
+    return get_writer().submit(func, args, kwargs)
+
+
+def execute(func, *args, **kwargs):
+    """Run a write through the queue and wait for its result"""
+    if not config.WRITE_QUEUE_ENABLED:
+        with db_transaction() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            return func(conn, *args, **kwargs)
+    writer = get_writer()
+    if threading.current_thread() is writer:
+        # A write issued from inside a write joins the open transaction
+        return func(writer._connection(), *args, **kwargs)
+    if tracing_sql():
+        # The batch runs on the writer thread: time it (queue wait included) from here
+        started = time.perf_counter()
+        try:
+            return writer.submit(func, args, kwargs).result()
+        finally:
+            record_sql(getattr(func, '__qualname__', 'write'), started, ['(write queue)'])
+    return writer.submit(func, args, kwargs).result()
+
+
+def get_stats():
+    """Batches and writes committed by each region's writer in this process"""
+    return {
+        region: {'batches': writer.batches, 'writes': writer.writes,
+                 'queued': writer.queue.qsize()}
+        for region, writer in _writers.items()
+    }